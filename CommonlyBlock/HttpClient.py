@@ -0,0 +1,512 @@
+'''
+基于asyncio的HTTP/1.1客户端，替代Urllib.py里每次urlopen都新建连接、整个body读进内存的用法:
+
+    client = HTTPClient(per_host=6, cache_dir='.http_cache')
+    async with await client.get('https://api.douban.com/v2/book/2129650') as resp:
+        async for chunk in resp.iter_chunks():
+            ...
+    await client.close()
+
+- 每个host一个keep-alive连接池，空闲连接复用，省掉重复的TCP/TLS握手
+- 每个host和全局都有并发上限，超出的请求排队等待连接
+- body按块流式读取，读完后连接自动回到池里
+- GET响应缓存在磁盘上，按Cache-Control/Expires判断新鲜度，过期后带ETag/Last-Modified做条件请求，304时直接用缓存的body
+
+直接运行本文件会启动一个本地HTTP服务器做演示。
+'''
+
+import asyncio, collections, hashlib, json, os, ssl, tempfile, time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (compatible; HttpClient.py)',
+    'Accept-Encoding': 'identity',
+    'Connection': 'keep-alive',
+}
+
+
+class _Connection(object):
+
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+        self.idle_since = time.monotonic()
+
+    def close(self):
+        self.writer.close()
+
+
+class _HostPool(object):
+
+    def __init__(self, limit):
+        self.sem = asyncio.Semaphore(limit)
+        self.idle = collections.deque()
+
+
+# 从连接读取body：Content-Length、chunked或者读到连接关闭
+class _ConnBody(object):
+
+    def __init__(self, client, conn, length, chunked, keep_alive):
+        self._client = client
+        self._conn = conn
+        self._left = length  # 剩余字节数，None表示读到连接关闭为止
+        self._chunked = chunked
+        self._chunk_left = 0
+        self._keep_alive = keep_alive and (chunked or length is not None)
+        self._tee = None
+        self.done = False
+        if length == 0 and not chunked:
+            self._finish()
+
+    async def _io(self, coro):
+        return await asyncio.wait_for(coro, self._client.timeout)
+
+    async def read(self, size):
+        if self.done:
+            return b''
+        reader = self._conn.reader
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await self._io(reader.readline())
+                self._chunk_left = int(line.split(b';')[0].strip() or b'0', 16)
+                if self._chunk_left == 0:
+                    # 最后一个chunk之后是trailer，以空行结束
+                    while (await self._io(reader.readline())) not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._finish()
+                    return b''
+            data = await self._io(reader.read(min(size, self._chunk_left)))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', self._chunk_left)
+            self._chunk_left -= len(data)
+            if self._chunk_left == 0:
+                await self._io(reader.readexactly(2))
+            complete = False
+        elif self._left is not None:
+            data = await self._io(reader.read(min(size, self._left)))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', self._left)
+            self._left -= len(data)
+            complete = self._left == 0
+        else:
+            data = await self._io(reader.read(size))
+            if not data:
+                self._finish()
+                return b''
+            complete = False
+        # 先写缓存再结束，_finish()会提交缓存文件
+        if self._tee is not None:
+            self._tee.write(data)
+        if complete:
+            self._finish()
+        return data
+
+    def _finish(self):
+        self.done = True
+        if self._tee is not None:
+            self._tee.commit()
+            self._tee = None
+        self._client._release(self._conn, self._keep_alive)
+
+    def close(self):
+        if not self.done:
+            # 没读完的body无法复用连接，直接关闭
+            self.done = True
+            if self._tee is not None:
+                self._tee.abort()
+                self._tee = None
+            self._client._release(self._conn, False)
+
+
+class _FileBody(object):
+
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+
+    async def read(self, size):
+        # 本地磁盘上的缓存文件，同步读取即可
+        data = self._f.read(size)
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        self._f.close()
+
+
+class Response(object):
+
+    def __init__(self, status, reason, headers, body, from_cache=False):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # 小写的header名 => 值
+        self.from_cache = from_cache
+        self._body = body
+
+    async def iter_chunks(self, size=65536):
+        while True:
+            chunk = await self._body.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+    async def read(self):
+        L = []
+        async for chunk in self.iter_chunks():
+            L.append(chunk)
+        return b''.join(L)
+
+    def release(self):
+        self._body.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def _cache_control(headers):
+    cc = dict()
+    for item in headers.get('cache-control', '').split(','):
+        k, _, v = item.strip().partition('=')
+        if k:
+            cc[k.lower()] = v.strip('"')
+    return cc
+
+
+# 响应可以直接使用的秒数，0表示每次都要向服务器确认
+def _freshness(headers):
+    cc = _cache_control(headers)
+    if 'no-cache' in cc:
+        return 0
+    for k in ('s-maxage', 'max-age'):
+        if k in cc:
+            try:
+                return max(int(cc[k]), 0)
+            except ValueError:
+                return 0
+    if 'expires' in headers:
+        try:
+            expires = parsedate_to_datetime(headers['expires']).timestamp()
+            date = parsedate_to_datetime(headers['date']).timestamp() if 'date' in headers else time.time()
+            return max(expires - date, 0)
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+
+class _CacheWriter(object):
+
+    def __init__(self, cache, url, resp):
+        self._cache = cache
+        self._url = url
+        self._resp = resp
+        fd, self._tmp = tempfile.mkstemp(dir=cache.path, suffix='.tmp')
+        self._f = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self._f.write(data)
+
+    def commit(self):
+        self._f.close()
+        path = self._cache._path(self._url)
+        os.replace(self._tmp, path + '.body')
+        self._cache._write_meta(path, dict(url=self._url, status=self._resp.status, reason=self._resp.reason,
+                                           headers=self._resp.headers, stored_at=time.time()))
+
+    def abort(self):
+        self._f.close()
+        os.remove(self._tmp)
+
+
+class HTTPCache(object):
+    '''
+    每个url两个文件：<sha1>.meta保存状态行和header，<sha1>.body保存body。
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _write_meta(self, path, meta):
+        tmp = path + '.meta.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, path + '.meta')
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            with open(path + '.meta') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['url'] != url or not os.path.exists(path + '.body'):
+            return None
+        return meta
+
+    def fresh(self, meta):
+        headers = meta['headers']
+        age = time.time() - meta['stored_at'] + int(headers.get('age', '0') or 0)
+        return age < _freshness(headers)
+
+    def storable(self, resp):
+        cc = _cache_control(resp.headers)
+        if 'no-store' in cc or resp.headers.get('vary', 'accept-encoding').lower() not in ('accept-encoding', ''):
+            return False
+        return _freshness(resp.headers) > 0 or 'etag' in resp.headers or 'last-modified' in resp.headers
+
+    def revalidated(self, url, meta, headers):
+        # 304带回的header覆盖原来的，body不变
+        for k, v in headers.items():
+            if k not in ('content-length', 'transfer-encoding', 'connection'):
+                meta['headers'][k] = v
+        meta['stored_at'] = time.time()
+        self._write_meta(self._path(url), meta)
+
+    def response(self, url, meta):
+        return Response(meta['status'], meta['reason'], meta['headers'], _FileBody(self._path(url) + '.body'), True)
+
+    def writer(self, url, resp):
+        return _CacheWriter(self, url, resp)
+
+
+class HTTPClient(object):
+
+    def __init__(self, per_host=6, limit=64, timeout=30, idle_timeout=30, cache_dir=None, headers=None):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.headers = dict(DEFAULT_HEADERS)
+        self.headers.update(headers or {})
+        self.cache = HTTPCache(cache_dir) if cache_dir else None
+        self.connections = 0  # 新建的连接数，可以看出复用的效果
+        self._limit = asyncio.Semaphore(limit)
+        self._pools = dict()  # (scheme, host, port) => _HostPool
+        self._ssl = ssl.create_default_context()
+
+    async def _acquire(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _HostPool(self.per_host)
+        # 先等本host的名额再占全局名额，否则排队等繁忙host的请求会占着全局名额，连空闲host的请求也发不出去
+        await pool.sem.acquire()
+        try:
+            await self._limit.acquire()
+        except BaseException:
+            pool.sem.release()
+            raise
+        now = time.monotonic()
+        while pool.idle:
+            conn = pool.idle.pop()
+            if now - conn.idle_since < self.idle_timeout and not conn.reader.at_eof():
+                return conn
+            conn.close()
+        scheme, host, port = key
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=self._ssl if scheme == 'https' else None), self.timeout)
+        except BaseException:
+            self._limit.release()
+            pool.sem.release()
+            raise
+        self.connections += 1
+        return _Connection(key, reader, writer)
+
+    def _release(self, conn, reuse):
+        pool = self._pools[conn.key]
+        if reuse:
+            conn.idle_since = time.monotonic()
+            pool.idle.append(conn)
+        else:
+            conn.close()
+        self._limit.release()
+        pool.sem.release()
+
+    async def _send(self, method, key, path, headers, body):
+        lines = ['%s %s HTTP/1.1' % (method, path)] + ['%s: %s' % kv for kv in headers.items()]
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        data = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+        for attempt in range(2):
+            conn = await self._acquire(key)
+            reused = conn.requests > 0
+            try:
+                conn.writer.write(data)
+                await conn.writer.drain()
+                status_line = await asyncio.wait_for(conn.reader.readline(), self.timeout)
+                if not status_line:
+                    raise ConnectionResetError('connection closed by server')
+                version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+                status = int(status)
+                resp_headers = dict()
+                while True:
+                    line = await asyncio.wait_for(conn.reader.readline(), self.timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    k, _, v = line.decode('latin-1').partition(':')
+                    k, v = k.strip().lower(), v.strip()
+                    resp_headers[k] = resp_headers[k] + ', ' + v if k in resp_headers else v
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._release(conn, False)
+                # 复用的空闲连接可能已经被服务器关掉了，幂等的请求换个新连接重试一次
+                if reused and attempt == 0 and method in ('GET', 'HEAD'):
+                    continue
+                raise
+            except BaseException:
+                self._release(conn, False)
+                raise
+            conn.requests += 1
+            if method == 'HEAD' or status in (204, 304) or status < 200:
+                length, chunked = 0, False
+            else:
+                chunked = 'chunked' in resp_headers.get('transfer-encoding', '').lower()
+                length = None if chunked or 'content-length' not in resp_headers else int(resp_headers['content-length'])
+            conn_header = resp_headers.get('connection', '').lower()
+            keep_alive = 'close' not in conn_header and (version != 'HTTP/1.0' or 'keep-alive' in conn_header)
+            return Response(status, reason, resp_headers, _ConnBody(self, conn, length, chunked, keep_alive))
+
+    async def request(self, method, url, headers=None, body=None):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        h = dict(self.headers)
+        h['Host'] = parts.netloc
+        h.update(headers or {})
+        meta = None
+        if self.cache is not None and method == 'GET':
+            meta = self.cache.get(url)
+            if meta is not None:
+                if self.cache.fresh(meta):
+                    return self.cache.response(url, meta)
+                if 'etag' in meta['headers']:
+                    h['If-None-Match'] = meta['headers']['etag']
+                if 'last-modified' in meta['headers']:
+                    h['If-Modified-Since'] = meta['headers']['last-modified']
+        resp = await self._send(method, key, path, h, body)
+        if meta is not None and resp.status == 304:
+            resp.release()
+            self.cache.revalidated(url, meta, resp.headers)
+            return self.cache.response(url, meta)
+        if self.cache is not None and method == 'GET' and resp.status == 200 and self.cache.storable(resp):
+            # 边读边写进缓存，body完整读完才生效
+            resp._body._tee = self.cache.writer(url, resp)
+            if resp._body.done:
+                resp._body._tee.commit()
+                resp._body._tee = None
+        return resp
+
+    async def get(self, url, headers=None):
+        return await self.request('GET', url, headers)
+
+    async def fetch(self, url, headers=None):
+        # 相当于urlopen(url).read()
+        async with await self.get(url, headers) as resp:
+            return resp.status, resp.headers, await resp.read()
+
+    async def close(self):
+        for pool in self._pools.values():
+            while pool.idle:
+                pool.idle.pop().close()
+
+
+# 以下为本地演示：一个支持keep-alive、ETag和chunked的HTTP/1.1服务器
+def _start_server():
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            self.server.stats['connections'] += 1
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, ctype, extra=()):
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in extra:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.server.stats['requests'] += 1
+            if self.path.startswith('/book/'):
+                body = json.dumps(dict(id=self.path[6:], title='Python')).encode('utf-8')
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+                if self.headers.get('If-None-Match') == etag:
+                    self.server.stats['not_modified'] += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self._send(body, 'application/json', [('ETag', etag), ('Cache-Control', 'no-cache')])
+            elif self.path == '/static.css':
+                self._send(b'body{}' * 100, 'text/css', [('Cache-Control', 'max-age=60')])
+            elif self.path == '/big':
+                self._send(os.urandom(1024) * 8 * 1024, 'application/octet-stream')
+            elif self.path == '/chunked':
+                self.send_response(200)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(5):
+                    data = ('chunk %d\n' % i).encode('utf-8')
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.send_error(404)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.stats = collections.Counter()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _demo():
+    server = _start_server()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+    cache_dir = tempfile.mkdtemp()
+    client = HTTPClient(per_host=4, cache_dir=cache_dir)
+
+    start = time.time()
+    results = await asyncio.gather(*[client.fetch('%s/book/%d' % (base, i)) for i in range(50)])
+    print('50 requests in %.3fs, status %s, new connections: %d' % (
+        time.time() - start, set(r[0] for r in results), client.connections))
+
+    # 流式读取大文件，内存里每次只有一块
+    total = 0
+    async with await client.get(base + '/big') as resp:
+        async for chunk in resp.iter_chunks():
+            total += len(chunk)
+    print('streamed /big: %d bytes' % total)
+
+    status, headers, body = await client.fetch(base + '/chunked')
+    print('chunked body: %r' % body)
+
+    for i in range(2):
+        async with await client.get(base + '/static.css') as resp:
+            await resp.read()
+            print('/static.css from cache: %s' % resp.from_cache)
+    async with await client.get(base + '/book/1') as resp:
+        print('/book/1 revalidated: from_cache=%s, body=%s' % (resp.from_cache, (await resp.read()).decode('utf-8')))
+
+    print('server: %s, client connections: %d' % (dict(server.stats), client.connections))
+    await client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(_demo())
@@ -0,0 +1,133 @@
+import asyncio, collections
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from HttpClient import HTTPClient
+
+ETAG = '"v1"'
+
+
+def make_app(hits):
+
+    async def book(request):
+        hits[request.path] += 1
+        if request.headers.get('If-None-Match') == ETAG:
+            hits['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': ETAG})
+        return web.json_response(dict(id=request.match_info['id']), headers={'ETag': ETAG, 'Cache-Control': 'no-cache'})
+
+    async def static(request):
+        hits[request.path] += 1
+        return web.Response(text='body{}' * 100, content_type='text/css', headers={'Cache-Control': 'max-age=60'})
+
+    async def chunked(request):
+        hits[request.path] += 1
+        resp = web.StreamResponse(headers={'Cache-Control': 'max-age=60'})
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        for i in range(5):
+            await resp.write(b'chunk %d\n' % i)
+        await resp.write_eof()
+        return resp
+
+    async def big(request):
+        hits[request.path] += 1
+        return web.Response(body=b'x' * 1024 * 1024, headers={'Cache-Control': 'max-age=60'})
+
+    app = web.Application()
+    app.router.add_get('/book/{id}', book)
+    app.router.add_get('/static.css', static)
+    app.router.add_get('/chunked', chunked)
+    app.router.add_get('/big', big)
+    return app
+
+
+def run_with_server(test, **kw):
+    hits = collections.Counter()
+
+    async def run():
+        server = TestServer(make_app(hits))
+        await server.start_server(**kw)
+        try:
+            await test('http://127.0.0.1:%d' % server.port)
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+    return hits
+
+
+def test_connections_are_reused():
+
+    async def test(base):
+        client = HTTPClient(per_host=2)
+        results = await asyncio.gather(*[client.fetch('%s/book/%d' % (base, i)) for i in range(20)])
+        assert [r[0] for r in results] == [200] * 20
+        assert [r[2] for r in results] == [b'{"id": "%d"}' % i for i in range(20)]
+        status, headers, body = await client.fetch(base + '/chunked')
+        assert body == b''.join(b'chunk %d\n' % i for i in range(5))
+        assert client.connections <= 2
+        await client.close()
+
+    hits = run_with_server(test)
+    assert sum(v for k, v in hits.items() if k.startswith('/book/')) == 20
+
+
+def test_cache_fresh_and_revalidated(tmp_path):
+
+    async def test(base):
+        client = HTTPClient(cache_dir=str(tmp_path))
+        for i in range(3):
+            async with await client.get(base + '/static.css') as resp:
+                assert await resp.read() == b'body{}' * 100
+                assert resp.from_cache == (i > 0)
+        # chunked的body也能进缓存
+        await client.fetch(base + '/chunked')
+        status, headers, body = await client.fetch(base + '/chunked')
+        assert body.startswith(b'chunk 0\n')
+        # no-cache：每次都带ETag问服务器，304时用缓存的body
+        await client.fetch(base + '/book/1')
+        async with await client.get(base + '/book/1') as resp:
+            assert resp.status == 200 and resp.from_cache
+            assert await resp.read() == b'{"id": "1"}'
+        await client.close()
+
+    hits = run_with_server(test)
+    assert hits['/static.css'] == 1
+    assert hits['/chunked'] == 1
+    assert hits['/book/1'] == 2 and hits['not_modified'] == 1
+
+
+def test_unread_body_closes_connection_and_skips_cache(tmp_path):
+
+    async def test(base):
+        client = HTTPClient(per_host=1, cache_dir=str(tmp_path))
+        async with await client.get(base + '/big') as resp:
+            assert len(await resp._body.read(1000)) > 0
+        # 没读完的连接不能复用，缓存也不能留下半个body
+        assert client.connections == 1
+        async with await client.get(base + '/big') as resp:
+            assert not resp.from_cache
+            assert len(await resp.read()) == 1024 * 1024
+        assert client.connections == 2
+        assert client.cache.get(base + '/big') is not None
+        await client.close()
+
+    hits = run_with_server(test)
+    assert hits['/big'] == 2
+
+
+def test_idle_connection_closed_by_server():
+
+    async def test(base):
+        client = HTTPClient()
+        await client.fetch(base + '/book/1')
+        # 服务器关掉了空闲连接，下一个请求换新连接
+        await asyncio.sleep(0.3)
+        status, headers, body = await client.fetch(base + '/book/2')
+        assert status == 200 and body == b'{"id": "2"}'
+        assert client.connections == 2
+        await client.close()
+
+    run_with_server(test, keepalive_timeout=0.1)
@@ -0,0 +1,322 @@
+'''
+在Asyncio_test.py的wget基础上做的并发爬虫:
+
+- 固定数量的worker从队列里取url，并发数有上限，不再一次性asyncio.wait所有任务
+- 每个host限制连接数和两次请求的最小间隔，不会把一个站点打爆
+- 用HTTP/1.1 keep-alive，同一个host的请求复用连接
+- 支持Content-Length、chunked和读到连接关闭三种body，边读边写到磁盘，同时增量解析出链接
+- 已访问的url只保存8字节的hash，算上int对象和set的开销每个url约70字节，一百万url约70MB
+- 定期打印每秒抓取的页面数
+
+    python3 Crawler.py                      # 对本地演示服务器抓取
+    python3 Crawler.py http://example.com/ --concurrency 20 --per-host 2 --delay 0.5 --max-pages 1000
+'''
+
+import argparse, asyncio, codecs, hashlib, os, tempfile, time
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, urldefrag
+
+
+class LinkParser(HTMLParser):
+    # 可以一块一块feed，和CommonlyBlock/HTMLParser.py的用法一样
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for k, v in attrs:
+                if k == 'href' and v:
+                    self.links.append(v)
+
+
+class SeenSet(object):
+    '''
+    url规范化后取blake2b的8字节摘要存成int，碰撞概率可以忽略。
+    每个url约70字节（int对象32字节，加上set哈希表的槽位），
+    直接存50字节左右的url字符串要130字节以上。
+    '''
+
+    def __init__(self):
+        self._hashes = set()
+
+    @staticmethod
+    def _key(url):
+        return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def add(self, url):
+        # 新url返回True
+        key = self._key(url)
+        if key in self._hashes:
+            return False
+        self._hashes.add(key)
+        return True
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+class _Host(object):
+
+    def __init__(self, per_host):
+        self.sem = asyncio.Semaphore(per_host)
+        self.idle = []  # 空闲的(reader, writer)
+        self.next_time = 0  # 下一次允许发请求的时间
+        self.connections = 0
+
+
+def normalize(url):
+    url, _ = urldefrag(url)
+    parts = urlsplit(url)
+    if parts.scheme != 'http' or not parts.hostname:
+        return None
+    return '%s://%s%s%s' % (parts.scheme, parts.netloc.lower(), parts.path or '/', '?' + parts.query if parts.query else '')
+
+
+class Crawler(object):
+
+    def __init__(self, seeds, out_dir, concurrency=10, per_host=2, delay=0.0, max_pages=1000, timeout=10):
+        self.out_dir = out_dir
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.allowed = set(urlsplit(u).netloc.lower() for u in seeds)  # 只在种子站点内抓取
+        self.queue = asyncio.Queue()
+        self.seen = SeenSet()
+        self.hosts = dict()
+        self.pages = self.bytes = self.errors = 0
+        self.start = None
+        for url in seeds:
+            self.enqueue(url)
+
+    def enqueue(self, url):
+        url = normalize(url)
+        if url and urlsplit(url).netloc in self.allowed and len(self.seen) < self.max_pages and self.seen.add(url):
+            self.queue.put_nowait(url)
+
+    async def _connect(self, host, netloc, fresh=False):
+        # 礼貌限制：同一host的请求之间至少间隔delay秒
+        await host.sem.acquire()
+        now = time.monotonic()
+        wait = host.next_time - now
+        host.next_time = max(now, host.next_time) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if host.idle and not fresh:
+            return host.idle.pop(), True
+        parts = urlsplit('http://' + netloc)
+        try:
+            conn = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), self.timeout)
+        except BaseException:
+            host.sem.release()
+            raise
+        host.connections += 1
+        return conn, False
+
+    def _release(self, host, conn, reuse):
+        if reuse:
+            host.idle.append(conn)
+        else:
+            conn[1].close()
+        host.sem.release()
+
+    async def wget(self, url):
+        parts = urlsplit(url)
+        host = self.hosts.get(parts.netloc)
+        if host is None:
+            host = self.hosts[parts.netloc] = _Host(self.per_host)
+        for attempt in range(2):
+            # 重试时不再用空闲连接，它们多半和刚才那个一样已经被服务器关掉了
+            conn, reused = await self._connect(host, parts.netloc, fresh=attempt > 0)
+            try:
+                result = await asyncio.wait_for(self._fetch(conn, url), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._release(host, conn, False)
+                # 空闲连接可能已经被服务器关掉，换新连接重试一次
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                self._release(host, conn, False)
+                raise
+            status, location, links, keep_alive = result
+            self._release(host, conn, keep_alive)
+            return status, location, links
+
+    async def _fetch(self, conn, url):
+        reader, writer = conn
+        parts = urlsplit(url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        header = 'GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: Crawler.py\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n' % (path, parts.netloc)
+        writer.write(header.encode('utf-8'))
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('connection closed')
+        version, status = line.decode('latin-1').split(' ', 2)[:2]
+        status = int(status)
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, _, v = line.decode('latin-1').partition(':')
+            headers[k.strip().lower()] = v.strip()
+        keep_alive = 'close' not in headers.get('connection', '').lower() and version != 'HTTP/1.0'
+        parser = LinkParser() if 'html' in headers.get('content-type', '') and status == 200 else None
+        # 多字节字符可能被切在两块之间，用增量解码器
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        path = os.path.join(self.out_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html')
+        with open(path, 'wb') as f:
+            async for chunk in self._body(reader, headers, status):
+                if not chunk:
+                    keep_alive = False
+                    continue
+                self.bytes += len(chunk)
+                f.write(chunk)
+                if parser is not None:
+                    parser.feed(decoder.decode(chunk))
+        return status, headers.get('location'), parser.links if parser else [], keep_alive
+
+    async def _body(self, reader, headers, status, size=65536):
+        if status in (204, 304) or status < 200:
+            return
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                n = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if n == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                while n > 0:
+                    data = await reader.read(min(n, size))
+                    if not data:
+                        raise asyncio.IncompleteReadError(b'', n)
+                    n -= len(data)
+                    yield data
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            n = int(headers['content-length'])
+            while n > 0:
+                data = await reader.read(min(n, size))
+                if not data:
+                    raise asyncio.IncompleteReadError(b'', n)
+                n -= len(data)
+                yield data
+        else:
+            # 没有长度，读到连接关闭，这个连接不能再复用，用空块通知调用方
+            while True:
+                data = await reader.read(size)
+                if not data:
+                    break
+                yield data
+            yield b''
+
+    async def worker(self):
+        while True:
+            url = await self.queue.get()
+            try:
+                status, location, links = await self.wget(url)
+                self.pages += 1
+                if location and 300 <= status < 400:
+                    self.enqueue(urljoin(url, location))
+                for link in links:
+                    self.enqueue(urljoin(url, link))
+            except Exception as e:
+                self.errors += 1
+                print('error %s: %r' % (url, e))
+            finally:
+                self.queue.task_done()
+
+    async def report(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.stats())
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start
+        return '%d pages, %d errors, %.1f MB, %.1f pages/s, %d queued, %d connections' % (
+            self.pages, self.errors, self.bytes / 1048576, self.pages / elapsed if elapsed else 0,
+            self.queue.qsize(), sum(h.connections for h in self.hosts.values()))
+
+    async def run(self):
+        self.start = time.monotonic()
+        workers = [asyncio.ensure_future(self.worker()) for i in range(self.concurrency)]
+        reporter = asyncio.ensure_future(self.report())
+        await self.queue.join()
+        for t in workers + [reporter]:
+            t.cancel()
+        for host in self.hosts.values():
+            for reader, writer in host.idle:
+                writer.close()
+                await writer.wait_closed()
+        print('done: ' + self.stats())
+
+
+# 本地演示服务器：/page/N链接到其他几个页面，奇数页用chunked，偶数页用Content-Length，keep-alive
+async def _serve(reader, writer, total, stats):
+    stats['connections'] += 1
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            path = line.split()[1].decode('latin-1')
+            stats['requests'] += 1
+            if path == '/':
+                writer.write(b'HTTP/1.1 302 Found\r\nLocation: /page/0\r\nContent-Length: 0\r\n\r\n')
+                continue
+            n = int(path.rsplit('/', 1)[1])
+            links = ''.join('<a href="/page/%d">page %d</a>\n' % ((n * 7 + k) % total, (n * 7 + k) % total) for k in range(1, 6))
+            body = ('<html><body><h1>page %d</h1>\n%s<p>%s</p></body></html>' % (n, links, 'x' * 2000)).encode('utf-8')
+            if n % 2:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nTransfer-Encoding: chunked\r\n\r\n')
+                for i in range(0, len(body), 1000):
+                    part = body[i:i + 1000]
+                    writer.write(b'%x\r\n%s\r\n' % (len(part), part))
+                writer.write(b'0\r\n\r\n')
+            else:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _demo(args):
+    stats = dict(connections=0, requests=0)
+    server = await asyncio.start_server(lambda r, w: _serve(r, w, args.max_pages, stats), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    # 127.0.0.1和localhost算两个host，各自有连接数和间隔限制
+    seeds = ['http://127.0.0.1:%d/' % port, 'http://localhost:%d/page/1' % port]
+    out_dir = tempfile.mkdtemp()
+    crawler = Crawler(seeds, out_dir, args.concurrency, args.per_host, args.delay, args.max_pages)
+    await crawler.run()
+    print('server: %s, files in %s: %d' % (stats, out_dir, len(os.listdir(out_dir))))
+    server.close()
+    await server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('seeds', nargs='*')
+    parser.add_argument('--out', default=None, help='directory for fetched pages')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--per-host', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds between requests to one host')
+    parser.add_argument('--max-pages', type=int, default=2000)
+    args = parser.parse_args()
+    if not args.seeds:
+        asyncio.run(_demo(args))
+        return
+    out_dir = args.out or tempfile.mkdtemp()
+    os.makedirs(out_dir, exist_ok=True)
+    asyncio.run(Crawler(args.seeds, out_dir, args.concurrency, args.per_host, args.delay, args.max_pages).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import asyncio, collections, os
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from Crawler import Crawler, SeenSet, normalize
+
+PAGES = {
+    '/page/a': ['/page/b', '/page/c#top', 'http://other.example/x', 'mailto:a@b.c'],
+    '/page/b': ['/page/a', '/page/c', '/page/b'],
+    '/page/c': ['/page/a', '/page/b?x=1'],
+    '/page/b?x=1': ['/page/a'],
+}
+
+
+def make_app(hits):
+
+    async def page(request):
+        key = request.path_qs
+        hits[key] += 1
+        if request.path == '/':
+            raise web.HTTPFound('/page/a')
+        links = ''.join('<a href="%s">%s</a>' % (l, l) for l in PAGES[key])
+        body = ('<html><body><h1>页面 %s</h1>%s</body></html>' % (key, links)).encode('utf-8')
+        if key == '/page/b':
+            # 一个页面用chunked，分块切在多字节字符中间
+            resp = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+            resp.enable_chunked_encoding()
+            await resp.prepare(request)
+            for i in range(0, len(body), 7):
+                await resp.write(body[i:i + 7])
+            await resp.write_eof()
+            return resp
+        return web.Response(body=body, content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/', page)
+    app.router.add_get('/page/{name}', page)
+    return app
+
+
+def test_crawl_fetches_each_page_once(tmp_path):
+    hits = collections.Counter()
+
+    async def run():
+        server = TestServer(make_app(hits))
+        await server.start_server()
+        try:
+            crawler = Crawler(['http://127.0.0.1:%d/' % server.port], str(tmp_path), concurrency=4, per_host=2)
+            await crawler.run()
+            return crawler
+        finally:
+            await server.close()
+
+    crawler = asyncio.run(run())
+    assert hits == dict((k, 1) for k in ['/'] + list(PAGES))
+    assert crawler.pages == 5 and crawler.errors == 0
+    assert len(os.listdir(str(tmp_path))) == 5
+    # keep-alive：请求都走不超过per_host个连接
+    assert sum(h.connections for h in crawler.hosts.values()) <= 2
+
+
+def test_max_pages_limits_crawl(tmp_path):
+    hits = collections.Counter()
+
+    async def run():
+        server = TestServer(make_app(hits))
+        await server.start_server()
+        try:
+            crawler = Crawler(['http://127.0.0.1:%d/page/a' % server.port], str(tmp_path), max_pages=2)
+            await crawler.run()
+            return crawler
+        finally:
+            await server.close()
+
+    crawler = asyncio.run(run())
+    assert crawler.pages == 2
+    assert sum(hits.values()) == 2
+
+
+def test_seen_set_and_normalize():
+    seen = SeenSet()
+    assert seen.add(normalize('http://Example.com/a#frag'))
+    assert not seen.add(normalize('http://example.com/a'))
+    assert seen.add(normalize('http://example.com/a?x=1'))
+    assert len(seen) == 2
+    assert normalize('http://example.com') == 'http://example.com/'
+    assert normalize('https://example.com/') is None
+    assert normalize('mailto:a@b.c') is None
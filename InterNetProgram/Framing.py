@@ -0,0 +1,166 @@
+'''
+给Welcome/Hello/exit协议加上分帧：每条消息前面是8字节头(长度, 请求id)，
+TCP把几条消息粘在一起或者拆开收到都能正确还原，请求id让客户端可以不等回复连续发送(pipelining)。
+
+    python3 server.py --event --framed      # 分帧模式的服务器
+    python3 Framing.py                      # 对比原来一问一答和分帧+pipelining的吞吐量
+'''
+
+import argparse, asyncio, collections, itertools, struct, time
+
+HEADER = struct.Struct('!II')  # 长度, 请求id
+MAX_FRAME = 1 << 20
+WELCOME_ID = 0  # 服务器主动发的欢迎消息
+
+
+def pack(req_id, payload):
+    return HEADER.pack(len(payload), req_id) + payload
+
+
+class FrameDecoder(object):
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        # 返回已经收完整的[(请求id, 内容)]，不完整的留到下次
+        buf = self.buf
+        buf += data
+        frames = []
+        pos = 0
+        while len(buf) - pos >= HEADER.size:
+            length, req_id = HEADER.unpack_from(buf, pos)
+            if length > MAX_FRAME:
+                raise ValueError('frame too large: %d bytes' % length)
+            end = pos + HEADER.size + length
+            if end > len(buf):
+                break
+            frames.append((req_id, bytes(buf[pos + HEADER.size:end])))
+            pos = end
+        if pos:
+            del buf[:pos]
+        return frames
+
+
+class FramedClient(object):
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count(1)
+        self._loop = asyncio.get_event_loop()
+        self._waiting = {WELCOME_ID: self._loop.create_future()}  # 请求id => future
+        self._outbuf = bytearray()
+        self._task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        client = cls(reader, writer)
+        client.welcome = await client._waiting[WELCOME_ID]
+        return client
+
+    async def _read_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await self._reader.read(65536)
+                if not data:
+                    break
+                for req_id, payload in decoder.feed(data):
+                    fut = self._waiting.pop(req_id, None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(payload)
+        finally:
+            for fut in self._waiting.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError('connection closed'))
+            self._waiting.clear()
+
+    def request(self, payload):
+        # 不等回复，返回future，回复按id对上；同一轮事件循环里发出的请求合并成一次write
+        req_id = next(self._ids)
+        fut = self._waiting[req_id] = self._loop.create_future()
+        if not self._outbuf:
+            self._loop.call_soon(self._flush)
+        self._outbuf += pack(req_id, payload)
+        return fut
+
+    def _flush(self):
+        if self._outbuf:
+            self._writer.write(bytes(self._outbuf))
+            self._outbuf.clear()
+
+    async def close(self):
+        self._outbuf += pack(next(self._ids), b'exit')
+        self._flush()
+        # 服务器处理完exit会关闭连接，读循环随之结束
+        await self._task
+        self._writer.close()
+
+
+def _serve(port_queue, framed):
+    import server
+    srv = server.EventServer('127.0.0.1', 0, delay=0, framed=framed)
+    port_queue.put(srv.lsock.getsockname()[1])
+    srv.serve_forever(report_interval=3600)
+
+
+async def _lockstep(port, clients, messages):
+    async def one():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await reader.read(1024)
+        for i in range(messages):
+            writer.write(b'Michael')
+            if await reader.read(1024) != b'Hello, Michael!':
+                raise ValueError('reply mismatch')
+        writer.write(b'exit')
+        await reader.read()
+        writer.close()
+    await asyncio.gather(*[one() for i in range(clients)])
+
+
+async def _pipelined(port, clients, messages, window):
+    async def one():
+        client = await FramedClient.connect('127.0.0.1', port)
+        # 保持window个请求在路上，收到一个回复就补发一个
+        in_flight = collections.deque()
+        sent = 0
+        while sent < messages or in_flight:
+            while sent < messages and len(in_flight) < window:
+                in_flight.append(client.request(b'Michael'))
+                sent += 1
+            if await in_flight.popleft() != b'Hello, Michael!':
+                raise ValueError('reply mismatch')
+        await client.close()
+    await asyncio.gather(*[one() for i in range(clients)])
+
+
+def bench(clients, messages, window):
+    import multiprocessing
+    results = []
+    for name, framed in (('lockstep', False), ('framed+pipelined', True)):
+        q = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_serve, args=(q, framed), daemon=True)
+        p.start()
+        port = q.get()
+        start = time.perf_counter()
+        if framed:
+            asyncio.run(_pipelined(port, clients, messages, window))
+        else:
+            asyncio.run(_lockstep(port, clients, messages))
+        elapsed = time.perf_counter() - start
+        p.terminate()
+        total = clients * messages
+        results.append(total / elapsed)
+        print('%-18s %d clients x %d messages: %.2fs, %.0f msg/s' % (name, clients, messages, elapsed, total / elapsed))
+    print('speedup: %.1fx (window %d)' % (results[1] / results[0], window))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--window', type=int, default=128, help='max in-flight requests per connection')
+    args = parser.parse_args()
+    bench(args.clients, args.messages, args.window)
@@ -1,23 +1,206 @@
-import socket
-
-
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect(('www.sina.com.cn', 80))
-# 发送数据:
-s.send(b'GET / HTTP/1.1\r\nHost: www.sina.com.cn\r\nConnection: close\r\n\r\n')
-# 接收数据:
-buffer = []
-while True:
-    # 每次最多接收1k字节:
-    d = s.recv(1024)
-    if d:
-        buffer.append(d)
+'''
+用socket直接发HTTP请求，流式地把body写进文件:
+
+- 只分配一块固定大小的bytearray，recv_into直接收进去，不再每次recv(1024)产生新的bytes再join
+- 一边收一边按行解析状态行和header
+- 支持Content-Length、Transfer-Encoding: chunked和读到连接关闭，body通过memoryview直接写文件
+
+    python3 TcpPro.py            # 抓取新浪首页存到sina.html
+    python3 TcpPro.py --bench    # 和原来的recv(1024)写法在本地服务器上对比
+'''
+
+import socket, sys, time, collections
+
+FetchResult = collections.namedtuple('FetchResult', ['status', 'reason', 'headers', 'length', 'recv_calls'])
+
+
+class StreamReader(object):
+
+    def __init__(self, sock, size=65536):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.start = self.end = 0  # buf[start:end]是已收到还没处理的数据
+        self.recv_calls = 0
+
+    def _fill(self):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            # 缓冲区尾部满了，把没处理完的半行挪到开头
+            n = self.end - self.start
+            if n == len(self.buf):
+                raise ValueError('line longer than buffer (%d bytes)' % n)
+            self.buf[:n] = bytes(self.mv[self.start:self.end])
+            self.start, self.end = 0, n
+        n = self.sock.recv_into(self.mv[self.end:])
+        self.recv_calls += 1
+        self.end += n
+        return n
+
+    def readline(self):
+        while True:
+            i = self.buf.find(b'\n', self.start, self.end)
+            if i >= 0:
+                line = bytes(self.mv[self.start:i + 1])
+                self.start = i + 1
+                return line
+            if not self._fill():
+                raise ConnectionError('connection closed in the middle of a line')
+
+    def copy_to(self, f, n=None):
+        # 把n个字节(None表示直到连接关闭)写入f，返回写入的字节数
+        total = 0
+        while n is None or total < n:
+            if self.start == self.end and not self._fill():
+                if n is None:
+                    break
+                raise ConnectionError('connection closed, %d of %d bytes received' % (total, n))
+            k = self.end - self.start
+            if n is not None:
+                k = min(k, n - total)
+            f.write(self.mv[self.start:self.start + k])
+            self.start += k
+            total += k
+        return total
+
+
+class _Discard(object):
+
+    def write(self, data):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def fetch(host, path='/', port=80, out=None, bufsize=65536):
+    s = socket.create_connection((host, port))
+    try:
+        s.sendall(('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n' % (path, host)).encode('ascii'))
+        r = StreamReader(s, bufsize)
+        version, status, reason = (r.readline().decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        headers = []
+        while True:
+            line = r.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            k, _, v = line.decode('latin-1').partition(':')
+            headers.append((k.strip(), v.strip()))
+        h = dict((k.lower(), v) for k, v in headers)
+        with (open(out, 'wb') if out else _Discard()) as f:
+            if 'chunked' in h.get('transfer-encoding', '').lower():
+                length = 0
+                while True:
+                    # 每块：十六进制长度行 + 数据 + CRLF，长度为0的块后面是trailer和空行
+                    size = int(r.readline().split(b';')[0].strip(), 16)
+                    if size == 0:
+                        while r.readline() not in (b'\r\n', b'\n'):
+                            pass
+                        break
+                    length += r.copy_to(f, size)
+                    r.readline()
+            elif 'content-length' in h:
+                length = r.copy_to(f, int(h['content-length']))
+            else:
+                length = r.copy_to(f)
+        return FetchResult(int(status), reason, headers, length, r.recv_calls)
+    finally:
+        s.close()
+
+
+# 原来的写法，留作对比
+def fetch_naive(host, path='/', port=80, out=None):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((host, port))
+    s.send(('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n' % (path, host)).encode('ascii'))
+    buffer = []
+    calls = 0
+    while True:
+        d = s.recv(1024)
+        calls += 1
+        if d:
+            buffer.append(d)
+        else:
+            break
+    data = b''.join(buffer)
+    s.close()
+    header, html = data.split(b'\r\n\r\n', 1)
+    if out:
+        with open(out, 'wb') as f:
+            f.write(html)
+    return calls
+
+
+def _start_server(size):
+    import socketserver, threading
+
+    body = b'<html>' + b'x' * (size - 13) + b'</html>'
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            path = self.rfile.readline().split()[1]
+            while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            if path == b'/chunked':
+                self.wfile.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+                mv = memoryview(body)
+                for i in range(0, len(body), 16384):
+                    part = mv[i:i + 16384]
+                    self.wfile.write(b'%x\r\n' % len(part))
+                    self.wfile.write(part)
+                    self.wfile.write(b'\r\n')
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' % len(body))
+                self.wfile.write(body)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench(size=32 * 1024 * 1024, rounds=5):
+    import os, tempfile, tracemalloc
+    server = _start_server(size)
+    port = server.server_address[1]
+    out = os.path.join(tempfile.mkdtemp(), 'body.html')
+    print('body size: %.1f MB, %d rounds' % (size / 1048576, rounds))
+    cases = [
+        ('recv(1024) + join', lambda path: fetch_naive('127.0.0.1', path, port, out)),
+        ('recv_into streaming', lambda path: fetch('127.0.0.1', path, port, out).recv_calls),
+    ]
+    for path in ('/', '/chunked'):
+        for name, fn in cases:
+            best = None
+            for i in range(rounds):
+                start = time.perf_counter()
+                calls = fn(path)
+                t = time.perf_counter() - start
+                best = t if best is None else min(best, t)
+            # 峰值内存单独测一次，tracemalloc会拖慢速度
+            tracemalloc.start()
+            fn(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%-9s %-20s %8.1f ms  %7.1f MB/s  peak %7.2f MB  recv calls %d' % (
+                path, name, best * 1000, size / best / 1048576, peak / 1048576, calls))
+        if path == '/chunked':
+            print('          (recv(1024) + join writes the chunk framing into the file, it cannot decode chunked)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        bench()
     else:
-        break
-data = b''.join(buffer)
-s.close()
-header, html = data.split(b'\r\n\r\n', 1)
-print(header.decode('utf-8'))
-# 把接收的数据写入文件:
-with open('sina.html', 'wb') as f:
-    f.write(html)
+        r = fetch('www.sina.com.cn', out='sina.html')
+        print('HTTP %s %s' % (r.status, r.reason))
+        for k, v in r.headers:
+            print('%s: %s' % (k, v))
+        print('saved %d bytes to sina.html' % r.length)
@@ -1,10 +1,119 @@
-import socket
+'''
+    python3 UDP_client.py                                  # 发三个名字，和原来一样
+    python3 UDP_client.py --rate 50000 --duration 5        # 负载生成，统计每秒包数、丢包率和往返延迟
 
+负载模式下用多个socket（不同的源端口，SO_REUSEPORT才会分到不同的worker），
+包里带序号和发送时间，服务器原样放在'Hello, ...!'里返回。
+'''
 
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-for data in [b'Michael', b'Tracy', b'Sarah']:
-    # 发送数据:
-    s.sendto(data, ('127.0.0.1', 9999))
-    # 接收数据:
-    print(s.recv(1024).decode('utf-8'))
-s.close()
+import argparse, array, selectors, socket, struct, time
+
+PAYLOAD = struct.Struct('!Qd')  # 序号, 发送时间
+
+
+def run_once(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for data in [b'Michael', b'Tracy', b'Sarah']:
+        # 发送数据:
+        s.sendto(data, (host, port))
+        # 接收数据:
+        print(s.recv(1024).decode('utf-8'))
+    s.close()
+
+
+def load(host, port, rate, duration, sockets, result_queue=None, grace=0.5):
+    socks = []
+    sel = selectors.DefaultSelector()
+    for i in range(sockets):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        s.connect((host, port))
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ)
+        socks.append(s)
+    buf = bytearray(2048)
+    rtts = array.array('d')
+    sent = received = send_errors = 0
+    start = time.perf_counter()
+    end = start + duration
+    while True:
+        now = time.perf_counter()
+        if now >= end + grace:
+            break
+        if now < end:
+            # 按目标速率补发落后的包，每轮最多64个，rate为0时尽量快
+            due = 64 if not rate else min(int((now - start) * rate) - sent, 64)
+            for i in range(due):
+                try:
+                    socks[sent % sockets].send(PAYLOAD.pack(sent, time.perf_counter()))
+                except (BlockingIOError, InterruptedError):
+                    send_errors += 1
+                    break
+                sent += 1
+            timeout = 0 if due > 0 else 0.001
+        else:
+            timeout = 0.01
+        for key, mask in sel.select(timeout):
+            while True:
+                try:
+                    n = key.fileobj.recv_into(buf)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except ConnectionRefusedError:
+                    break
+                seq, t = PAYLOAD.unpack_from(buf, 7)
+                rtts.append(time.perf_counter() - t)
+                received += 1
+    for s in socks:
+        s.close()
+    result = dict(sent=sent, received=received, send_errors=send_errors, elapsed=min(time.perf_counter() - start, duration))
+    if result_queue is not None:
+        result['rtts'] = rtts.tobytes()
+        result_queue.put(result)
+    else:
+        result['rtts'] = rtts
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--rate', type=int, default=None, help='packets per second in total, 0 for as fast as possible')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--sockets', type=int, default=16, help='sockets per process')
+    parser.add_argument('--procs', type=int, default=1, help='sender processes')
+    args = parser.parse_args()
+    if args.rate is None:
+        run_once(args.host, args.port)
+        return
+    if args.procs == 1:
+        results = [load(args.host, args.port, args.rate, args.duration, args.sockets)]
+    else:
+        import multiprocessing
+        q = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=load, args=(args.host, args.port, args.rate / args.procs,
+                                                            args.duration, args.sockets, q)) for i in range(args.procs)]
+        for p in procs:
+            p.start()
+        results = [q.get() for p in procs]
+        for p in procs:
+            p.join()
+        for r in results:
+            rtts = array.array('d')
+            rtts.frombytes(r['rtts'])
+            r['rtts'] = rtts
+    sent = sum(r['sent'] for r in results)
+    received = sum(r['received'] for r in results)
+    elapsed = max(r['elapsed'] for r in results)
+    rtts = sorted(x for r in results for x in r['rtts'])
+    print('sent %d (%.0f pkt/s), received %d (%.0f pkt/s), loss %.2f%%, send errors %d' % (
+        sent, sent / elapsed, received, received / elapsed, (sent - received) * 100.0 / sent if sent else 0,
+        sum(r['send_errors'] for r in results)))
+    if rtts:
+        print('rtt: p50 %.3f ms, p99 %.3f ms, max %.3f ms' % (
+            rtts[len(rtts) // 2] * 1000, rtts[int(len(rtts) * 0.99)] * 1000, rtts[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,128 @@
-import socket
-
-
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-# 绑定端口:
-s.bind(('127.0.0.1', 9999))
-print('Bind UDP on 9999...')
-# 创建Socket时，SOCK_DGRAM指定了这个Socket的类型是UDP。
-# 绑定端口和TCP一样，但是不需要调用listen()方法，而是直接接收来自任何客户端的数据
-while True:
-    # 接收数据:
-    # recvfrom()方法返回数据和客户端的地址与端口，这样，服务器收到数据后，直接调用sendto()就可以把数据用UDP发给客户端。
-    data, addr = s.recvfrom(1024)
-    print('Received from %s:%s.' % addr)
-    s.sendto(b'Hello, %s!' % data, addr)
+'''
+    python3 UDP_server.py                  # 单个阻塞循环，和原来一样
+    python3 UDP_server.py --workers 4      # 多进程，SO_REUSEPORT共用端口
+
+多进程模式下每个worker:
+- 有自己的socket，内核按来源地址把数据报分给不同的worker
+- 调大收发缓冲区，突发流量时少丢包
+- 非阻塞socket，每次可读后循环recvfrom_into直到收空，省掉每个包一次select
+- 统计收发包数、发送缓冲区满丢掉的回复和每批收到的包数，主进程每秒汇总，并读取/proc/net/udp里内核的丢包计数
+'''
+
+import argparse, selectors, socket, time
+
+
+def serve_simple(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # 绑定端口:
+    s.bind((host, port))
+    print('Bind UDP on %d...' % port)
+    # 创建Socket时，SOCK_DGRAM指定了这个Socket的类型是UDP。
+    # 绑定端口和TCP一样，但是不需要调用listen()方法，而是直接接收来自任何客户端的数据
+    while True:
+        # 接收数据:
+        # recvfrom()方法返回数据和客户端的地址与端口，这样，服务器收到数据后，直接调用sendto()就可以把数据用UDP发给客户端。
+        data, addr = s.recvfrom(1024)
+        print('Received from %s:%s.' % addr)
+        s.sendto(b'Hello, %s!' % data, addr)
+
+
+# 每个worker在共享数组里占的计数器
+RECEIVED, SENT, SEND_DROPS, BATCHES, MAX_BATCH = range(5)
+NUM_COUNTERS = 5
+
+
+def worker(host, port, bufsize, counters, index, batch_max=256, report_interval=0.5):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufsize)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufsize)
+    s.bind((host, port))
+    s.setblocking(False)
+    sel = selectors.DefaultSelector()
+    sel.register(s, selectors.EVENT_READ)
+    buf = bytearray(65536)
+    mv = memoryview(buf)
+    # 计数先记在局部变量里，定期写到共享数组，避免每个包都加锁
+    stats = [0] * NUM_COUNTERS
+    base = index * NUM_COUNTERS
+    next_report = time.monotonic() + report_interval
+    while True:
+        if sel.select(report_interval):
+            n = 0
+            while n < batch_max:
+                try:
+                    size, addr = s.recvfrom_into(buf)
+                except (BlockingIOError, InterruptedError):
+                    break
+                n += 1
+                try:
+                    s.sendto(b'Hello, %s!' % mv[:size], addr)
+                    stats[SENT] += 1
+                except (BlockingIOError, InterruptedError):
+                    stats[SEND_DROPS] += 1
+            stats[RECEIVED] += n
+            stats[BATCHES] += 1
+            stats[MAX_BATCH] = max(stats[MAX_BATCH], n)
+        now = time.monotonic()
+        if now >= next_report:
+            next_report = now + report_interval
+            for i, v in enumerate(stats):
+                counters[base + i] = v
+
+
+def kernel_drops(port):
+    # /proc/net/udp最后一列是每个socket因接收缓冲区满被内核丢掉的包数
+    drops = 0
+    try:
+        with open('/proc/net/udp') as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if int(fields[1].split(':')[1], 16) == port:
+                    drops += int(fields[-1])
+    except (OSError, StopIteration, ValueError, IndexError):
+        return None
+    return drops
+
+
+def serve_workers(host, port, workers, bufsize):
+    import multiprocessing
+    counters = multiprocessing.Array('Q', workers * NUM_COUNTERS, lock=False)
+    procs = [multiprocessing.Process(target=worker, args=(host, port, bufsize, counters, i), daemon=True)
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    print('Bind UDP on %d with %d workers (SO_REUSEPORT, buffers %d KB)...' % (port, workers, bufsize // 1024))
+    last = [0] * workers
+    last_time = time.monotonic()
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            per_worker = []
+            for i in range(workers):
+                received = counters[i * NUM_COUNTERS + RECEIVED]
+                per_worker.append((received - last[i]) / (now - last_time))
+                last[i] = received
+            last_time = now
+            total = [sum(counters[i * NUM_COUNTERS + k] for i in range(workers)) for k in range(NUM_COUNTERS)]
+            print('%8.0f pkt/s %s | received %d, sent %d, send drops %d, kernel drops %s, avg batch %.1f, max batch %d' % (
+                sum(per_worker), ' '.join('%.0f' % r for r in per_worker), total[RECEIVED], total[SENT],
+                total[SEND_DROPS], kernel_drops(port), total[RECEIVED] / total[BATCHES] if total[BATCHES] else 0,
+                max(counters[i * NUM_COUNTERS + MAX_BATCH] for i in range(workers))))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--workers', type=int, default=0, help='number of SO_REUSEPORT worker processes')
+    parser.add_argument('--bufsize', type=int, default=4 * 1024 * 1024, help='socket send/receive buffer size')
+    args = parser.parse_args()
+    if args.workers:
+        serve_workers(args.host, args.port, args.workers, args.bufsize)
+    else:
+        serve_simple(args.host, args.port)
@@ -1,14 +1,109 @@
-import socket
+'''
+    python3 cliennt.py                    # 单个客户端，和原来一样
+    python3 cliennt.py --clients 10000    # 负载生成：用asyncio同时维持上万个连接
+'''
 
+import argparse, asyncio, socket, time
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-# 建立连接:
-s.connect(('127.0.0.1', 9999))
-# 接收欢迎消息:
-print(s.recv(1024).decode('utf-8'))
-for data in [b'Michael', b'Tracy', b'Sarah']:
-    # 发送数据:
-    s.send(data)
+
+def run_once(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # 建立连接:
+    s.connect((host, port))
+    # 接收欢迎消息:
     print(s.recv(1024).decode('utf-8'))
-s.send(b'exit')
-s.close()
+    for data in [b'Michael', b'Tracy', b'Sarah']:
+        # 发送数据:
+        s.send(data)
+        print(s.recv(1024).decode('utf-8'))
+    s.send(b'exit')
+    s.close()
+
+
+class Load(object):
+
+    def __init__(self):
+        self.open = self.peak = self.done = self.failed = 0
+        self.latencies = []
+
+
+async def client(host, port, names, load, connect_sem):
+    async with connect_sem:
+        reader, writer = await asyncio.open_connection(host, port)
+    load.open += 1
+    load.peak = max(load.peak, load.open)
+    try:
+        if not (await reader.read(1024)).startswith(b'Welcome'):
+            raise ValueError('bad welcome')
+        for name in names:
+            start = time.monotonic()
+            writer.write(name)
+            reply = await reader.read(1024)
+            if reply != b'Hello, ' + name + b'!':
+                raise ValueError('bad reply %r' % reply)
+            load.latencies.append(time.monotonic() - start)
+        writer.write(b'exit')
+        await writer.drain()
+        # 等服务器关闭连接
+        await reader.read()
+    finally:
+        load.open -= 1
+        writer.close()
+
+
+async def run_load(host, port, clients, connect_concurrency):
+    load = Load()
+    # 限制同时进行中的connect，避免瞬间打满服务器的accept队列
+    connect_sem = asyncio.Semaphore(connect_concurrency)
+    names = [b'Michael', b'Tracy', b'Sarah']
+
+    async def one():
+        try:
+            await client(host, port, names, load, connect_sem)
+            load.done += 1
+        except (OSError, ValueError) as e:
+            load.failed += 1
+            if load.failed <= 5:
+                print('client failed: %r' % e)
+
+    async def report():
+        while True:
+            await asyncio.sleep(1)
+            print('open %d (peak %d), done %d, failed %d' % (load.open, load.peak, load.done, load.failed))
+
+    start = time.monotonic()
+    reporter = asyncio.ensure_future(report())
+    await asyncio.gather(*[one() for i in range(clients)])
+    reporter.cancel()
+    elapsed = time.monotonic() - start
+    lat = sorted(load.latencies)
+    print('%d clients in %.1fs: done %d, failed %d, peak concurrent %d' % (
+        clients, elapsed, load.done, load.failed, load.peak))
+    if lat:
+        print('reply latency: p50 %.3fs, p99 %.3fs, max %.3fs' % (
+            lat[len(lat) // 2], lat[int(len(lat) * 0.99)], lat[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--clients', type=int, default=0, help='number of concurrent clients for a load test')
+    parser.add_argument('--connect-concurrency', type=int, default=1000)
+    args = parser.parse_args()
+    if not args.clients:
+        run_once(args.host, args.port)
+        return
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        if hard < args.clients + 100:
+            print('warning: open file limit %d is below %d clients' % (hard, args.clients))
+    except (ImportError, ValueError, OSError):
+        pass
+    asyncio.run(run_load(args.host, args.port, args.clients, args.connect_concurrency))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,20 @@
-import socket
-import threading
-import time
+'''
+Welcome/Hello/exit协议的TCP服务器，两种模式:
+
+    python3 server.py             # 每个连接一个线程（原来的写法）
+    python3 server.py --event     # selectors事件循环，单线程处理上万个连接
+    python3 server.py --event --framed   # 消息带长度和请求id，见Framing.py
+
+事件模式下:
+- listen的backlog用系统允许的最大值，每次可读时循环accept直到没有新连接
+- 每个连接有自己的输入/输出缓冲区，一轮事件里产生的回复合并成一次send，没发完的部分等可写时再发
+- 原来每条消息time.sleep(1)，这里改成定时器，等待期间不占线程
+- 超过idle_timeout没有收发数据的连接会被关闭
+'''
+
+import argparse, collections, heapq, itertools, selectors, socket, threading, time
+
+import Framing
 
 
 def tcplink(sock, addr):
@@ -16,14 +30,221 @@ def tcplink(sock, addr):
     print('Connection from %s:%s closed.' % addr)
 
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind(('127.0.0.1', 9999))
-s.listen(5)
-print('Waiting for connection..')
-while True:
-    # 接受一个新连接:
-    sock, addr = s.accept()
-    # 创建新线程来处理TCP连接:
-    t = threading.Thread(target=tcplink, args=(sock, addr))
-    t.start()
+def serve_threads(host, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((host, port))
+    s.listen(5)
+    print('Waiting for connection..')
+    while True:
+        # 接受一个新连接:
+        sock, addr = s.accept()
+        # 创建新线程来处理TCP连接:
+        t = threading.Thread(target=tcplink, args=(sock, addr))
+        t.start()
+
+
+class Connection(object):
+    __slots__ = ('sock', 'addr', 'inbuf', 'decoder', 'outbuf', 'want_write', 'last_active', 'closed', 'closing')
+
+    def __init__(self, sock, addr, framed):
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.decoder = Framing.FrameDecoder() if framed else None
+        self.outbuf = bytearray()
+        self.want_write = False  # 是否在等可写事件
+        self.last_active = time.monotonic()
+        self.closed = False
+        self.closing = False  # 输出缓冲区发完后关闭
+
+
+class EventServer(object):
+
+    def __init__(self, host, port, backlog=socket.SOMAXCONN, idle_timeout=60, delay=1.0, framed=False, verbose=False):
+        self.sel = selectors.DefaultSelector()
+        self.lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.lsock.bind((host, port))
+        self.lsock.listen(backlog)
+        self.lsock.setblocking(False)
+        self.sel.register(self.lsock, selectors.EVENT_READ, None)
+        self.idle_timeout = idle_timeout
+        self.delay = delay
+        self.framed = framed
+        self.verbose = verbose
+        # 按最后活跃时间排序，超时检查只需要看开头几个
+        self.conns = collections.OrderedDict()
+        self.timers = []  # (时间, 序号, 连接, 请求id, 数据)
+        self.pending = set()  # 输出缓冲区有新数据、本轮结束时要写的连接
+        self._seq = itertools.count()
+        self.stats = collections.Counter()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self.lsock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # 文件描述符用完等情况，下次再接受
+                print('accept failed: %s' % e)
+                return
+            sock.setblocking(False)
+            conn = Connection(sock, addr, self.framed)
+            self.conns[sock.fileno()] = conn
+            self.sel.register(sock, selectors.EVENT_READ, conn)
+            self.stats['accepted'] += 1
+            self.stats['peak'] = max(self.stats['peak'], len(self.conns))
+            if self.verbose:
+                print('Accept new connection from %s:%s...' % addr)
+            self._send(conn, Framing.pack(Framing.WELCOME_ID, b'Welcome!') if self.framed else b'Welcome!')
+
+    def _touch(self, conn):
+        conn.last_active = time.monotonic()
+        self.conns.move_to_end(conn.sock.fileno())
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        self._touch(conn)
+        if conn.decoder is not None:
+            try:
+                messages = conn.decoder.feed(data)
+            except ValueError:
+                self._close(conn)
+                return
+        else:
+            # 协议没有分帧，和原来一样把一次收到的数据当作一条消息
+            conn.inbuf += data
+            messages = [(None, bytes(conn.inbuf))]
+            conn.inbuf.clear()
+        for req_id, msg in messages:
+            self.stats['messages'] += 1
+            if self.delay > 0:
+                heapq.heappush(self.timers, (time.monotonic() + self.delay, next(self._seq), conn, req_id, msg))
+            else:
+                self._reply(conn, req_id, msg)
+
+    def _reply(self, conn, req_id, msg):
+        if conn.closed or conn.closing:
+            return
+        if msg == b'exit':
+            conn.closing = True
+            self.pending.add(conn)
+            return
+        reply = ('Hello, %s!' % msg.decode('utf-8', 'replace')).encode('utf-8')
+        self._send(conn, reply if req_id is None else Framing.pack(req_id, reply))
+
+    def _send(self, conn, data):
+        # 先放进输出缓冲区，本轮事件处理完后在_flush()里一次写出
+        conn.outbuf += data
+        self.pending.add(conn)
+
+    def _flush(self):
+        for conn in self.pending:
+            if not conn.closed:
+                self._write(conn)
+        self.pending.clear()
+
+    def _write(self, conn):
+        if conn.outbuf:
+            try:
+                n = conn.sock.send(conn.outbuf)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError:
+                self._close(conn)
+                return
+            del conn.outbuf[:n]
+        if conn.outbuf:
+            if not conn.want_write:
+                conn.want_write = True
+                self.sel.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+        elif conn.closing:
+            self._close(conn)
+        elif conn.want_write:
+            conn.want_write = False
+            self.sel.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def _close(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self.sel.unregister(conn.sock)
+        del self.conns[conn.sock.fileno()]
+        conn.sock.close()
+        self.stats['closed'] += 1
+        if self.verbose:
+            print('Connection from %s:%s closed.' % conn.addr)
+
+    def _expire(self, now):
+        while self.conns:
+            conn = next(iter(self.conns.values()))
+            if now - conn.last_active < self.idle_timeout:
+                break
+            self.stats['idle_closed'] += 1
+            self._close(conn)
+
+    def serve_forever(self, report_interval=5):
+        next_report = time.monotonic() + report_interval
+        while True:
+            now = time.monotonic()
+            timeout = 1.0
+            if self.timers:
+                timeout = min(timeout, max(self.timers[0][0] - now, 0))
+            for key, mask in self.sel.select(timeout):
+                conn = key.data
+                if conn is None:
+                    self._accept()
+                    continue
+                if mask & selectors.EVENT_READ and not conn.closed:
+                    self._read(conn)
+                if mask & selectors.EVENT_WRITE and not conn.closed:
+                    self._write(conn)
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                when, seq, conn, req_id, msg = heapq.heappop(self.timers)
+                self._reply(conn, req_id, msg)
+            self._flush()
+            self._expire(now)
+            if now >= next_report:
+                next_report = now + report_interval
+                print('connections: %d (peak %d), accepted %d, messages %d, idle closed %d' % (
+                    len(self.conns), self.stats['peak'], self.stats['accepted'], self.stats['messages'],
+                    self.stats['idle_closed']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--event', action='store_true', help='single-threaded selectors server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--idle-timeout', type=float, default=60)
+    parser.add_argument('--delay', type=float, default=1.0, help='seconds before each reply')
+    parser.add_argument('--framed', action='store_true', help='length-prefixed messages with request ids')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    if not args.event:
+        serve_threads(args.host, args.port)
+        return
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        # 每个连接一个文件描述符，尽量调高上限
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    server = EventServer(args.host, args.port, idle_timeout=args.idle_timeout, delay=args.delay, framed=args.framed, verbose=args.verbose)
+    print('Waiting for connection on %s:%s (event mode)..' % (args.host, args.port))
+    server.serve_forever()
+
 
+if __name__ == '__main__':
+    main()
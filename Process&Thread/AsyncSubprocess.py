@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''
+ChildProcess.py里的subprocess.call和communicate()会阻塞调用者，并且把输出全部读进内存再一次性解码。
+这里用asyncio同时跑很多外部命令:
+
+    pool = SubprocessPool(concurrency=8, timeout=60)
+    result = await pool.run(['nslookup', 'www.python.org'], stdout=print, stderr='err.log')
+    results = await pool.map([['ls', '-l'], ['git', 'status']], stdout=callback)
+
+- 同时运行的命令数不超过concurrency，其余排队；同一个pool可以在不同的事件循环里用，并发数按循环分别计算
+- stdout/stderr边读边按行交给回调（普通函数或协程函数），或写进文件（路径或已打开的文本文件），不在内存里攒输出
+- 每个命令可以单独设置超时，超时先发SIGTERM，kill_grace秒后还没退出就SIGKILL；
+  命令在自己的进程组里运行，shell=True时由shell启动的子进程也一起结束
+- 不写死gbk：先看BOM，再试UTF-8和系统默认编码，装了charset_normalizer时用它猜，最后依次试FALLBACK_ENCODINGS
+
+    python3 AsyncSubprocess.py    # 用本机python命令演示并发、流式输出、超时升级和编码识别
+'''
+
+import asyncio, codecs, collections, locale, os, signal, subprocess, sys, time, weakref
+
+try:
+    import charset_normalizer
+except ImportError:
+    charset_normalizer = None
+
+Result = collections.namedtuple('Result', ['args', 'returncode', 'elapsed', 'timed_out', 'stdout_encoding', 'stderr_encoding'])
+
+# 前面都判断不出来时依次尝试，gb18030兼容gbk（原来ChildProcess.py写死的编码），latin-1什么字节都能解码
+FALLBACK_ENCODINGS = ('gb18030', 'latin-1')
+
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+
+def detect_encoding(data):
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    for encoding in ('utf-8', locale.getpreferredencoding(False)):
+        try:
+            # 样本可能在多字节字符中间截断，用增量解码器且final=False，末尾不完整的字符不算错
+            codecs.getincrementaldecoder(encoding)().decode(data, final=False)
+            return codecs.lookup(encoding).name
+        except (UnicodeDecodeError, LookupError):
+            pass
+    if charset_normalizer is not None:
+        best = charset_normalizer.from_bytes(data).best()
+        if best is not None:
+            return best.encoding
+    for encoding in FALLBACK_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(data, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            pass
+    return 'latin-1'
+
+
+class _LineSplitter(object):
+    '''
+    Splits a byte stream into decoded lines. Unless an encoding is given, it is detected
+    from the first line with non-ASCII bytes (or the first sample_size bytes without a newline).
+    '''
+
+    def __init__(self, encoding=None, sample_size=4096):
+        self.encoding = encoding
+        self.sample_size = sample_size
+        self._decoder = None
+        self._pending = b''  # 编码确定之前攒的字节
+        self._partial = ''  # 还没遇到换行的半行
+
+    def _start(self):
+        if self.encoding is None:
+            self.encoding = detect_encoding(self._pending)
+        self._decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        data, self._pending = self._pending, b''
+        return self._decode(data, False)
+
+    def _decode(self, data, final):
+        text = self._partial + self._decoder.decode(data, final)
+        lines = text.splitlines(True)
+        if lines and not final and not lines[-1].endswith(('\n', '\r')):
+            self._partial = lines.pop()
+        else:
+            self._partial = ''
+        return lines
+
+    def feed(self, data):
+        if self._decoder is not None:
+            return self._decode(data, False)
+        self._pending += data
+        if self._pending.startswith(tuple(bom for bom, encoding in _BOMS)):
+            return self._start()
+        # 编码还没确定时，纯ASCII的整行在各种候选编码下都一样，马上交出去，不让输出少的命令一直憋着
+        end = self._pending.rfind(b'\n') + 1
+        if not self._pending[:end].isascii():
+            return self._start()
+        lines = self._pending[:end].decode('ascii').splitlines(True)
+        self._pending = self._pending[end:]
+        if len(self._pending) >= self.sample_size:
+            return lines + self._start()
+        return lines
+
+    def close(self):
+        lines = self._start() if self._decoder is None else []
+        return lines + self._decode(b'', True)
+
+
+def _make_sink(target):
+    '''
+    Returns (write_line, close) for a callback, a coroutine function, a path or an open text file.
+    '''
+    if target is None:
+        return None, None
+    if isinstance(target, (str, os.PathLike)):
+        f = open(target, 'a', encoding='utf-8')
+        return f.write, f.close
+    if hasattr(target, 'write'):
+        return target.write, target.flush
+    return target, None
+
+
+async def _pump(reader, sink, encoding, read_size=65536):
+    write, close = _make_sink(sink)
+    splitter = _LineSplitter(encoding)
+    try:
+        while True:
+            # 按块读再自己分行，单行再长也不会触发StreamReader的行长度限制
+            data = await reader.read(read_size)
+            lines = splitter.feed(data) if data else splitter.close()
+            if write is not None:
+                for line in lines:
+                    r = write(line)
+                    if asyncio.iscoroutine(r):
+                        await r
+            if not data:
+                return splitter.encoding
+    finally:
+        if close is not None:
+            close()
+
+
+async def _feed(writer, data):
+    if data is None:
+        return
+    try:
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # 子进程没读完输入就退出了，或者已经被杀掉
+        pass
+
+
+class SubprocessPool(object):
+
+    def __init__(self, concurrency=None, timeout=None, kill_grace=5.0, encoding=None):
+        self.concurrency = concurrency or os.cpu_count()
+        self.timeout = timeout
+        self.kill_grace = kill_grace
+        self.encoding = encoding
+        # 事件循环 => 信号量；信号量只能在创建它的循环里用，同一个pool先后被多次asyncio.run()时各用各的
+        self._sems = weakref.WeakKeyDictionary()
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        sem = self._sems.get(loop)
+        if sem is None:
+            sem = self._sems[loop] = asyncio.Semaphore(self.concurrency)
+        return sem
+
+    def _signal(self, proc, sig):
+        try:
+            # 子进程自己是进程组组长（start_new_session）时发给整组，shell启动的子进程一起结束；
+            # 调用方传了start_new_session=False时它和我们同组，只能发给它自己
+            if os.name == 'posix' and os.getpgid(proc.pid) == proc.pid:
+                os.killpg(proc.pid, sig)
+            else:
+                proc.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+    async def _stop(self, proc):
+        # 先礼后兵：SIGTERM，等kill_grace秒，再SIGKILL
+        self._signal(proc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), self.kill_grace)
+        except asyncio.TimeoutError:
+            self._signal(proc, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            await proc.wait()
+
+    async def run(self, args, stdout=None, stderr=None, input=None, timeout=None, shell=False, encoding=None, **kw):
+        '''
+        Run one command and return a Result. stdout/stderr take a callable(line), a coroutine function,
+        a path or a text file; output that has no sink is discarded, never buffered.
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        encoding = encoding or self.encoding
+        async with self._semaphore():
+            start = time.monotonic()
+            kw.setdefault('start_new_session', os.name == 'posix')
+            pipes = dict(stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if shell:
+                proc = await asyncio.create_subprocess_shell(args, **pipes, **kw)
+            else:
+                proc = await asyncio.create_subprocess_exec(*args, **pipes, **kw)
+            # 先开始读输出再写输入：子进程边读stdin边写stdout时，没人读的stdout管道写满会和我们的drain()互相等待
+            pumps = asyncio.gather(_pump(proc.stdout, stdout, encoding), _pump(proc.stderr, stderr, encoding))
+            feeder = asyncio.ensure_future(_feed(proc.stdin, input))
+            timed_out = False
+            try:
+                # 输入写完、输出读完（管道关闭）且进程退出才算结束，写输入也受超时限制
+                await asyncio.wait_for(asyncio.shield(asyncio.gather(pumps, feeder, proc.wait())), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                await self._stop(proc)
+            except BaseException:
+                # 被取消，或者回调抛了异常：结束进程再往上抛
+                pumps.cancel()
+                feeder.cancel()
+                await self._stop(proc)
+                raise
+            # 被杀掉后孙进程可能还拿着管道，读到EOF前最多再等kill_grace秒
+            try:
+                out_encoding, err_encoding = await asyncio.wait_for(pumps, self.kill_grace)
+            except asyncio.TimeoutError:
+                out_encoding = err_encoding = None
+            return Result(args, proc.returncode, time.monotonic() - start, timed_out, out_encoding, err_encoding)
+
+    async def map(self, commands, **kw):
+        # 并发数由信号量限制，所以可以一次把所有命令都交给gather
+        return await asyncio.gather(*(self.run(args, **kw) for args in commands))
+
+
+async def demo():
+    py = sys.executable
+    pool = SubprocessPool(concurrency=3, timeout=2, kill_grace=1)
+
+    def prefixed(name):
+        return lambda line: print('[%s] %s' % (name, line.rstrip('\n')))
+
+    jobs = [
+        ('count', [py, '-u', '-c', 'import time\nfor i in range(3):\n    print("line", i); time.sleep(0.3)']),
+        ('stderr', [py, '-c', 'import sys; sys.stderr.write("something went wrong\\n"); sys.exit(3)']),
+        ('gbk', [py, '-c', 'import sys; sys.stdout.buffer.write("你好，世界\\n".encode("gbk"))']),
+        ('utf8', [py, '-c', 'import sys; sys.stdout.buffer.write("你好，世界\\n".encode("utf-8"))']),
+        ('sleeper', [py, '-c', 'import time; print("sleeping", flush=True); time.sleep(60)']),
+        ('stubborn', [py, '-c', 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                                'print("ignoring SIGTERM", flush=True); time.sleep(60)']),
+    ]
+    start = time.monotonic()
+    results = await asyncio.gather(*(pool.run(args, stdout=prefixed(name), stderr=prefixed(name + ':err'))
+                                     for name, args in jobs))
+    for (name, args), r in zip(jobs, results):
+        print('%-9s exit %s, %.2fs, timed out %s, stdout encoding %s' % (
+            name, r.returncode, r.elapsed, r.timed_out, r.stdout_encoding))
+    print('%d commands, concurrency %d: %.2fs' % (len(jobs), pool.concurrency, time.monotonic() - start))
+
+    # 大量输出直接写文件，不占内存
+    path = 'subprocess_demo.log'
+    r = await pool.run([py, '-c', 'for i in range(200000): print("row %d" % i)'], stdout=path)
+    with open(path, encoding='utf-8') as f:
+        print('wrote %d lines to %s in %.2fs' % (sum(1 for line in f), path, r.elapsed))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    asyncio.run(demo())
@@ -0,0 +1,222 @@
+'''
+在ProcessPool.py的Pool上做的并行map:
+
+    for result in parallel_map(func, items):             # 按输入顺序返回
+        ...
+    for result in parallel_map(func, items, ordered=False):  # 谁先做完先返回
+
+- 进程数默认os.cpu_count()
+- 不固定chunksize：先一个一个地发，根据worker回报的每个任务耗时调整，让每批大约跑target_chunk_time秒，
+  小任务一批打包很多个，IPC开销摊薄；快结束时批次变小，各个进程差不多同时做完
+- 结果边做边返回，同时在路上的批次有上限，输入可以是生成器，不会一下子全读进内存
+- 进度和吞吐量定期打印到stderr，也可以传一个函数自己处理
+- worker里的异常带着原来的traceback和出错的输入下标在主进程抛出TaskError
+
+    python3 ParallelMap.py    # 小任务下逐个apply_async和parallel_map的对比
+'''
+
+import os, queue, sys, time, traceback
+from multiprocessing import Pool
+
+
+class TaskError(Exception):
+    '''
+    A task raised in a worker; index is the position of the failing item in the input.
+    '''
+
+    def __init__(self, index, item, error, tb):
+        super(TaskError, self).__init__('task %d (%r) failed: %s\n\nRemote traceback:\n%s' % (index, item, error, tb))
+        self.index = index
+        self.item = item
+        self.remote_traceback = tb
+
+
+def _run_chunk(func, start, items):
+    # 在worker进程里执行一批任务，返回(起始下标, 结果, 耗时, 错误)
+    results = []
+    t = time.perf_counter()
+    for i, item in enumerate(items):
+        try:
+            results.append(func(item))
+        except Exception as e:
+            error = (start + i, repr(item), '%s: %s' % (type(e).__name__, e), traceback.format_exc())
+            return start, results, time.perf_counter() - t, error
+    return start, results, time.perf_counter() - t, None
+
+
+class Progress(object):
+    '''
+    Default progress reporter: one line on stderr every interval seconds.
+    '''
+
+    def __init__(self, interval=1.0, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.start = time.monotonic()
+        self.last = 0
+
+    def __call__(self, done, total, chunksize, final=False):
+        now = time.monotonic()
+        if not final and now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0
+        if total is not None:
+            eta = (total - done) / rate if rate else float('inf')
+            line = '%d/%d (%.1f%%) %.0f items/s, avg chunksize %d, eta %.1fs' % (
+                done, total, done * 100.0 / total if total else 100, rate, chunksize, eta)
+        else:
+            line = '%d %.0f items/s, avg chunksize %d' % (done, rate, chunksize)
+        self.stream.write('\r' + line + ('\n' if final else ''))
+        self.stream.flush()
+
+
+class _ChunkSizer(object):
+    '''
+    Picks the next chunk size from the measured per-item time (exponential moving average).
+    '''
+
+    def __init__(self, processes, target_chunk_time, max_chunksize):
+        self.processes = processes
+        self.target = target_chunk_time
+        self.max_chunksize = max_chunksize
+        self.per_item = None
+
+    def record(self, n, elapsed):
+        if not n:
+            return
+        t = elapsed / n
+        self.per_item = t if self.per_item is None else 0.7 * self.per_item + 0.3 * t
+
+    def next(self, remaining):
+        if self.per_item is None:
+            # 还没有测量结果，先每批一个
+            return 1
+        size = int(self.target / self.per_item) if self.per_item > 0 else self.max_chunksize
+        if remaining is not None:
+            # 剩下的任务至少分成每个进程2批，避免最后一个大批次拖尾
+            size = min(size, -(-remaining // (self.processes * 2)))
+        return max(1, min(size, self.max_chunksize))
+
+
+def parallel_map(func, iterable, processes=None, ordered=True, chunksize=None, target_chunk_time=0.05,
+                 max_chunksize=10000, progress=True, pool=None):
+    '''
+    Yield func(item) for every item, computed in a process pool.
+    chunksize=None sizes chunks from the measured task duration; pass an int to fix it.
+    progress may be True (print to stderr), False or a callable(done, total, chunksize, final=False).
+    '''
+    processes = processes or (pool._processes if pool is not None else os.cpu_count())
+    try:
+        total = len(iterable)
+    except TypeError:
+        total = None
+    if progress is True:
+        progress = Progress()
+    sizer = _ChunkSizer(processes, target_chunk_time, max_chunksize)
+    own_pool = pool is None
+    if own_pool:
+        pool = Pool(processes)
+    # 结果由Pool的结果线程通过回调放进这个队列
+    finished = queue.Queue()
+    it = iter(iterable)
+    index = 0  # 下一个要发出去的输入下标
+    exhausted = False
+    in_flight = 0  # 已发出、还没交给调用者的批次数（有序模式下包括已完成但在等前面批次的）
+    max_in_flight = processes * 4
+    buffered = dict()  # 有序模式：起始下标 => 结果
+    next_index = 0  # 有序模式下一个要返回的下标
+    chunk_items = dict()  # 起始下标 => 输入，用于报错时给出出错的输入
+    done = 0
+    chunks = 0
+    try:
+        while True:
+            while not exhausted and in_flight < max_in_flight:
+                current = chunksize or sizer.next(None if total is None else total - index)
+                items = []
+                for item in it:
+                    items.append(item)
+                    if len(items) >= current:
+                        break
+                if len(items) < current:
+                    exhausted = True
+                if not items:
+                    break
+                chunk_items[index] = items
+                pool.apply_async(_run_chunk, (func, index, items), callback=finished.put,
+                                 error_callback=lambda e, start=index: finished.put((start, [], 0, (start, '?', repr(e), ''))))
+                index += len(items)
+                in_flight += 1
+            if in_flight == 0:
+                break
+            start, results, elapsed, error = finished.get()
+            items = chunk_items.pop(start)
+            if error is not None:
+                i, item_repr, message, tb = error
+                raise TaskError(i, items[i - start] if i - start < len(items) else item_repr, message, tb)
+            sizer.record(len(results), elapsed)
+            chunks += 1
+            if ordered:
+                buffered[start] = results
+                while next_index in buffered:
+                    results = buffered.pop(next_index)
+                    next_index += len(results)
+                    in_flight -= 1
+                    done += len(results)
+                    for r in results:
+                        yield r
+            else:
+                in_flight -= 1
+                done += len(results)
+                for r in results:
+                    yield r
+            if progress:
+                progress(done, total, done // chunks if chunks else 0)
+        if progress:
+            progress(done, total, done // chunks if chunks else 0, final=True)
+    finally:
+        if own_pool:
+            # 正常结束时worker都空闲；出错或调用者提前停止迭代时直接结束剩下的任务
+            pool.terminate()
+            pool.join()
+
+
+def small_task(n):
+    # 每个任务只有几十微秒的计算，逐个提交时IPC开销占大头
+    return sum(i * i for i in range(n))
+
+
+def failing_task(n):
+    if n == 7:
+        raise ValueError('bad input %d' % n)
+    return n
+
+
+if __name__ == '__main__':
+    N = 20000
+    print('Parent process %s, %d workers.' % (os.getpid(), os.cpu_count()))
+
+    start = time.perf_counter()
+    with Pool(os.cpu_count()) as p:
+        pending = [p.apply_async(small_task, (200,)) for i in range(N)]
+        naive = [r.get() for r in pending]
+    naive_time = time.perf_counter() - start
+    print('apply_async one by one: %.2fs, %.0f tasks/s' % (naive_time, N / naive_time))
+
+    start = time.perf_counter()
+    results = list(parallel_map(small_task, [200] * N))
+    elapsed = time.perf_counter() - start
+    assert results == naive
+    print('parallel_map ordered:   %.2fs, %.0f tasks/s' % (elapsed, N / elapsed))
+
+    start = time.perf_counter()
+    results = list(parallel_map(small_task, (200 for i in range(N)), ordered=False, progress=False))
+    elapsed = time.perf_counter() - start
+    assert len(results) == N
+    print('parallel_map unordered, generator input: %.2fs, %.0f tasks/s' % (elapsed, N / elapsed))
+
+    try:
+        list(parallel_map(failing_task, range(20), progress=False))
+    except TaskError as e:
+        print('TaskError at index %d:\n%s' % (e.index, e))
@@ -1,14 +1,138 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import random, time, queue
+'''
+分布式任务队列的master端。
+
+原来每次task.put/task.get只传一个整数，每次都是一次网络往返；这里改成通过BaseManager注册一个TaskBroker:
+- put_many/exchange一次传一批任务和结果
+- worker一直拉取任务，不再固定做10个就退出
+- worker定期发心跳，超时没有心跳的worker手上的任务重新放回队列
+- master用get_results边收边处理结果
+
+    python3 task_master.py --tasks 100000 --batch 200 --local-workers 4   # 本机起4个worker做基准测试
+    python3 task_master.py --host 0.0.0.0 --tasks 1000                    # 等其他机器上的task_worker.py连进来
+'''
+
+import argparse, collections, itertools, random, threading, time
 from multiprocessing import freeze_support
 from multiprocessing.managers import BaseManager
 
-# 发送任务的队列:
-task_queue = queue.Queue()
-# 接收结果的队列:
-result_queue = queue.Queue()
+
+class TaskBroker(object):
+    '''
+    运行在manager的服务进程里，每个客户端连接一个线程，所有方法都加锁。
+    '''
+
+    def __init__(self, heartbeat_timeout=10):
+        self.heartbeat_timeout = heartbeat_timeout
+        self._cond = threading.Condition()
+        self._pending = collections.deque()  # (任务id, 任务)
+        self._in_flight = dict()  # worker id => {任务id: 任务}
+        self._last_seen = dict()  # worker id => 最后一次心跳时间
+        self._results = collections.deque()  # (任务id, 结果)
+        self._ids = itertools.count()
+        self._closed = False
+        self._stats = collections.Counter()
+        threading.Thread(target=self._reap, daemon=True).start()
+
+    def _wait(self, ready, timeout):
+        # 在锁内等待ready()为真，超时返回False
+        deadline = time.monotonic() + timeout
+        while not ready():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def put_many(self, tasks):
+        with self._cond:
+            ids = []
+            for task in tasks:
+                task_id = next(self._ids)
+                self._pending.append((task_id, task))
+                ids.append(task_id)
+            self._stats['submitted'] += len(ids)
+            self._cond.notify_all()
+            return ids
+
+    def exchange(self, worker_id, results, n, timeout):
+        '''
+        Hand in finished results and take up to n new tasks in one round trip.
+        Returns None once the broker is closed and the queue is empty.
+        '''
+        with self._cond:
+            self._last_seen[worker_id] = time.monotonic()
+            if results:
+                mine = self._in_flight.get(worker_id, {})
+                for task_id, result in results:
+                    # 已经因为心跳超时被重新分配的任务，迟到的结果丢掉，不算完成
+                    if mine.pop(task_id, None) is None:
+                        self._stats['late'] += 1
+                        continue
+                    self._results.append((task_id, result))
+                    self._stats['completed'] += 1
+                self._cond.notify_all()
+            if not self._wait(lambda: self._pending or self._closed, timeout):
+                return []
+            if not self._pending:
+                return None
+            # 等待期间可能已经被_reap当成死掉删了，分任务前重新登记，否则这批任务没人再检查
+            self._last_seen[worker_id] = time.monotonic()
+            batch = [self._pending.popleft() for i in range(min(n, len(self._pending)))]
+            self._in_flight.setdefault(worker_id, {}).update(batch)
+            return batch
+
+    def get_heartbeat_timeout(self):
+        # worker据此决定心跳间隔
+        return self.heartbeat_timeout
+
+    def heartbeat(self, worker_id):
+        with self._cond:
+            self._last_seen[worker_id] = time.monotonic()
+
+    def get_results(self, n, timeout):
+        with self._cond:
+            if not self._wait(lambda: self._results, timeout):
+                return []
+            return [self._results.popleft() for i in range(min(n, len(self._results)))]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, pending=len(self._pending), results=len(self._results), workers=len(self._last_seen),
+                        in_flight=sum(len(t) for t in self._in_flight.values()))
+
+    def _reap(self):
+        while True:
+            time.sleep(self.heartbeat_timeout / 4)
+            with self._cond:
+                now = time.monotonic()
+                for worker_id, last in list(self._last_seen.items()):
+                    if now - last < self.heartbeat_timeout:
+                        continue
+                    del self._last_seen[worker_id]
+                    tasks = self._in_flight.pop(worker_id, {})
+                    # 放回队首，尽快被别的worker领走
+                    self._pending.extendleft(reversed(list(tasks.items())))
+                    self._stats['dead_workers'] += 1
+                    self._stats['requeued'] += len(tasks)
+                    print('worker %s missed heartbeats, requeued %d tasks' % (worker_id, len(tasks)))
+                    self._cond.notify_all()
+
+
+broker = None
+
+
+def init_broker(heartbeat_timeout):
+    # manager.start()的initializer，在服务进程里创建broker
+    global broker
+    broker = TaskBroker(heartbeat_timeout)
 
 
 # 从BaseManager继承的QueueManager:
@@ -16,45 +140,66 @@ class QueueManager(BaseManager):
     pass
 
 
-def return_task_queue():
-    global task_queue
-    return task_queue
-
-
-def return_result_queue():
-    global result_queue
-    return result_queue
-
-
-def test():
-    # 把两个Queue都注册到网络上, callable参数关联了Queue对象:
-    # QueueManager.register('get_task_queue', callable=lambda: task_queue)
-    # QueueManager.register('get_result_queue', callable=lambda: result_queue)
-    QueueManager.register('get_task_queue', callable=return_task_queue)
-    QueueManager.register('get_result_queue', callable=return_result_queue)
-
-    # 绑定端口5000, 设置验证码'abc':
-    manager = QueueManager(address=('192.168.0.103', 5000), authkey=b'abc')
-    # 启动Queue:
-    manager.start()
-    # 获得通过网络访问的Queue对象:
-    task = manager.get_task_queue()
-    result = manager.get_result_queue()
-    # 放几个任务进去:
-    for i in range(10):
-        n = random.randint(0, 10000)
-        print('Put task %d...' % n)
-        task.put(n)
-    # 从result队列读取结果:
-    print('Try get results...')
-    for i in range(10):
-        r = result.get(timeout=10)
-        print('Result: %s' % r)
-    # 关闭:
+def return_broker():
+    global broker
+    return broker
+
+
+def iter_results(broker, total, n):
+    # 结果流：收到一批处理一批，不用等全部完成
+    received = 0
+    while received < total:
+        results = broker.get_results(n, 10)
+        if not results:
+            print('waiting for results... %s' % broker.stats())
+            continue
+        received += len(results)
+        for r in results:
+            yield r
+
+
+def test(args):
+    QueueManager.register('get_broker', callable=return_broker)
+    manager = QueueManager(address=(args.host, args.port), authkey=b'abc')
+    manager.start(init_broker, (args.heartbeat_timeout,))
+    broker = manager.get_broker()
+
+    workers = []
+    if args.local_workers:
+        import multiprocessing, task_worker
+        for i in range(args.local_workers):
+            p = multiprocessing.Process(target=task_worker.run, args=(
+                '127.0.0.1' if args.host == '0.0.0.0' else args.host, args.port, args.batch, args.work_ms))
+            p.start()
+            workers.append(p)
+
+    start = time.perf_counter()
+    for i in range(0, args.tasks, args.batch):
+        broker.put_many([random.randint(0, 10000) for j in range(min(args.batch, args.tasks - i))])
+    print('put %d tasks in %.2fs' % (args.tasks, time.perf_counter() - start))
+    for i, (task_id, r) in enumerate(iter_results(broker, args.tasks, args.batch)):
+        if i < 3:
+            print('Result: %s' % r)
+        elif i % max(args.tasks // 10, 1) == 0:
+            print('%d results, %.0f tasks/s' % (i, i / (time.perf_counter() - start)))
+    elapsed = time.perf_counter() - start
+    print('%d tasks, batch %d: %.2fs, %.0f tasks/s, %s' % (args.tasks, args.batch, elapsed, args.tasks / elapsed, broker.stats()))
+    # 关闭：worker拿到None后退出
+    broker.close()
+    for p in workers:
+        p.join()
     manager.shutdown()
     print('master exit.')
 
 
 if __name__ == '__main__':
     freeze_support()
-    test()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--tasks', type=int, default=10)
+    parser.add_argument('--batch', type=int, default=100, help='tasks per round trip')
+    parser.add_argument('--local-workers', type=int, default=0, help='start this many workers on this machine')
+    parser.add_argument('--work-ms', type=float, default=0, help='simulated work per task for local workers')
+    parser.add_argument('--heartbeat-timeout', type=float, default=10)
+    test(parser.parse_args())
@@ -1,6 +1,11 @@
 # task_worker.py
+# 一直从master拉取任务直到master关闭，每次往返交回上一批结果、领取下一批任务；
+# 另开一个线程定期发心跳，处理一批耗时较长的任务时也不会被当成死掉。
+# 心跳间隔默认取master的--heartbeat-timeout的1/4，也可以用--heartbeat-interval指定。
+#
+#     python3 task_worker.py --host 192.168.0.103 --batch 100
 
-import time, sys, queue
+import argparse, os, socket, threading, time
 from multiprocessing.managers import BaseManager
 
 
@@ -9,29 +14,57 @@ class QueueManager(BaseManager):
     pass
 
 
-# 由于这个QueueManager只从网络上获取Queue，所以注册时只提供名字:
-QueueManager.register('get_task_queue')
-QueueManager.register('get_result_queue')
-
-# 连接到服务器，也就是运行task_master.py的机器:
-server_addr = '192.168.0.103'
-print('Connect to server %s...' % server_addr)
-# 端口和验证码注意保持与task_master.py设置的完全一致:
-m = QueueManager(address=(server_addr, 5000), authkey=b'abc')
-# 从网络连接:
-m.connect()
-# 获取Queue的对象:
-task = m.get_task_queue()
-result = m.get_result_queue()
-# 从task队列取任务,并把结果写入result队列:
-for i in range(10):
-    try:
-        n = task.get(timeout=1)
-        print('run task %d * %d...' % (n, n))
-        r = '%d * %d = %d' % (n, n, n*n)
-        time.sleep(1)
-        result.put(r)
-    except queue.Empty:
-        print('task queue is empty.')
-# 处理结束:
-print('worker exit.')
\ No newline at end of file
+# 由于这个QueueManager只从网络上获取broker，所以注册时只提供名字:
+QueueManager.register('get_broker')
+
+
+def run(host, port, batch=100, work_ms=0, heartbeat_interval=None, die_after=None):
+    print('Connect to server %s...' % host)
+    # 端口和验证码注意保持与task_master.py设置的完全一致:
+    m = QueueManager(address=(host, port), authkey=b'abc')
+    # 从网络连接:
+    m.connect()
+    broker = m.get_broker()
+    worker_id = '%s-%d' % (socket.gethostname(), os.getpid())
+    if heartbeat_interval is None:
+        # 超时前至少能发出三四次心跳，偶尔一次慢了也不会被误判为死掉
+        heartbeat_interval = broker.get_heartbeat_timeout() / 4
+    stop = threading.Event()
+
+    def beat():
+        # 代理对象在每个线程里用自己的连接，心跳不会和任务请求互相阻塞
+        while not stop.wait(heartbeat_interval):
+            broker.heartbeat(worker_id)
+
+    threading.Thread(target=beat, daemon=True).start()
+    done = 0
+    results = []
+    while True:
+        tasks = broker.exchange(worker_id, results, batch, 1.0)
+        results = []
+        if tasks is None:
+            break
+        if die_after is not None and done >= die_after:
+            # 模拟worker崩溃：领了任务不交结果也不再发心跳
+            print('worker %s crashing with %d tasks in hand' % (worker_id, len(tasks)))
+            os._exit(1)
+        for task_id, n in tasks:
+            if work_ms:
+                time.sleep(work_ms / 1000.0)
+            results.append((task_id, '%d * %d = %d' % (n, n, n * n)))
+        done += len(tasks)
+    stop.set()
+    # 处理结束:
+    print('worker %s exit after %d tasks.' % (worker_id, done))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--heartbeat-interval', type=float, default=None,
+                        help='seconds between heartbeats (default: a quarter of the master\'s heartbeat timeout)')
+    parser.add_argument('--die-after', type=int, default=None, help='crash after this many tasks (to test requeueing)')
+    args = parser.parse_args()
+    run(args.host, args.port, args.batch, heartbeat_interval=args.heartbeat_interval, die_after=args.die_after)
@@ -0,0 +1,32 @@
+import threading, time
+
+from task_master import TaskBroker
+
+
+def test_late_results_are_not_completed():
+    broker = TaskBroker(heartbeat_timeout=0.2)
+    broker.put_many(range(10))
+    slow = broker.exchange('slow', [], 10, 1)
+    assert len(slow) == 10
+    # slow不发心跳，任务被放回队列交给fast
+    time.sleep(0.5)
+    fast = broker.exchange('fast', [], 10, 1)
+    assert sorted(fast) == sorted(slow)
+    broker.exchange('slow', [(task_id, n * n) for task_id, n in slow[:4]], 10, 0)
+    broker.exchange('fast', [(task_id, n * n) for task_id, n in fast], 10, 0)
+    stats = broker.stats()
+    assert stats['completed'] == 10 and stats['late'] == 4 and stats['requeued'] == 10
+    assert len(broker.get_results(100, 0)) == 10
+
+
+def test_worker_reaped_while_waiting_is_tracked_again():
+    broker = TaskBroker(heartbeat_timeout=0.2)
+    # 在exchange等任务期间被当成死掉，任务晚到后又分给了它
+    threading.Timer(0.6, broker.put_many, args=(range(5),)).start()
+    batch = broker.exchange('idle', [], 10, 1.0)
+    assert len(batch) == 5
+    assert broker.stats()['workers'] == 1
+    # 之后真的死掉：任务要能被放回队列
+    time.sleep(0.6)
+    stats = broker.stats()
+    assert stats['in_flight'] == 0 and stats['pending'] == 5
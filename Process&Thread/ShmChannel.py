@@ -0,0 +1,293 @@
+'''
+基于multiprocessing.shared_memory环形缓冲区的进程间通道，用法和ProcessCommunity.py里的Queue一样:
+
+    ch = ShmChannel(capacity=64 * 1024 * 1024)
+    Process(target=write, args=(ch,)).start()
+    ch.put(b'...')              # 缓冲区满时阻塞（背压），timeout到了抛queue.Full
+    ch.get()                    # 空时阻塞，timeout到了抛queue.Empty
+    with ch.view() as mv:       # 直接读共享内存，不复制，with结束后这段空间才能被重新写入
+        ...
+
+bytes、bytearray、memoryview等支持buffer协议的对象按原始字节写入，不经过pickle，
+其他对象pickle后写入。Queue要经过pickle、管道和后台feeder线程，这里只有一次内存复制。
+
+    python3 ShmChannel.py            # 和ProcessCommunity.py一样的读写演示
+    python3 ShmChannel.py --bench    # 不同大小的数据和Queue对比
+'''
+
+import contextlib, multiprocessing, os, pickle, queue, struct, sys, time
+from multiprocessing import shared_memory
+
+_INDEX = struct.Struct('QQ')  # 共享内存开头：已读位置, 已写位置（都只增不减，取模得到偏移）
+_DATA_OFFSET = 64
+_RECORD = struct.Struct('IIQ')  # 每条记录的头：长度, 类型, 保留
+RAW, PICKLED, WRAP = 0, 1, 2  # WRAP表示尾部放不下，从缓冲区开头继续
+_INLINE = 16 * 1024  # 不超过这个大小的记录在_cond里直接复制
+
+
+def _align(n):
+    # 按记录头大小对齐，缓冲区尾部剩下的空间要么是0，要么至少放得下一个WRAP标记
+    return -(-n // _RECORD.size) * _RECORD.size
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # 3.13之前没有track参数，子进程attach时会被resource_tracker登记，退出时误删或报泄漏
+        shm = shared_memory.SharedMemory(name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class ShmChannel(object):
+
+    def __init__(self, capacity=16 * 1024 * 1024):
+        capacity = _align(capacity)
+        self._shm = shared_memory.SharedMemory(create=True, size=_DATA_OFFSET + capacity)
+        self._owner = True
+        _INDEX.pack_into(self._shm.buf, 0, 0, 0)
+        self._cond = multiprocessing.Condition()
+        # 同一时刻只有一个写者在复制数据、一个读者在读，复制时不持有_cond，读写可以并行
+        self._put_lock = multiprocessing.Lock()
+        self._get_lock = multiprocessing.Lock()
+        self._setup(capacity)
+
+    def _setup(self, capacity):
+        self.capacity = capacity
+        self._data = self._shm.buf[_DATA_OFFSET:_DATA_OFFSET + capacity]
+
+    def __getstate__(self):
+        return dict(name=self._shm.name, capacity=self.capacity, cond=self._cond,
+                    put_lock=self._put_lock, get_lock=self._get_lock)
+
+    def __setstate__(self, state):
+        self._shm = _attach(state['name'])
+        self._owner = False
+        self._cond = state['cond']
+        self._put_lock = state['put_lock']
+        self._get_lock = state['get_lock']
+        self._setup(state['capacity'])
+
+    def _index(self):
+        return _INDEX.unpack_from(self._shm.buf, 0)
+
+    def _wait(self, ready, block, timeout):
+        # 持有_cond时调用，等待ready()为真
+        if ready():
+            return True
+        if not block:
+            return False
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ready():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._cond.wait(remaining)
+        return True
+
+    def put(self, obj, block=True, timeout=None):
+        try:
+            data = memoryview(obj).cast('B')
+            kind = RAW
+        except TypeError:
+            data = memoryview(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+            kind = PICKLED
+        size = _align(_RECORD.size + len(data))
+        if size > self.capacity:
+            raise ValueError('item of %d bytes does not fit in a %d byte channel' % (len(data), self.capacity))
+        with self._put_lock:
+            with self._cond:
+                head, tail = self._index()
+                pos = tail % self.capacity
+                if self.capacity - pos < size:
+                    # 尾部连续空间不够，写一个WRAP标记，从开头写，保证每条记录在内存里是连续的
+                    skip = self.capacity - pos
+                    if not self._wait(lambda: self.capacity - (self._index()[1] - self._index()[0]) >= skip, block, timeout):
+                        raise queue.Full
+                    _RECORD.pack_into(self._data, pos, 0, WRAP, 0)
+                    tail += skip
+                    _INDEX.pack_into(self._shm.buf, 0, self._index()[0], tail)
+                    self._cond.notify_all()
+                    pos = 0
+                if not self._wait(lambda: self.capacity - (tail - self._index()[0]) >= size, block, timeout):
+                    raise queue.Full
+                if size <= _INLINE:
+                    # 小数据复制很快，直接在锁里写完，省掉第二次加锁
+                    self._write(pos, data, kind)
+                    _INDEX.pack_into(self._shm.buf, 0, self._index()[0], tail + size)
+                    self._cond.notify_all()
+                    return
+            # 这段空间读者不会碰，复制时不用持有_cond
+            self._write(pos, data, kind)
+            with self._cond:
+                _INDEX.pack_into(self._shm.buf, 0, self._index()[0], tail + size)
+                self._cond.notify_all()
+
+    def _write(self, pos, data, kind):
+        _RECORD.pack_into(self._data, pos, len(data), kind, 0)
+        start = pos + _RECORD.size
+        self._data[start:start + len(data)] = data
+
+    def put_nowait(self, obj):
+        self.put(obj, False)
+
+    def _next_record(self, block, timeout):
+        # 持有_get_lock和_cond时调用，跳过WRAP标记，返回下一条记录的(偏移, 长度, 类型)
+        while True:
+            if not self._wait(lambda: self._index()[1] > self._index()[0], block, timeout):
+                raise queue.Empty
+            head, tail = self._index()
+            pos = head % self.capacity
+            length, kind, _ = _RECORD.unpack_from(self._data, pos)
+            if kind != WRAP:
+                return pos, length, kind
+            _INDEX.pack_into(self._shm.buf, 0, head + self.capacity - pos, tail)
+            self._cond.notify_all()
+
+    def _release(self, length):
+        with self._cond:
+            self._advance(length)
+
+    def _advance(self, length):
+        head, tail = self._index()
+        _INDEX.pack_into(self._shm.buf, 0, head + _align(_RECORD.size + length), tail)
+        self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def view(self, block=True, timeout=None):
+        '''
+        Yield the next item as a memoryview into shared memory (pickled items are yielded as their pickle bytes).
+        The space is handed back to writers when the block exits, so do not keep the view.
+        '''
+        with self._get_lock:
+            with self._cond:
+                pos, length, kind = self._next_record(block, timeout)
+            mv = self._data[pos + _RECORD.size:pos + _RECORD.size + length]
+            try:
+                yield mv
+            finally:
+                mv.release()
+                self._release(length)
+
+    def get(self, block=True, timeout=None):
+        with self._get_lock:
+            with self._cond:
+                pos, length, kind = self._next_record(block, timeout)
+                start = pos + _RECORD.size
+                if length <= _INLINE:
+                    obj = bytes(self._data[start:start + length])
+                    self._advance(length)
+                    return pickle.loads(obj) if kind == PICKLED else obj
+            obj = bytes(self._data[start:start + length])
+            self._release(length)
+            return pickle.loads(obj) if kind == PICKLED else obj
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        # 已占用的字节数，不是条数
+        head, tail = self._index()
+        return tail - head
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        self._data.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+# 写数据进程执行的代码:
+def write(q):
+    import random
+    print('Process to write: %s' % os.getpid())
+    for value in ['A', 'B', 'C']:
+        print('Put %s to channel...' % value)
+        q.put(value)
+        time.sleep(random.random())
+    q.put(None)
+
+
+# 读数据进程执行的代码:
+def read(q):
+    print('Process to read: %s' % os.getpid())
+    while True:
+        value = q.get(True)
+        if value is None:
+            break
+        print('Get %s from channel.' % value)
+
+
+def _produce(ch, size, count):
+    payload = os.urandom(size)
+    for i in range(count):
+        ch.put(payload)
+    ch.put(b'')
+
+
+def _consume_copy(ch, done):
+    n = 0
+    while ch.get():
+        n += 1
+    done.put(n)
+
+
+def _consume_view(ch, done):
+    n = 0
+    while True:
+        with ch.view() as mv:
+            if not len(mv):
+                break
+            # 读数据本身，例如校验首尾字节，而不复制
+            mv[0], mv[-1]
+            n += 1
+    done.put(n)
+
+
+def bench(total_bytes=256 * 1024 * 1024, sizes=(64, 4096, 65536, 1024 * 1024, 8 * 1024 * 1024)):
+    print('%-10s %-14s %10s %12s %10s' % ('size', 'channel', 'items', 'items/s', 'MB/s'))
+    for size in sizes:
+        count = max(min(total_bytes // size, 200000), 20)
+        for name, consume in (('Queue', _consume_copy), ('ShmChannel', _consume_copy), ('ShmChannel.view', _consume_view)):
+            # Queue限制64条，ShmChannel限制64MB，两边都有背压
+            ch = multiprocessing.Queue(64) if name == 'Queue' else ShmChannel(max(64 * 1024 * 1024, 4 * size))
+            done = multiprocessing.Queue()
+            start = time.perf_counter()
+            pc = multiprocessing.Process(target=consume, args=(ch, done))
+            pp = multiprocessing.Process(target=_produce, args=(ch, size, count))
+            pc.start()
+            pp.start()
+            n = done.get()
+            elapsed = time.perf_counter() - start
+            pp.join()
+            pc.join()
+            if isinstance(ch, ShmChannel):
+                ch.close()
+            assert n == count, (n, count)
+            print('%-10s %-14s %10d %12.0f %10.1f' % (_fmt_size(size), name, count, count / elapsed, count * size / elapsed / 1048576))
+
+
+def _fmt_size(n):
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024 or unit == 'MB':
+            return '%d%s' % (n, unit)
+        n //= 1024
+
+
+if __name__ == '__main__':
+    if '--bench' in sys.argv:
+        bench()
+    else:
+        ch = ShmChannel(1024 * 1024)
+        pw = multiprocessing.Process(target=write, args=(ch,))
+        pr = multiprocessing.Process(target=read, args=(ch,))
+        pw.start()
+        pr.start()
+        pw.join()
+        pr.join()
+        ch.close()
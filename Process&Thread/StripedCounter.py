@@ -0,0 +1,221 @@
+'''
+多线程共享计数器。mulThreadDataShare.py里每次加减都抢同一把全局锁，线程越多排队越厉害。这里提供三种计数器，接口相同:
+
+    c = LocalCounter()          # 或 StripedCounter() / LockedCounter()
+    c.incr('GET /')             # 线程里随便加
+    c.incr('POST /login', 3)
+    c.value('GET /')            # 读的时候把各部分加起来
+    c.snapshot()                # {key: 合计}
+
+- LockedCounter: 一把锁，和mulThreadDataShare.py一样，作对照
+- StripedCounter: 分成多个stripe，每个stripe一把锁，线程按id固定用其中一个，不同线程基本不会抢同一把锁
+- LocalCounter: 每个线程用threading.local（见ThreadLocal.py）保存自己的部分和，写的时候完全不加锁，
+  读的时候合并所有线程的部分和；线程退出后它的部分和并进一个公共的合计，不会丢，也不会越攒越多
+
+LocalStats是同样思路的统计量（次数、总和、最小、最大），例如记录请求耗时。
+
+有GIL时同一时刻只有一个线程在跑，锁很少真的被抢，LocalCounter的好处主要是省掉加锁解锁；
+多核上的无GIL（free-threading）版本里，单锁会让所有线程排队，stripe和per-thread的差距才会拉开。
+
+    python3 StripedCounter.py                        # 1/2/4/8/16个线程下三种计数器的吞吐量
+    python3 StripedCounter.py --threads 1 4 32 --ops 200000
+'''
+
+import argparse, collections, itertools, threading, time, weakref
+
+
+class LockedCounter(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+
+    def incr(self, key=None, n=1):
+        with self._lock:
+            self._counts[key] += n
+
+    def value(self, key=None):
+        with self._lock:
+            return self._counts[key]
+
+    def snapshot(self):
+        with self._lock:
+            return collections.Counter(self._counts)
+
+
+class StripedCounter(object):
+
+    def __init__(self, stripes=16):
+        self._stripes = [(threading.Lock(), collections.Counter()) for i in range(stripes)]
+        # 每个线程第一次用时分一个stripe，轮流分配比按线程id取模分得更均匀
+        self._next = itertools.count()
+        self._local = threading.local()
+
+    def _stripe(self):
+        try:
+            return self._local.stripe
+        except AttributeError:
+            stripe = self._local.stripe = self._stripes[next(self._next) % len(self._stripes)]
+            return stripe
+
+    def incr(self, key=None, n=1):
+        lock, counts = self._stripe()
+        with lock:
+            counts[key] += n
+
+    def value(self, key=None):
+        total = 0
+        for lock, counts in self._stripes:
+            with lock:
+                total += counts[key]
+        return total
+
+    def snapshot(self):
+        total = collections.Counter()
+        for lock, counts in self._stripes:
+            with lock:
+                total.update(counts)
+        return total
+
+
+class _Token(object):
+    # 放在threading.local里，线程退出、它被释放时触发weakref.finalize
+    pass
+
+
+def _on_thread_exit(local, callback, *args):
+    local.token = token = _Token()
+    weakref.finalize(token, callback, *args)
+
+
+class LocalCounter(object):
+    '''
+    Reads copy other threads' cells without a lock. That relies on CPython: copying a dict runs
+    with the GIL held (or under the dict's own lock in free-threaded builds), so a concurrent
+    increment is either fully in the copy or not at all. Other interpreters need a per-cell lock.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()  # 只在线程第一次使用和退出时加锁
+        self._cells = []
+        self._retired = collections.Counter()  # 已退出线程的部分和
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = collections.Counter()
+            with self._lock:
+                self._cells.append(cell)
+            _on_thread_exit(self._local, self._retire, cell)
+            return cell
+
+    def _retire(self, cell):
+        # 线程已经退出，不会再写这个cell
+        with self._lock:
+            self._cells.remove(cell)
+            self._retired.update(cell)
+
+    def incr(self, key=None, n=1):
+        # 只有本线程写自己的cell，不用加锁
+        self._cell()[key] += n
+
+    def value(self, key=None):
+        with self._lock:
+            cells = list(self._cells)
+            total = self._retired.get(key, 0)
+        return total + sum(cell.get(key, 0) for cell in cells)
+
+    def snapshot(self):
+        with self._lock:
+            cells = list(self._cells)
+            total = collections.Counter(self._retired)
+        for cell in cells:
+            total.update(dict(cell))
+        return total
+
+
+class LocalStats(object):
+    '''
+    Per-thread count/sum/min/max of observed values, merged on read.
+    Like LocalCounter, a read may see a cell halfway through an update (count already
+    incremented, sum not yet); the merged numbers are exact once writers are idle.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells = []
+        self._retired = None  # 已退出线程合并后的[count, sum, min, max]
+
+    def add(self, x):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0, 0, x, x]
+            with self._lock:
+                self._cells.append(cell)
+            _on_thread_exit(self._local, self._retire, cell)
+        cell[0] += 1
+        cell[1] += x
+        if x < cell[2]:
+            cell[2] = x
+        if x > cell[3]:
+            cell[3] = x
+
+    def _retire(self, cell):
+        with self._lock:
+            self._cells.remove(cell)
+            r = self._retired
+            self._retired = list(cell) if r is None else [r[0] + cell[0], r[1] + cell[1],
+                                                          min(r[2], cell[2]), max(r[3], cell[3])]
+
+    def stats(self):
+        with self._lock:
+            cells = [list(c) for c in self._cells]
+            if self._retired is not None:
+                cells.append(list(self._retired))
+        count = sum(c[0] for c in cells)
+        if not count:
+            return dict(count=0, sum=0, mean=None, min=None, max=None)
+        total = sum(c[1] for c in cells)
+        return dict(count=count, sum=total, mean=total / count, min=min(c[2] for c in cells),
+                    max=max(c[3] for c in cells))
+
+
+def run_thread(counter, ops, key):
+    for i in range(ops):
+        counter.incr(key)
+
+
+def bench(threads_list, ops):
+    print('%-8s %-15s %12s %10s' % ('threads', 'counter', 'ops/s', 'correct'))
+    for threads in threads_list:
+        for cls in (LockedCounter, StripedCounter, LocalCounter):
+            counter = cls()
+            # 一半线程记同一个key，模拟热点计数，例如同一个URL的请求数
+            ts = [threading.Thread(target=run_thread, args=(counter, ops, 'hot' if i % 2 else i)) for i in range(threads)]
+            start = time.perf_counter()
+            for t in ts:
+                t.start()
+            for t in ts:
+                t.join()
+            elapsed = time.perf_counter() - start
+            total = sum(counter.snapshot().values())
+            print('%-8d %-15s %12.0f %10s' % (threads, cls.__name__, threads * ops / elapsed, total == threads * ops))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--ops', type=int, default=100000, help='increments per thread')
+    args = parser.parse_args()
+    bench(args.threads, args.ops)
+    stats = LocalStats()
+    ts = [threading.Thread(target=lambda: [stats.add(x) for x in range(1000)]) for i in range(4)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    print('LocalStats: %s' % stats.stats())
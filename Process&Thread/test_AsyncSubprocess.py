@@ -0,0 +1,75 @@
+import asyncio, sys
+
+from AsyncSubprocess import SubprocessPool, detect_encoding
+
+PY = sys.executable
+
+
+def test_timeout_escalates_to_sigkill():
+    pool = SubprocessPool(timeout=0.5, kill_grace=0.5)
+    lines = []
+    args = [PY, '-c', 'import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                      'print("ready", flush=True); time.sleep(60)']
+    r = asyncio.run(pool.run(args, stdout=lines.append))
+    assert r.timed_out and r.returncode == -9
+    assert lines == ['ready\n']
+    assert r.elapsed < 5
+
+
+def test_timeout_sigterm_is_enough():
+    pool = SubprocessPool(timeout=0.5, kill_grace=5)
+    r = asyncio.run(pool.run([PY, '-c', 'import time; time.sleep(60)']))
+    assert r.timed_out and r.returncode == -15
+    assert r.elapsed < 5
+
+
+def test_detect_encoding():
+    text = '你好，世界\n' * 10
+    assert detect_encoding(text.encode('utf-8')) == 'utf-8'
+    assert detect_encoding(text.encode('gbk')) in ('gb18030', 'gbk', 'gb2312')
+    assert detect_encoding(b'\xef\xbb\xbf' + text.encode('utf-8')) == 'utf-8-sig'
+    # 样本在多字节字符中间截断仍然认作utf-8
+    assert detect_encoding(text.encode('utf-8')[:-2]) == 'utf-8'
+
+
+def test_run_decodes_gbk_and_utf8():
+    for encoding in ('gbk', 'utf-8'):
+        pool = SubprocessPool()
+        lines = []
+        args = [PY, '-c', 'import sys; sys.stdout.buffer.write("hello\\n你好，世界\\n".encode(%r))' % encoding]
+        r = asyncio.run(pool.run(args, stdout=lines.append))
+        assert r.returncode == 0
+        assert lines == ['hello\n', '你好，世界\n']
+        assert (r.stdout_encoding == 'utf-8') == (encoding == 'utf-8')
+
+
+def test_large_stdin_does_not_deadlock():
+    # cat边读边写，输出没人读时会写满管道，和写stdin的drain()互相等待
+    data = b'x' * 1023 + b'\n'
+    pool = SubprocessPool(timeout=10)
+    lines = []
+    r = asyncio.run(pool.run(['cat'], stdout=lines.append, input=data * 1024))
+    assert not r.timed_out and r.returncode == 0
+    assert len(lines) == 1024 and lines[0] == data.decode()
+
+
+def test_child_exits_without_reading_stdin():
+    pool = SubprocessPool(timeout=10)
+    r = asyncio.run(pool.run([PY, '-c', 'pass'], input=b'x' * (1 << 20)))
+    assert not r.timed_out and r.returncode == 0
+
+
+def test_pool_reused_across_event_loops():
+    pool = SubprocessPool(concurrency=1, timeout=10)
+    commands = [[PY, '-c', 'print(1)'], [PY, '-c', 'print(2)']]
+    for i in range(2):
+        results = asyncio.run(asyncio.wait_for(pool.map(commands), 10))
+        assert [r.returncode for r in results] == [0, 0]
+
+
+def test_timeout_without_new_session():
+    # 不在自己的进程组里时不能用killpg，超时也要能结束进程
+    pool = SubprocessPool(timeout=0.5, kill_grace=1)
+    r = asyncio.run(pool.run([PY, '-c', 'import time; time.sleep(8)'], start_new_session=False))
+    assert r.timed_out and r.returncode == -15
+    assert r.elapsed < 5
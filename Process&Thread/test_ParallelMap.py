@@ -0,0 +1,82 @@
+import os, time
+
+import pytest
+from multiprocessing import Pool
+
+from ParallelMap import TaskError, parallel_map
+
+
+def square(n):
+    return n * n
+
+
+def slow_first(n):
+    # 第一个任务最慢，无序模式下它的结果应该最后到
+    if n == 0:
+        time.sleep(0.5)
+    return n
+
+
+def failing(n):
+    if n == 7:
+        raise ValueError('bad input %d' % n)
+    return n
+
+
+def pid_after(delay):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def test_ordered_output():
+    assert list(parallel_map(slow_first, range(20), processes=4, chunksize=1, progress=False)) == list(range(20))
+    assert list(parallel_map(square, range(1000), processes=2, progress=False)) == [n * n for n in range(1000)]
+
+
+def test_unordered_output():
+    results = list(parallel_map(slow_first, range(20), processes=4, chunksize=1, ordered=False, progress=False))
+    assert sorted(results) == list(range(20))
+    assert results[0] != 0 and results[-1] == 0
+
+
+def test_generator_input():
+    calls = []
+
+    def progress(done, total, chunksize, final=False):
+        calls.append((done, total, final))
+
+    results = list(parallel_map(square, (n for n in range(500)), processes=2, progress=progress))
+    assert results == [n * n for n in range(500)]
+    # 生成器没有长度，total是None
+    assert calls[-1] == (500, None, True)
+
+
+@pytest.mark.parametrize('chunksize', [None, 1, 3])
+def test_task_error_carries_index_and_remote_traceback(chunksize):
+    with pytest.raises(TaskError) as info:
+        list(parallel_map(failing, range(20), processes=2, chunksize=chunksize, progress=False))
+    e = info.value
+    assert e.index == 7 and e.item == 7
+    assert 'ValueError: bad input 7' in str(e)
+    assert 'Traceback' in e.remote_traceback and 'in failing' in e.remote_traceback
+
+
+def test_break_terminates_owned_pool():
+    pids = set()
+    for pid in parallel_map(pid_after, [0.01] * 4 + [5] * 8, processes=2, chunksize=1, progress=False):
+        pids.add(pid)
+        break
+    # 生成器被回收时结束自己建的Pool，不等剩下的慢任务做完
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+
+
+def test_break_keeps_passed_pool():
+    with Pool(2) as pool:
+        start = time.perf_counter()
+        for r in parallel_map(square, range(100), pool=pool, chunksize=1, progress=False):
+            break
+        # 调用者传进来的Pool不会被结束，还能继续用
+        assert pool.apply(square, (3,)) == 9
+        assert time.perf_counter() - start < 5
@@ -0,0 +1,91 @@
+import multiprocessing, queue, random
+
+import pytest
+
+from ShmChannel import ShmChannel
+
+
+@pytest.fixture
+def channel():
+    chs = []
+
+    def make(capacity):
+        ch = ShmChannel(capacity)
+        chs.append(ch)
+        return ch
+
+    yield make
+    for ch in chs:
+        ch.close()
+
+
+def test_wrap_with_small_tail_gap(channel):
+    # 尾部只剩8个字节时原来写不下WRAP标记，通道从此不能再用
+    ch = channel(40)
+    for i in range(10):
+        ch.put(b'')
+        ch.put(b'x')
+        assert ch.get() == b''
+        assert ch.get() == b'x'
+
+
+def test_mixed_sizes_through_many_wraps(channel):
+    # 最多同时攒4条，加上一次WRAP跳过的空间也放得下，单线程里put不会阻塞
+    ch = channel(2048)
+    rnd = random.Random(1)
+    written = 0
+    pending = []
+    for i in range(200000):
+        data = bytes([i % 256]) * rnd.randint(0, 300)
+        ch.put(data, timeout=1)
+        pending.append(data)
+        written += len(data)
+        # 随机攒几条再读，让读写位置在环里各种对齐方式下相遇
+        if len(pending) > rnd.randint(0, 3):
+            while pending:
+                assert ch.get_nowait() == pending.pop(0)
+    while pending:
+        assert ch.get_nowait() == pending.pop(0)
+    assert written > 1000 * ch.capacity
+    assert ch.empty()
+
+
+def test_view_and_pickled_items(channel):
+    ch = channel(256)
+    for i in range(100):
+        ch.put({'i': i})
+        ch.put(b'abc' * (i % 20))
+        assert ch.get() == {'i': i}
+        with ch.view() as mv:
+            assert bytes(mv) == b'abc' * (i % 20)
+
+
+def test_backpressure_and_timeouts(channel):
+    ch = channel(64)
+    ch.put(b'x' * 40)
+    with pytest.raises(queue.Full):
+        ch.put(b'y' * 40, timeout=0.05)
+    assert ch.get() == b'x' * 40
+    with pytest.raises(queue.Empty):
+        ch.get(timeout=0.05)
+    with pytest.raises(ValueError):
+        ch.put(b'z' * 64)
+
+
+def _produce(ch, seed, count):
+    rnd = random.Random(seed)
+    for i in range(count):
+        ch.put(bytes([i % 256]) * rnd.randint(0, 500))
+    ch.put(None)
+
+
+def test_across_processes(channel):
+    ch = channel(2048)
+    p = multiprocessing.Process(target=_produce, args=(ch, 2, 5000))
+    p.start()
+    rnd = random.Random(2)
+    for i in range(5000):
+        assert ch.get(timeout=10) == bytes([i % 256]) * rnd.randint(0, 500)
+    assert ch.get(timeout=10) is None
+    p.join()
+    assert p.exitcode == 0
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from StripedCounter import LocalCounter, LocalStats, LockedCounter, StripedCounter
+
+
+def _run_threads(n, target):
+    ts = [threading.Thread(target=target, args=(i,)) for i in range(n)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+
+
+@pytest.mark.parametrize('cls', [LockedCounter, StripedCounter, LocalCounter])
+def test_counts(cls):
+    counter = cls()
+
+    def work(i):
+        for j in range(1000):
+            counter.incr('hot')
+            counter.incr(i, 2)
+
+    _run_threads(8, work)
+    assert counter.value('hot') == 8000
+    expected = {i: 2000 for i in range(8)}
+    expected['hot'] = 8000
+    assert counter.snapshot() == expected
+
+
+def test_local_counter_folds_dead_threads():
+    counter = LocalCounter()
+    for round in range(20):
+        _run_threads(10, lambda i: counter.incr('k', i))
+    # 退出的线程的部分和都并进了合计，不再保留各自的cell
+    assert len(counter._cells) == 0
+    assert counter.value('k') == 20 * 45 and counter.snapshot() == {'k': 900}
+    counter.incr('k')
+    assert len(counter._cells) == 1 and counter.value('k') == 901
+
+
+def test_local_stats_folds_dead_threads():
+    stats = LocalStats()
+    for round in range(10):
+        _run_threads(5, lambda i: [stats.add(x) for x in range(i, i + 10)])
+    assert len(stats._cells) == 0
+    assert stats.stats() == dict(count=500, sum=10 * 325, mean=6.5, min=0, max=13)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+' admission control and load shedding middleware '
+
+import asyncio, collections, heapq, itertools, logging, time
+
+from aiohttp import web
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Limiter(object):
+    '''
+    Concurrency limiter with a bounded wait queue.
+    Waiters are served by priority (smaller first), then in arrival order.
+    '''
+
+    def __init__(self, concurrency, queue):
+        self.concurrency = concurrency
+        self.max_queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._heap = []
+        self._seq = itertools.count()
+
+    async def acquire(self, priority=0, timeout=None):
+        if self.active < self.concurrency and self.waiting == 0:
+            self.active += 1
+            return
+        # 队列已满，立即拒绝，不让请求继续排队拖垮延迟
+        if self.waiting >= self.max_queue:
+            raise Overloaded()
+        fut = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self.waiting += 1
+        try:
+            # release()把名额直接转交给fut，因此这里不需要再active += 1
+            await asyncio.wait_for(fut, timeout)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # 名额已经转交过来，但调用方被取消了，要还回去
+                self.release()
+            else:
+                self.waiting -= 1
+                fut.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded()
+            raise
+
+    def release(self):
+        # 被取消（超时）的等待者留在堆里，出堆时跳过
+        while self._heap:
+            priority, seq, fut = heapq.heappop(self._heap)
+            if not fut.done():
+                self.waiting -= 1
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+
+class TokenBucket(object):
+    '''
+    Per-client token buckets, refilled at `rate` tokens/s up to `burst`.
+    At most `maxclients` buckets are kept; the least recently used one is dropped first.
+    '''
+
+    def __init__(self, rate, burst, maxclients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxclients = maxclients
+        self._buckets = collections.OrderedDict()  # client => [tokens, last]，按最近使用排序
+
+    def take(self, client):
+        '''
+        Take one token, return 0 on success or the seconds until a token is available.
+        '''
+        now = time.monotonic()
+        b = self._buckets.get(client)
+        if b is None:
+            # 客户端太多时丢掉最久没来的桶，不管有没有回满，保证桶的数量不超过maxclients
+            while len(self._buckets) >= self.maxclients:
+                self._buckets.popitem(last=False)
+            b = self._buckets[client] = [self.burst, now]
+        else:
+            self._buckets.move_to_end(client)
+        tokens = min(self.burst, b[0] + (now - b[1]) * self.rate)
+        b[1] = now
+        if tokens >= 1:
+            b[0] = tokens - 1
+            return 0
+        b[0] = tokens
+        return (1 - tokens) / self.rate
+
+
+class Rule(object):
+
+    def __init__(self, prefix, priority=0, concurrency=None, queue=0, timeout=None):
+        self.prefix = prefix
+        self.priority = priority
+        # concurrency为None表示该前缀不单独限流，只受全局限制
+        self.limiter = Limiter(concurrency, queue) if concurrency else None
+        self.timeout = timeout
+
+
+class Admission(object):
+
+    def __init__(self, concurrency=100, queue=200, timeout=1.0, retry_after=1, rules=(), exempt=(), rate=None):
+        self.limiter = Limiter(concurrency, queue)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.rules = [Rule(**r) for r in rules]
+        self.default = Rule('/')
+        self.exempt = tuple(exempt)
+        self.buckets = TokenBucket(**rate) if rate else None
+        self.rejected = 0
+
+    def rule_for(self, path):
+        for r in self.rules:
+            if path.startswith(r.prefix):
+                return r
+        return self.default
+
+    def reject(self, retry_after=None):
+        self.rejected += 1
+        return web.HTTPServiceUnavailable(headers={'Retry-After': str(retry_after or self.retry_after)})
+
+
+# 过载时快速失败的middleware：
+# 1、按客户端令牌桶限速，超出返回429
+# 2、按路由前缀限制并发，再经过全局并发限制，排队按优先级出队
+# 3、队列满或者排队超过deadline，返回503并带上Retry-After
+async def admission_factory(app, handler):
+    admission = app['__admission__']
+
+    async def admit(request):
+        path = request.path
+        if path.startswith(admission.exempt):
+            return (await handler(request))
+        if admission.buckets is not None:
+            wait = admission.buckets.take(request.remote)
+            if wait:
+                return web.HTTPTooManyRequests(headers={'Retry-After': str(int(wait) + 1)})
+        rule = admission.rule_for(path)
+        deadline = time.monotonic() + (rule.timeout or admission.timeout)
+        if rule.limiter is not None:
+            try:
+                await rule.limiter.acquire(rule.priority, deadline - time.monotonic())
+            except Overloaded:
+                return admission.reject()
+        try:
+            try:
+                await admission.limiter.acquire(rule.priority, max(0, deadline - time.monotonic()))
+            except Overloaded:
+                return admission.reject()
+            try:
+                return (await handler(request))
+            finally:
+                admission.limiter.release()
+        finally:
+            if rule.limiter is not None:
+                rule.limiter.release()
+    return admit
+
+
+def add_admission(app, **kw):
+    app['__admission__'] = Admission(**kw)
+    logging.info('admission control: concurrency=%s, queue=%s' % (kw.get('concurrency'), kw.get('queue')))
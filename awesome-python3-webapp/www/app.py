@@ -3,18 +3,34 @@
 # 默认的日志格式为日志级别：Logger名称：用户输出消息。
 import logging; logging.basicConfig(level=logging.INFO)
 
+# 启动分析和fast start必须在导入其他模块之前生效
+import startup
+if startup.PROFILE_STARTUP:
+    startup.profiler.enabled = True
+    startup.profiler.track_imports()
+if startup.FAST_START:
+    # 启动期间只输出WARNING以上的日志，省掉逐个模型、字段、路由的INFO日志，就绪后再恢复
+    logging.getLogger().setLevel(logging.WARNING)
+
 # asyncio是支持协程的库 异步IO
-import asyncio, os, json, time
+import asyncio, os, json, time, signal, socket
 from datetime import datetime
 
 # aiohttp是基于asyncio实现的HTTP框架
 from aiohttp import web
-from jinja2 import Environment, FileSystemLoader
 
 from config import configs
 
 import orm
-from coroweb import add_routes, add_static
+from cache import LRUCache
+from coroweb import add_routes, add_static, FastUrlDispatcher
+from metrics import metrics_factory, add_metrics
+from admission import admission_factory, add_admission
+from session import auth_factory, add_session
+from search import add_search
+from feeds import add_feeds
+from counters import add_counters, count_comments
+from jobs import add_jobs
 
 
 ''''我们使用jinja2作为模板引擎，在新框架中对jinja2模板进行初始化设置。
@@ -26,6 +42,9 @@ from coroweb import add_routes, add_static
 
 def init_jinja2(app, **kw):
     logging.info('init jinja2...')
+    # jinja2在这里才导入，fast start时可以推迟到监听端口之后
+    from jinja2 import Environment, FileSystemLoader
+    from template_cache import FragmentCacheExtension
     # 配置options参数
     options = dict(
         # 自动转义xml/html的特殊字符
@@ -46,7 +65,9 @@ def init_jinja2(app, **kw):
     # Environment类是jinja2的核心类，用来保存配置、全局对象以及模板文件的路径
     # FileSystemLoader类加载path路径中的模板文件
     logging.info('set jinja2 template path: %s' % path)
-    env = Environment(loader=FileSystemLoader(path), **options)
+    env = Environment(loader=FileSystemLoader(path), extensions=[FragmentCacheExtension], **options)
+    # {% cache %}片段缓存的存储，key由模板自己决定，一般带上模型id和created_at作为版本
+    env.fragment_cache = LRUCache(kw.get('fragment_cache_size', 1000))
     # 过滤器集合
     filters = kw.get('filters', None)
     if filters is not None:
@@ -58,6 +79,24 @@ def init_jinja2(app, **kw):
     app['__templating__'] = env
 
 
+# fast start时app['__templating__']先放这个占位对象，第一次get_template()或warm()时才初始化jinja2
+class LazyTemplating(object):
+
+    def __init__(self, **kw):
+        self._kw = kw
+        self._env = None
+
+    def warm(self):
+        if self._env is None:
+            holder = dict()
+            init_jinja2(holder, **self._kw)
+            self._env = holder['__templating__']
+        return self._env
+
+    def get_template(self, name):
+        return self.warm().get_template(name)
+
+
 def datetime_filter(t):
     delta = int(time.time() - t)
     if delta < 60:
@@ -88,6 +127,18 @@ async def logger_factory(app, handler):
     return logger
 
 
+# fast start时端口先于on_startup打开，这期间收到的请求在这里等到on_startup跑完，
+# 否则会读到还没加载的搜索索引、没生成的订阅，计数器和任务队列也还没启动
+async def ready_factory(app, handler):
+    ready = app['__ready__']
+
+    async def wait_ready(request):
+        if not ready.is_set():
+            await ready.wait()
+        return (await handler(request))
+    return wait_ready
+
+
 async def data_factory(app, handler):
     async def parse_data(request):
         if request.method == 'POST':
@@ -137,6 +188,8 @@ async def response_factory(app, handler):
                 resp.content_type = 'application/json;charset=utf-8'
                 return resp
             else:  # 带模板信息，渲染模板
+                # auth_factory解析出的当前用户，供__base__.html的导航栏使用
+                r.setdefault('user', getattr(request, '__user__', None))
                 # app['__templating__']获取已初始化的Environment对象，调用get_template()方法返回Template对象
                 # 调用Template对象的render()方法，传入r渲染模板，返回unicode格式字符串，将其用utf-8编码
                 resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
@@ -157,19 +210,99 @@ async def response_factory(app, handler):
     return response
 
 
-async def init(loop):
-    await orm.create_pool(loop=loop, **configs.db)
-    app = web.Application(loop=loop, middlewares=[
-        logger_factory, response_factory
-    ])
-    init_jinja2(app, filters=dict(datetime=datetime_filter))
+# 创建app并注册middleware、模板、路由，不涉及数据库和监听端口
+# hold_until_ready=True时请求要等app['__ready__']被set()才处理，用于在on_startup之前就监听端口
+def create_app(loop, static_path=None, lazy_templates=False, hold_until_ready=False):
+    middlewares = [logger_factory, metrics_factory, admission_factory, auth_factory, response_factory]
+    if hold_until_ready:
+        middlewares.insert(0, ready_factory)
+    app = web.Application(loop=loop, router=FastUrlDispatcher(), middlewares=middlewares)
+    if hold_until_ready:
+        app['__ready__'] = asyncio.Event()
+    add_admission(app, **configs.admission)
+    add_session(app, **configs.session)
+    if lazy_templates:
+        app['__templating__'] = LazyTemplating(filters=dict(datetime=datetime_filter))
+    else:
+        init_jinja2(app, filters=dict(datetime=datetime_filter))
     add_routes(app, 'handlers')
-    add_static(app)
-    srv = await loop.create_server(app.make_handler(), '127.0.0.1', 9000)
-    logging.info('server started at http://127.0.0.1:9000...')
-    return srv
+    add_static(app, static_path)
+    add_metrics(app, configs.metrics.path)
+    add_search(app, **configs.search)
+    add_feeds(app, **configs.feeds)
+    counters = add_counters(app, **configs.counters)
+    count_comments(counters['blog_comments'])
+    add_jobs(app, **configs.jobs)
+    return app
+
+
+# fast start时先监听端口，再并行创建连接池、初始化模板；推迟到监听之后的只有连接池和jinja2模板，
+# on_startup（搜索索引、订阅、计数器、任务队列）仍在连接池就绪后执行，在那之前收到的请求由ready_factory挡住
+async def init(loop):
+    fast = startup.FAST_START
+    if not fast:
+        await orm.create_pool(loop=loop, **configs.db)
+    with startup.phase('phase', 'create app'):
+        app = create_app(loop, lazy_templates=fast, hold_until_ready=fast)
+    if not fast:
+        with startup.phase('phase', 'on_startup'):
+            await app.startup()
+    handler = app.make_handler()
+    with startup.phase('phase', 'listen'):
+        # reuse_port让新进程在旧进程排空期间就能监听同一端口，发布时不丢连接
+        srv = await loop.create_server(handler, configs.server.host, configs.server.port, reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+    if fast:
+        pool = orm.start_pool(loop, **configs.db)
+        # 让连接池先发出连接请求，等待网络的同时初始化模板
+        await asyncio.sleep(0)
+        with startup.phase('phase', 'templates'):
+            app['__templating__'].warm()
+        await pool
+        # on_startup里有依赖数据库的工作（如加载搜索索引），放到连接池就绪之后
+        with startup.phase('phase', 'on_startup'):
+            await app.startup()
+        app['__ready__'].set()
+        logging.getLogger().setLevel(logging.INFO)
+    logging.info('server started at http://%s:%s...' % (configs.server.host, configs.server.port))
+    if startup.PROFILE_STARTUP:
+        startup.profiler.untrack_imports()
+        logging.info(startup.profiler.report())
+    return app, srv, handler
+
+
+# 优雅退出：
+# 1、关闭监听socket，不再接受新连接
+# 2、触发app.on_shutdown
+# 3、关闭空闲的keep-alive连接，等待处理中的请求完成，最多等待timeout秒
+# 4、触发app.on_cleanup，最后关闭数据库连接池
+async def shutdown(app, srv, handler, timeout):
+    logging.info('shutting down, draining connections for up to %ss...' % timeout)
+    srv.close()
+    await app.shutdown()
+    await handler.shutdown(timeout)
+    # 新版本的wait_closed()会等所有连接断开，所以放在handler.shutdown()之后
+    await srv.wait_closed()
+    await app.cleanup()
+    await orm.close_pool()
+    logging.info('server stopped.')
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    app, srv, handler = loop.run_until_complete(init(loop))
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, loop.stop)
+        except NotImplementedError:
+            # windows不支持add_signal_handler，只能靠KeyboardInterrupt
+            pass
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    loop.run_until_complete(shutdown(app, srv, handler, configs.server.shutdown_timeout))
+    loop.close()
 
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(init(loop))
-loop.run_forever()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+End-to-end HTTP load test: boot the app against a seeded local SQLite stand-in,
+drive it with a concurrent asyncio client and report RPS and latency percentiles.
+
+    python3 bench_http.py --workers 2 --concurrency 64 --duration 10 --output result.json
+'''
+
+import argparse, asyncio, json, logging, multiprocessing, os, random, resource, shutil, tempfile, time
+
+import aiohttp
+
+import orm, sqlite_pool
+
+# 每条路由的请求权重
+ROUTES = [
+    ('page', '/', 4),
+    ('api', '/api/blogs?limit=20', 4),
+    ('static', '/static/bench.css', 2),
+]
+
+
+def serve(db, static, port, ready):
+    # 在子进程里启动一个worker，所有worker通过SO_REUSEPORT共用端口
+    import app
+    logging.getLogger().setLevel(logging.WARNING)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    orm.set_pool(sqlite_pool.create_pool(db))
+    # 搜索索引和数据库一起放在临时目录里
+    app.configs.search.path = os.path.join(os.path.dirname(db), 'search.idx')
+    application = app.create_app(loop, static)
+    handler = application.make_handler(access_log=None)
+    # 和线上一样先跑完on_startup（加载搜索索引、生成订阅、启动计数器和任务队列）再接受请求
+    loop.run_until_complete(application.startup())
+    loop.run_until_complete(loop.create_server(handler, '127.0.0.1', port, reuse_port=True))
+    ready.set()
+    loop.run_forever()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def drive(base, concurrency, duration):
+    names = [r[0] for r in ROUTES for i in range(r[2])]
+    paths = dict((r[0], r[1]) for r in ROUTES)
+    latencies = dict((r[0], []) for r in ROUTES)
+    statuses = dict()
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def client():
+            while time.perf_counter() < deadline:
+                name = random.choice(names)
+                start = time.perf_counter()
+                try:
+                    async with session.get(base + paths[name]) as resp:
+                        await resp.read()
+                        status = resp.status
+                except aiohttp.ClientError:
+                    status = 'error'
+                latencies[name].append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def summarize(latencies, elapsed):
+    r = dict()
+    for name, L in list(latencies.items()) + [('all', sum(latencies.values(), []))]:
+        L.sort()
+        r[name] = dict(requests=len(L), rps=round(len(L) / elapsed, 1),
+                       p50_ms=_ms(percentile(L, 0.5)), p99_ms=_ms(percentile(L, 0.99)),
+                       p999_ms=_ms(percentile(L, 0.999)))
+    return r
+
+
+def _ms(v):
+    return None if v is None else round(v * 1000, 3)
+
+
+# 从/proc读取worker的常驻内存和峰值内存（KB），非linux系统返回None
+def memory_kb(pid):
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            fields = dict(line.split(':', 1) for line in f)
+        return dict(rss_kb=int(fields['VmRSS'].split()[0]), hwm_kb=int(fields['VmHWM'].split()[0]))
+    except (IOError, KeyError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--blogs', type=int, default=1000)
+    parser.add_argument('--comments', type=int, default=10000)
+    parser.add_argument('--output', help='write the result as JSON to this file')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench-http-')
+    try:
+        db = os.path.join(tmp, 'bench.db')
+        static = os.path.join(tmp, 'static')
+        os.mkdir(static)
+        with open(os.path.join(static, 'bench.css'), 'w') as f:
+            f.write('body { margin: 0; }\n' * 200)
+        sqlite_pool.seed(db, args.users, args.blogs, args.comments)
+
+        workers = []
+        for i in range(args.workers):
+            ready = multiprocessing.Event()
+            p = multiprocessing.Process(target=serve, args=(db, static, args.port, ready), daemon=True)
+            p.start()
+            workers.append(p)
+            if not ready.wait(30):
+                raise RuntimeError('worker %d failed to start' % i)
+        try:
+            latencies, statuses, elapsed = asyncio.run(
+                drive('http://127.0.0.1:%d' % args.port, args.concurrency, args.duration))
+            memory = [memory_kb(p.pid) for p in workers]
+        finally:
+            for p in workers:
+                p.terminate()
+                p.join()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    result = dict(
+        config=vars(args),
+        elapsed=round(elapsed, 3),
+        statuses=dict((str(k), v) for k, v in statuses.items()),
+        routes=summarize(latencies, elapsed),
+        workers=memory,
+        client_maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+    for name, r in result['routes'].items():
+        print('%-8s %8d req %10.1f rps  p50 %8.3f ms  p99 %8.3f ms  p999 %8.3f ms'
+              % (name, r['requests'], r['rps'], r['p50_ms'] or 0, r['p99_ms'] or 0, r['p999_ms'] or 0))
+    print('statuses: %s' % result['statuses'])
+    for i, m in enumerate(memory):
+        print('worker %d memory: %s' % (i, m))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
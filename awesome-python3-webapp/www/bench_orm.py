@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+ORM microbenchmarks against a fake cursor, no database server needed.
+
+    python3 bench_orm.py                 # compare with bench_orm_baseline.json, exit 1 on regression
+    python3 bench_orm.py --save          # record a new baseline
+    python3 bench_orm.py --threshold 0.3 # allow 30% slowdown
+
+Every benchmark is timed against a plain-Python reference workload in alternating rounds and
+compared as the median multiple over all rounds, so a faster or slower box shifts both. A
+benchmark fails only when it slows down by more than --threshold plus twice the measured noise
+(median deviation of the multiples, now and when the baseline was saved). The multiples still depend
+on the interpreter and CPU, so the committed baseline must be re-recorded (--save) on each
+machine and Python version it gates; a mismatch is reported.
+'''
+
+import argparse, json, logging, os, platform, statistics, sys, time
+
+import orm
+from orm import Model, StringField, BooleanField, FloatField, TextField
+from models import Blog, next_id
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_orm_baseline.json')
+
+ROW = dict(id=next_id(), user_id=next_id(), user_name='Test', user_image='about:blank',
+           name='Test Blog', summary='summary', content='内容' * 100, created_at=time.time())
+
+
+class FakeCursor(object):
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.rowcount = 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, sql, args=()):
+        pass
+
+    async def fetchall(self):
+        return self._rows
+
+    async def fetchmany(self, size):
+        return self._rows[:size]
+
+
+class FakePool(object):
+    '''
+    Every query returns the same DictCursor-like rows, every write affects one row.
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def acquire(self):
+        return self
+
+    get = acquire
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def cursor(self, *args):
+        return FakeCursor(self.rows)
+
+
+# FakePool从不挂起，直接驱动协程即可，省掉事件循环的开销
+def run(coro):
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('coroutine suspended on a fake pool')
+
+
+def bench_metaclass():
+    attrs = dict(__table__='bench', id=StringField(primary_key=True, default=next_id, ddl='varchar(50)'),
+                 name=StringField(ddl='varchar(50)'), admin=BooleanField(), content=TextField(),
+                 created_at=FloatField(default=time.time))
+    type('Bench', (Model,), dict(attrs))
+
+
+def bench_construct():
+    Blog(**ROW)
+
+
+_blog = Blog(**ROW)
+
+
+def bench_getattr():
+    b = _blog
+    b.id, b.name, b.summary, b.content, b.created_at
+
+
+def bench_save():
+    # 只给必填字段，id和created_at走getValueOrDefault的默认值
+    run(Blog(user_id='u', user_name='n', user_image='i', name='b', summary='s', content='c').save())
+
+
+def bench_find_all():
+    run(Blog.findAll('user_id=?', ['u'], orderBy='created_at desc', limit=(0, 10)))
+
+
+def bench_next_id():
+    next_id()
+
+
+BENCHMARKS = [
+    ('metaclass', bench_metaclass),
+    ('construct', bench_construct),
+    ('getattr', bench_getattr),
+    ('save', bench_save),
+    ('find_all', bench_find_all),
+    ('next_id', bench_next_id),
+]
+
+
+class _Plain(object):
+    # 参照用的普通类，和Model做的事情类似：构造时填字段、读属性、拼字符串
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+def bench_reference():
+    p = _Plain(**ROW)
+    p.id, p.name, p.summary, p.content, p.created_at
+    '%s=%s' % ('name', p.name)
+
+
+def _time(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def _calibrate(fn, min_time):
+    n = 1
+    while _time(fn, n) * n < min_time:
+        n *= 2
+    return n
+
+
+# 每轮先测参照再测目标，返回目标多轮中的最短耗时（纳秒）、每轮目标/参照比值的中位数，
+# 以及比值的相对中位数绝对偏差作为噪音；偶尔一轮被打断只影响一个比值，不影响中位数
+def measure(fn, repeat, min_time):
+    n, ref_n = _calibrate(fn, min_time), _calibrate(bench_reference, min_time)
+    best = None
+    ratios = []
+    for r in range(repeat):
+        ref = _time(bench_reference, ref_n)
+        t = _time(fn, n)
+        best = t if best is None else min(best, t)
+        ratios.append(t / ref)
+    relative = statistics.median(ratios)
+    noise = statistics.median(abs(x - relative) for x in ratios) / relative
+    return best * 1e9, relative, noise
+
+
+def environment():
+    return '%s %s on %s' % (platform.python_implementation(), platform.python_version(), platform.machine())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown ratio (default 0.2)')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.1, help='seconds per round')
+    args = parser.parse_args()
+
+    # ModelMetaclass和select()的INFO日志会淹没真正要测的开销
+    logging.getLogger().setLevel(logging.WARNING)
+    orm.set_pool(FakePool([ROW] * 10))
+
+    results = dict()
+    for name, fn in BENCHMARKS:
+        ns, relative, noise = measure(fn, args.repeat, args.min_time)
+        results[name] = dict(ns=round(ns, 1), relative=round(relative, 3), noise=round(noise, 3))
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(environment=environment(), results=results), f, indent=2, sort_keys=True)
+        print('baseline saved to %s' % args.baseline)
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if baseline and 'results' not in baseline:
+        # 旧格式只有绝对耗时，不能在别的机器上比较
+        print('%s has no relative timings, re-record it with --save' % args.baseline)
+        baseline = dict()
+    if baseline.get('environment') not in (None, environment()):
+        print('baseline recorded on %s, running on %s: re-record it with --save on this machine' % (
+            baseline['environment'], environment()))
+    base_results = baseline.get('results', {})
+    regressions = []
+    for name, r in results.items():
+        base = base_results.get(name)
+        if base is None:
+            print('%-10s %10.1f ns  %6.2fx reference  noise %4.1f%%' % (name, r['ns'], r['relative'], r['noise'] * 100))
+            continue
+        # 比较相对参照的倍数而不是绝对耗时，机器快慢、CPU频率变化对两者的影响大体抵消；
+        # 本次和记录基线时测量的波动也算进允许范围
+        change = r['relative'] / base['relative'] - 1
+        flag = ''
+        if change > args.threshold + 2 * (r['noise'] + base.get('noise', 0)):
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-10s %10.1f ns  %6.2fx reference  baseline %6.2fx  %+6.1f%%  noise %4.1f%%%s' % (
+            name, r['ns'], r['relative'], base['relative'], change * 100, r['noise'] * 100, flag))
+    if regressions:
+        print('regressed past %d%% plus twice the noise: %s' % (args.threshold * 100, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
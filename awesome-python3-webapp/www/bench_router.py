@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Compare route resolution of FastUrlDispatcher with aiohttp's default UrlDispatcher.
+
+    python3 bench_router.py --routes 300 --requests 100000 --repeat 5
+'''
+
+import argparse, asyncio, random, time
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from coroweb import FastUrlDispatcher
+
+
+async def handler(request):
+    return web.Response()
+
+
+# 模拟常见的REST API：每个资源一组固定路径和带{id}的路径
+def build(router, n):
+    paths = []
+    for i in range(n // 3):
+        router.add_route('GET', '/api/res%d' % i, handler)
+        router.add_route('GET', '/api/res%d/{id}' % i, handler)
+        router.add_route('POST', '/api/res%d/{id}/comments' % i, handler)
+        paths.append(('GET', '/api/res%d' % i))
+        paths.append(('GET', '/api/res%d/%d' % (i, i * 7)))
+        paths.append(('POST', '/api/res%d/%d/comments' % (i, i * 7)))
+    return paths
+
+
+async def _resolve_all(router, requests):
+    start = time.perf_counter()
+    for request in requests:
+        await router.resolve(request)
+    return time.perf_counter() - start
+
+
+def bench(router, requests, distinct, loop, repeat):
+    # 先检查一遍解析结果，计时的循环里只有resolve()本身，不扣除任何估计的开销
+    for request in distinct:
+        match_info = loop.run_until_complete(router.resolve(request))
+        assert match_info.route.handler is handler, request.path
+    # 取多次中最快的一次，其他几次的差异主要是调度和缓存带来的噪声
+    return min(loop.run_until_complete(_resolve_all(router, requests)) for i in range(repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--routes', type=int, default=300)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    loop = asyncio.new_event_loop()
+    default, fast = web.UrlDispatcher(), FastUrlDispatcher()
+    paths = build(default, args.routes)
+    build(fast, args.routes)
+    # 每个路径只构造一个请求对象，请求序列里重复引用，构造请求的开销不进入计时
+    prebuilt = dict((p, make_mocked_request(*p)) for p in paths)
+    requests = [prebuilt[random.choice(paths)] for i in range(args.requests)]
+    for name, router in (('default', default), ('compiled', fast)):
+        elapsed = bench(router, requests, list(prebuilt.values()), loop, args.repeat)
+        print('%-10s %d routes: %.2f us/resolve (best of %d)' % (name, len(paths), elapsed / len(requests) * 1e6, args.repeat))
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
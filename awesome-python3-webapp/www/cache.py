@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+' bounded in-memory LRU cache with TTL '
+
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Keep at most `maxsize` entries, each valid for `ttl` seconds (None means forever).
+    Every hit moves the entry to the end, the least recently used one is evicted first.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key => (expires, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires, value = item
+        if expires is not None and expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def replace(self, key, value):
+        '''
+        Change the value of a live entry but keep its expiry; return False if there is none.
+        '''
+        item = self._data.get(key)
+        if item is None or (item[0] is not None and item[0] < time.monotonic()):
+            return False
+        self._data[key] = (item[0], value)
+        return True
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+
+_missing = object()
@@ -6,6 +6,12 @@ Default configurations.
 '''
 
 configs = {
+    'server': {
+        'host': '127.0.0.1',
+        'port': 9000,
+        # 收到SIGTERM后等待处理中的请求完成的最长时间（秒）
+        'shutdown_timeout': 10.0
+    },
     'db': {
         'host': '127.0.0.1',
         'port': 3306,
@@ -14,6 +20,79 @@ configs = {
         'database': 'awesome'
     },
     'session': {
-        'secret': 'Awesome'
+        'secret': 'Awesome',
+        'name': 'awesession',
+        'max_age': 86400,
+        # 进程内缓存的用户数和缓存有效期（秒）
+        'cache_size': 10000,
+        'cache_ttl': 300
+    },
+    'metrics': {
+        'path': '/metrics'
+    },
+    'admission': {
+        # 全局同时处理的请求数、排队上限、排队超时（秒）
+        'concurrency': 100,
+        'queue': 200,
+        'timeout': 1.0,
+        'retry_after': 1,
+        # 按前缀匹配，priority越小越先出队；concurrency/queue为该前缀单独的限制
+        'rules': [
+            {'prefix': '/api/', 'priority': 0, 'concurrency': 80, 'queue': 160},
+            {'prefix': '/', 'priority': 1, 'concurrency': 40, 'queue': 80}
+        ],
+        # 不做准入控制的前缀
+        'exempt': ['/metrics', '/static/'],
+        # 每个客户端的令牌桶限速，如{'rate': 20, 'burst': 40}，None表示不限速
+        'rate': None
+    },
+    'search': {
+        # 索引文件，相对路径相对于www目录；不存在时启动时从数据库重建
+        'path': 'search.idx',
+        # 有变更时定期保存的间隔（秒）
+        'save_interval': 300
+    },
+    'feeds': {
+        # 订阅和sitemap里链接的前缀
+        'base_url': 'http://127.0.0.1:9000',
+        'title': 'Awesome Python Webapp',
+        # 订阅里的博客篇数，sitemap每个分片的url数（协议上限50000）
+        'size': 20,
+        'shard_size': 50000
+    },
+    'counters': {
+        # 计数器名称，增量先攒在内存里，定期批量写入counters表
+        'names': ['blog_views', 'blog_comments'],
+        'flush_interval': 5,
+        # 待写的key超过这个数就提前写一次
+        'max_pending': 10000,
+        # 缓存的数据库值多少秒后重新读，多个worker时能看到别的worker写进去的增量
+        'cache_ttl': 30
+    },
+    'jobs': {
+        # 扫描这些模块里用@task定义的任务
+        'modules': ['mail'],
+        # 同时执行的任务数，以及阻塞任务（如smtplib）使用的线程数
+        'concurrency': 4,
+        'threads': 4,
+        # 失败重试：最多执行次数，第n次失败后等待backoff * 2^(n-1)秒，不超过max_backoff
+        'max_attempts': 5,
+        'backoff': 10,
+        'max_backoff': 3600,
+        'poll_interval': 5,
+        # 领取任务后的租约（秒），进程崩溃后任务在租约到期时被重新执行
+        'lease': 300,
+        # 关闭时等待执行中任务的时间（秒）
+        'drain_timeout': 5
+    },
+    'mail': {
+        # host为空时不发送邮件，只记录日志
+        'host': '',
+        'port': 25,
+        'user': '',
+        'password': '',
+        'from_addr': 'Awesome Python Webapp <noreply@example.com>',
+        'starttls': True,
+        'timeout': 30
     }
 }
@@ -0,0 +1,39 @@
+'''
+Shared test fixtures: a seeded SQLite stand-in installed as the orm pool, and quiet logging.
+'''
+
+import logging
+
+import pytest
+
+import orm, sqlite_pool
+
+
+@pytest.fixture(scope='session', autouse=True)
+def quiet_logging():
+    # orm每条SQL都打INFO日志，测试时只看警告以上，结束后恢复
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    yield
+    logger.setLevel(level)
+
+
+@pytest.fixture(scope='session')
+def make_db(tmp_path_factory):
+    '''
+    make_db(users, blogs, comments) seeds a new database file, installs it with orm.set_pool and returns its path.
+    '''
+    def make(users=2, blogs=10, comments=5):
+        path = str(tmp_path_factory.mktemp('db') / 'test.db')
+        sqlite_pool.seed(path, users, blogs, comments)
+        orm.set_pool(sqlite_pool.create_pool(path))
+        return path
+
+    yield make
+    orm.set_pool(None)
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db()
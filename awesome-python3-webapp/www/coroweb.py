@@ -3,12 +3,14 @@
 
 __author__ = 'Michael Liao'
 
-import asyncio, os, inspect, logging, functools
+import asyncio, os, inspect, logging, functools, time
 
 from urllib import parse
 
 from aiohttp import web
+from aiohttp.web_urldispatcher import UrlMappingMatchInfo
 
+import startup
 from apis import APIError
 
 
@@ -141,19 +143,19 @@ class RequestHandler(object):
             if request.method == 'POST':
                 # 根据request参数中的content_type使用不同解析方法：
                 if not request.content_type:   # 如果content_type不存在，返回400错误
-                    return web.HTTPBadRequest('Missing Content-Type.')
+                    return web.HTTPBadRequest(text='Missing Content-Type.')
                 ct = request.content_type.lower()  # 小写，便于检查
                 if ct.startswith('application/json'):  # json格式数据
                     params = await request.json()  # 仅解析body字段的json数据
                     if not isinstance(params, dict):  # request.json()返回dict对象
-                        return web.HTTPBadRequest('JSON body must be object.')
+                        return web.HTTPBadRequest(text='JSON body must be object.')
                     kw = params
                 # form表单请求的编码形式
                 elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
                     params = await request.post()  # 返回post的内容中解析后的数据。dict-like对象。
                     kw = dict(**params)  # 组成dict，统一kw格式
                 else:
-                    return web.HTTPBadRequest('Unsupported Content-Type: %s' % request.content_type)
+                    return web.HTTPBadRequest(text='Unsupported Content-Type: %s' % request.content_type)
             if request.method == 'GET':
                 qs = request.query_string  # 返回URL查询语句，?后的键值。string形式。
                 if qs:
@@ -193,7 +195,7 @@ class RequestHandler(object):
         if self._required_kw_args:  # 视图函数存在无默认值的命名关键词参数
             for name in self._required_kw_args:
                 if not name in kw:  # 若未传入必须参数值，报错
-                    return web.HTTPBadRequest('Missing argument: %s' % name)
+                    return web.HTTPBadRequest(text='Missing argument: %s' % name)
         # 至此，kw为视图函数fn真正能调用的参数
         # request请求中的参数，终于传递给了视图函数
         logging.info('call with args: %s' % str(kw))
@@ -204,32 +206,131 @@ class RequestHandler(object):
             return dict(error=e.error, data=e.data, message=e.message)
 
 
+# 路由树的节点，每一层对应URL中'/'分隔的一段
+class _RouteNode(object):
+    __slots__ = ('static', 'param', 'param_name', 'routes')
+
+    def __init__(self):
+        self.static = dict()  # 固定的段 => 子节点
+        self.param = None  # {name}段对应的子节点
+        self.param_name = None
+        self.routes = dict()  # method => route
+
+
+def _is_param(segment):
+    return segment.startswith('{') and segment.endswith('}') and segment.count('{') == 1 and ':' not in segment
+
+
+# 编译后的路由表：
+# 1、不含变量的路径直接用dict按(method, path)精确查找
+# 2、只含{name}变量的路径放进按段组织的路由树，固定段优先于变量段匹配
+# 3、其余情况（如{id:\d+}正则、/a-{x}这种段内变量、通配方法）交还给aiohttp默认的线性匹配
+class FastUrlDispatcher(web.UrlDispatcher):
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._exact = dict()
+        self._tree = _RouteNode()
+
+    def add_route(self, method, path, handler, **kw):
+        route = super().add_route(method, path, handler, **kw)
+        method = route.method
+        if method == '*':
+            return route
+        if '{' not in path:
+            self._exact.setdefault((method, path), route)
+            return route
+        segments = path.split('/')
+        if not all(_is_param(seg) or '{' not in seg for seg in segments):
+            return route
+        node = self._tree
+        for seg in segments:
+            if _is_param(seg):
+                name = seg[1:-1]
+                if node.param is None:
+                    node.param, node.param_name = _RouteNode(), name
+                elif node.param_name != name:
+                    # 同一位置的变量名不一致，无法共用一个节点，交给默认匹配
+                    return route
+                node = node.param
+            else:
+                node = node.static.setdefault(seg, _RouteNode())
+        node.routes.setdefault(method, route)
+        return route
+
+    async def resolve(self, request):
+        method = request.method
+        path = request.rel_url.raw_path
+        route = self._exact.get((method, path))
+        if route is not None:
+            return UrlMappingMatchInfo({}, route)
+        match_dict = dict()
+        route = self._match(self._tree, path.split('/'), 0, method, match_dict)
+        if route is not None:
+            return UrlMappingMatchInfo(match_dict, route)
+        # 找不到时由默认实现处理，包括404/405以及静态文件等资源
+        return (await super().resolve(request))
+
+    def _match(self, node, segments, i, method, match_dict):
+        if i == len(segments):
+            return node.routes.get(method)
+        seg = segments[i]
+        child = node.static.get(seg)
+        if child is not None:
+            route = self._match(child, segments, i + 1, method, match_dict)
+            if route is not None:
+                return route
+        if node.param is not None and seg:
+            route = self._match(node.param, segments, i + 1, method, match_dict)
+            if route is not None:
+                match_dict[node.param_name] = parse.unquote(seg)
+                return route
+        return None
+
+
 # 添加静态文件，如image，css，javascript等
-def add_static(app):
+def add_static(app, path=None):
     # 拼接static文件目录
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
     app.router.add_static('/static/', path)
     logging.info('add static %s => %s' % ('/static/', path))
 
 
+def _to_coroutine(fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kw):
+        return fn(*args, **kw)
+    return wrapper
+
+
 # 编写一个add_route函数，用来注册一个URL处理函数：
 # 完成了RequestHandler类的编写，我们需要在app中注册视图函数（添加路由）。
 # add_route函数功能：
 # 1、验证视图函数是否拥有method和path参数
 # 2、将视图函数转变为协程
 def add_route(app, fn):
+    start = time.perf_counter()
     # getattr() 函数用于返回一个对象属性值
     method = getattr(fn, '__method__', None)
     path = getattr(fn, '__route__', None)
     if path is None or method is None:
         raise ValueError('@get or @post not defined in %s.' % str(fn))
     # 判断URL处理函数是否协程并且是生成器
-    if not asyncio.iscoroutinefunction(fn) and not inspect.isgeneratorfunction(fn):
-        fn = asyncio.coroutine(fn)
+    # @get/@post返回的wrapper本身不是协程函数，要看被包装的原函数；python3.11已经没有asyncio.coroutine
+    if not asyncio.iscoroutinefunction(inspect.unwrap(fn)) and not inspect.isgeneratorfunction(fn):
+        fn = _to_coroutine(fn)
     logging.info(
         'add route %s %s => %s(%s)' % (method, path, fn.__name__, ', '.join(inspect.signature(fn).parameters.keys())))
     # 在app中注册经RequestHandler类封装的视图函数
-    app.router.add_route(method, path, RequestHandler(app, fn))
+    # aiohttp3只把协程函数当作原生handler，其他可调用对象的返回值必须是web.StreamResponse，
+    # 而这里返回的dict、str要留给response_factory处理，所以再包一层协程函数
+    handler = RequestHandler(app, fn)
+
+    async def request_handler(request):
+        return (await handler(request))
+    app.router.add_route(method, path, request_handler)
+    startup.record('route', '%s %s' % (method, path), time.perf_counter() - start)
 
 
 # 导入模块，批量注册视图函数
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Write-behind counters: increments are buffered in memory per key and flushed periodically
+as one batched INSERT ... ON DUPLICATE KEY UPDATE into the `counters` table.
+Reads return the database value plus whatever is still pending.
+'''
+
+import asyncio, logging
+
+import orm
+from cache import LRUCache
+from models import Comment
+
+# 每条INSERT语句最多带多少行
+BATCH_SIZE = 500
+
+
+class BufferedCounter(object):
+
+    def __init__(self, name, flush_interval=5.0, max_pending=10000, cache_size=10000, cache_ttl=30):
+        self.name = name
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = dict()  # key => 还没有写库的增量
+        self._flushing = dict()  # key => 正在写库的增量，写完之前读的时候也要算上
+        # key => 数据库里的值；有过期时间，其他worker写进去的增量过一会儿也能读到
+        self._db = LRUCache(cache_size, cache_ttl)
+        self._generation = 0  # 写库开始和结束时各加一，奇数表示正在写库
+        self._lock = asyncio.Lock()
+        self._wakeup = None
+
+    def incr(self, key, n=1):
+        self._pending[key] = self._pending.get(key, 0) + n
+        if len(self._pending) >= self.max_pending and self._wakeup is not None:
+            # 积压太多，不等定时器提前写一次
+            self._wakeup.set()
+
+    def _delta(self, key):
+        return self._pending.get(key, 0) + self._flushing.get(key, 0)
+
+    async def get(self, key):
+        return (await self.get_many([key]))[key]
+
+    async def get_many(self, keys):
+        values = dict()
+        missing = []
+        for key in keys:
+            v = self._db.get(key)
+            if v is None:
+                missing.append(key)
+            else:
+                values[key] = v
+        for attempt in range(3):
+            if not missing:
+                break
+            generation = self._generation
+            rs = await orm.select('select `key`, `value` from `counters` where `name`=? and `key` in (%s)'
+                                  % orm.create_args_string(len(missing)), [self.name] + missing)
+            found = dict((r['key'], r['value']) for r in rs)
+            for key in missing:
+                values[key] = found.get(key, 0)
+            if generation == self._generation:
+                # 读的时候有写库在进行（generation为奇数），读到的可能差一批增量，这次先这样返回，但不缓存
+                if generation % 2 == 0:
+                    for key in missing:
+                        self._db.set(key, values[key])
+                break
+            # 读库期间有一次写库结束了，读到的可能是写之前的值，而那批增量已经不在_delta里了，重读
+        return dict((key, values[key] + self._delta(key)) for key in keys)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, dict()
+            items = list(self._flushing.items())
+            self._generation += 1
+            try:
+                for i in range(0, len(items), BATCH_SIZE):
+                    batch = items[i:i + BATCH_SIZE]
+                    args = []
+                    for key, n in batch:
+                        args.extend((self.name, key, n))
+                    await orm.execute('insert into `counters` (`name`, `key`, `value`) values %s '
+                                      'on duplicate key update `value`=`value`+values(`value`)'
+                                      % ', '.join(['(?, ?, ?)'] * len(batch)), args)
+                    # 已经写进去的部分计入缓存的数据库值，但不延长过期时间，到期后照样重读，才能看到其他worker的增量
+                    for key, n in batch:
+                        v = self._db.get(key)
+                        if v is not None:
+                            self._db.replace(key, v + n)
+                        del self._flushing[key]
+            except BaseException:
+                # 没写进去的放回待写队列，下次再试
+                for key, n in self._flushing.items():
+                    self._pending[key] = self._pending.get(key, 0) + n
+                self._flushing = dict()
+                raise
+            finally:
+                self._generation += 1
+            return len(items)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                n = await self.flush()
+                if n:
+                    logging.info('counter %s: flushed %s keys' % (self.name, n))
+            except Exception:
+                logging.exception('counter %s: flush failed' % self.name)
+
+
+def add_counters(app, names=(), **kw):
+    '''
+    Create app['__counters__'][name] for each name, flush them in the background
+    and once more on cleanup, after in-flight requests have drained.
+    '''
+    counters = app['__counters__'] = dict((name, BufferedCounter(name, **kw)) for name in names)
+    tasks = []
+
+    async def on_startup(app):
+        for c in counters.values():
+            tasks.append(asyncio.ensure_future(c.run()))
+
+    async def on_cleanup(app):
+        for t in tasks:
+            t.cancel()
+        for c in counters.values():
+            await c.flush()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return counters
+
+
+def count_comments(counter):
+    '''
+    Keep per-blog comment counts in `counter` up to date from Comment writes.
+    '''
+    orm.add_listener(Comment, 'save', lambda c: counter.incr(c.blog_id))
+    orm.add_listener(Comment, 'remove', lambda c: counter.incr(c.blog_id, -1))
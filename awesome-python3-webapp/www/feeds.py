@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Atom/RSS feeds and sitemap served from prebuilt bytes.
+
+Each blog's feed entry is rendered once when the blog is saved or updated, the feed document
+is just the joined fragments. The sitemap is split into shards of `shard_size` urls, a change
+only marks its own shard dirty, and dirty parts are rebuilt on the next request.
+'''
+
+import hashlib, logging, time
+
+from datetime import datetime, timezone
+from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
+
+from aiohttp import web
+
+import orm
+from models import Blog
+
+
+class Prebuilt(object):
+    '''
+    A ready-to-send document with its validators.
+    '''
+    __slots__ = ('body', 'etag', 'last_modified', 'content_type')
+
+    def __init__(self, body, last_modified, content_type):
+        self.body = body
+        self.last_modified = int(last_modified)
+        # 时间也算进ETag，重建后两个校验值一起变
+        self.etag = '"%s"' % hashlib.sha1(body + b'%d' % self.last_modified).hexdigest()[:20]
+        self.content_type = content_type
+
+    def response(self, request):
+        headers = {'ETag': self.etag, 'Last-Modified': formatdate(self.last_modified, usegmt=True)}
+        inm = request.headers.get('If-None-Match')
+        if inm is not None:
+            if self.etag in [t.strip() for t in inm.split(',')] or inm.strip() == '*':
+                return web.Response(status=304, headers=headers)
+        else:
+            ims = request.if_modified_since
+            if ims is not None and ims.timestamp() >= self.last_modified:
+                return web.Response(status=304, headers=headers)
+        resp = web.Response(body=self.body, headers=headers)
+        resp.content_type = self.content_type
+        return resp
+
+
+def _iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class Feeds(object):
+
+    def __init__(self, base_url, title, size=20, shard_size=50000):
+        self.base_url = base_url.rstrip('/')
+        self.title = title
+        self.size = size
+        self.shard_size = shard_size
+        # 订阅：最新size篇博客，id => (created_at, modified, atom片段, rss片段)
+        self._entries = dict()
+        self._atom = self._rss = None
+        # 删除博客的时间，文档的修改时间不能比它早，否则Last-Modified会倒退
+        self._feed_removed = 0
+        # sitemap：按发表顺序排列的[id, lastmod]，每shard_size个一个分片
+        self._urls = []
+        self._pos = dict()
+        self._shards = []  # 分片编号 => Prebuilt，None表示需要重建
+        self._shard_removed = []  # 分片编号 => 分片里最近一次删除url的时间
+        self._index = None
+
+    def blog_url(self, id):
+        return '%s/blog/%s' % (self.base_url, id)
+
+    def load(self, blogs, urls):
+        '''
+        Initial state: the newest blogs for the feed and (id, created_at) of every blog for the sitemap.
+        '''
+        for blog in blogs:
+            self._render_entry(blog, blog.created_at)
+        self._urls = [[id, created_at] for id, created_at in urls]
+        self._pos = dict((u[0], i) for i, u in enumerate(self._urls))
+        self._shards = [None] * self._shard_count()
+        self._shard_removed = [0] * self._shard_count()
+        self._atom = self._rss = self._index = None
+
+    def _render_entry(self, blog, modified):
+        url = self.blog_url(blog.id)
+        atom = ('<entry><title>%s</title><link href=%s/><id>%s</id><updated>%s</updated>'
+                '<author><name>%s</name></author><summary>%s</summary></entry>\n') % (
+            escape(blog.name), quoteattr(url), escape(url), _iso(modified), escape(blog.user_name), escape(blog.summary))
+        rss = ('<item><title>%s</title><link>%s</link><guid>%s</guid><pubDate>%s</pubDate>'
+               '<description>%s</description></item>\n') % (
+            escape(blog.name), escape(url), escape(url), formatdate(blog.created_at, usegmt=True), escape(blog.summary))
+        self._entries[blog.id] = (blog.created_at, modified, atom.encode('utf-8'), rss.encode('utf-8'))
+        if len(self._entries) > self.size:
+            oldest = min(self._entries, key=lambda id: self._entries[id][0])
+            del self._entries[oldest]
+
+    def on_blog(self, blog):
+        modified = time.time()
+        # 只有能进入最新size篇的博客才需要渲染到订阅里
+        if blog.id in self._entries or len(self._entries) < self.size or \
+                blog.created_at > min(e[0] for e in self._entries.values()):
+            self._render_entry(blog, modified)
+            self._atom = self._rss = None
+        pos = self._pos.get(blog.id)
+        if pos is None:
+            pos = self._pos[blog.id] = len(self._urls)
+            self._urls.append([blog.id, modified])
+            while len(self._shards) < self._shard_count():
+                self._shards.append(None)
+                self._shard_removed.append(0)
+        else:
+            self._urls[pos][1] = modified
+        self._shards[pos // self.shard_size] = None
+        self._index = None
+
+    def on_remove(self, blog):
+        '''
+        Drop a removed blog, return True when it was in the feed and refill() should run.
+        '''
+        now = time.time()
+        removed = self._entries.pop(blog.id, None) is not None
+        if removed:
+            self._feed_removed = now
+            self._atom = self._rss = None
+        pos = self._pos.pop(blog.id, None)
+        if pos is None:
+            return removed
+        del self._urls[pos]
+        for i in range(pos, len(self._urls)):
+            self._pos[self._urls[i][0]] = i
+        # 后面的url都前移了一位，从这个分片开始全部重建
+        first, count = pos // self.shard_size, self._shard_count()
+        self._shards = self._shards[:first] + [None] * (count - first)
+        self._shard_removed = self._shard_removed[:first] + [now] * (count - first)
+        self._index = None
+        return removed
+
+    async def refill(self):
+        # 删掉一篇后从数据库补上紧接着的更早的博客，订阅保持size篇
+        need = self.size - len(self._entries)
+        if need <= 0:
+            return
+        if self._entries:
+            oldest = min(e[0] for e in self._entries.values())
+            # 和最旧一篇同一时间发表的也可能还没进订阅，多取几条再跳过已有的
+            ties = sum(1 for e in self._entries.values() if e[0] == oldest)
+            blogs = await Blog.findAll('`created_at`<=?', [oldest], orderBy='`created_at` desc', limit=need + ties)
+        else:
+            blogs = await Blog.findAll(orderBy='`created_at` desc', limit=need)
+        blogs = [b for b in blogs if b.id not in self._entries][:need]
+        for blog in blogs:
+            self._render_entry(blog, blog.created_at)
+        if blogs:
+            self._atom = self._rss = None
+
+    def _shard_count(self):
+        return max(1, (len(self._urls) + self.shard_size - 1) // self.shard_size)
+
+    def _sorted_entries(self):
+        return sorted(self._entries.values(), key=lambda e: -e[0])
+
+    def atom(self):
+        if self._atom is None:
+            entries = self._sorted_entries()
+            updated = max([e[1] for e in entries] + [self._feed_removed])
+            head = ('<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">'
+                    '<title>%s</title><link href=%s/><link rel="self" href=%s/><id>%s/</id><updated>%s</updated>\n') % (
+                escape(self.title), quoteattr(self.base_url + '/'), quoteattr(self.base_url + '/feed'),
+                escape(self.base_url), _iso(updated))
+            body = b''.join([head.encode('utf-8')] + [e[2] for e in entries] + [b'</feed>\n'])
+            self._atom = Prebuilt(body, updated, 'application/atom+xml;charset=utf-8')
+        return self._atom
+
+    def rss(self):
+        if self._rss is None:
+            entries = self._sorted_entries()
+            updated = max([e[1] for e in entries] + [self._feed_removed])
+            head = ('<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>'
+                    '<title>%s</title><link>%s/</link><description>%s</description><lastBuildDate>%s</lastBuildDate>\n') % (
+                escape(self.title), escape(self.base_url), escape(self.title), formatdate(updated, usegmt=True))
+            body = b''.join([head.encode('utf-8')] + [e[3] for e in entries] + [b'</channel></rss>\n'])
+            self._rss = Prebuilt(body, updated, 'application/rss+xml;charset=utf-8')
+        return self._rss
+
+    def sitemap(self, n=None):
+        '''
+        n=None gives /sitemap.xml: the only shard, or an index of shards when there are several.
+        Returns None for a shard number out of range.
+        '''
+        count = self._shard_count()
+        if n is None and count > 1:
+            return self._sitemap_index()
+        n = n or 0
+        if n < 0 or n >= count:
+            return None
+        if self._shards[n] is None:
+            urls = self._urls[n * self.shard_size:(n + 1) * self.shard_size]
+            L = ['<?xml version="1.0" encoding="utf-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+            for id, lastmod in urls:
+                L.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (escape(self.blog_url(id)), _iso(lastmod)))
+            L.append('</urlset>\n')
+            self._shards[n] = Prebuilt(''.join(L).encode('utf-8'), max([u[1] for u in urls] + [self._shard_removed[n]]),
+                                       'application/xml;charset=utf-8')
+        return self._shards[n]
+
+    def _sitemap_index(self):
+        if self._index is None:
+            shards = [self.sitemap(n) for n in range(self._shard_count())]
+            L = ['<?xml version="1.0" encoding="utf-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+            for n, shard in enumerate(shards):
+                L.append('<sitemap><loc>%s/sitemap-%d.xml</loc><lastmod>%s</lastmod></sitemap>\n'
+                         % (escape(self.base_url), n, _iso(shard.last_modified)))
+            L.append('</sitemapindex>\n')
+            self._index = Prebuilt(''.join(L).encode('utf-8'), max(s.last_modified for s in shards),
+                                   'application/xml;charset=utf-8')
+        return self._index
+
+
+def add_feeds(app, **kw):
+    feeds = app['__feeds__'] = Feeds(**kw)
+    orm.add_listener(Blog, 'save', feeds.on_blog)
+    orm.add_listener(Blog, 'update', feeds.on_blog)
+
+    async def on_remove(blog):
+        if feeds.on_remove(blog):
+            await feeds.refill()
+
+    orm.add_listener(Blog, 'remove', on_remove)
+
+    async def on_startup(app):
+        blogs = await Blog.findAll(orderBy='created_at desc', limit=feeds.size)
+        rs = await orm.select('select `id`, `created_at` from `%s` order by `created_at`' % Blog.__table__, [])
+        feeds.load(blogs, [(r['id'], r['created_at']) for r in rs])
+        logging.info('feeds loaded: %s entries, %s sitemap urls' % (len(blogs), len(rs)))
+
+    app.on_startup.append(on_startup)
+    return feeds
@@ -5,10 +5,14 @@ __author__ = 'Michael Liao'
 
 ' url handlers '
 
-import re, time, json, logging, hashlib, base64, asyncio
+import re, time, json, logging, hashlib, base64, asyncio, binascii
+
+from aiohttp import web
 
 from coroweb import get, post
 
+from apis import APIValueError
+
 from models import User, Comment, Blog, next_id
 
 
@@ -26,3 +30,102 @@ async def index(request):
         '__template__': 'blogs.html',
         'blogs': blogs
     }
+
+
+def _parse_limit(limit, maximum=100):
+    # 查询参数里的limit：不是整数返回400，其余限制在[1, maximum]之间，负数不能进SQL
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise APIValueError('limit', 'limit must be an integer')
+    return min(max(limit, 1), maximum)
+
+
+@get('/api/blogs')
+async def api_blogs(request, *, limit='20'):
+    blogs = await Blog.findAll(orderBy='created_at desc', limit=_parse_limit(limit))
+    counts = await request.app['__counters__']['blog_comments'].get_many([b.id for b in blogs])
+    for b in blogs:
+        b['comments'] = counts[b.id]
+    return dict(blogs=blogs)
+
+
+@get('/api/blogs/{id}')
+async def api_get_blog(request, *, id):
+    blog = await Blog.find(id)
+    if blog is None:
+        raise web.HTTPNotFound()
+    # 浏览数只在内存里加一，由计数器定期批量写库
+    views = request.app['__counters__']['blog_views']
+    views.incr(id)
+    blog['views'] = await views.get(id)
+    blog['comments'] = await request.app['__counters__']['blog_comments'].get(id)
+    return blog
+
+
+# 评论分页的游标是上一页最后一条评论的(created_at, id)，配合(blog_id, created_at, id)索引，翻到多深都只扫描一页
+def _encode_cursor(comment):
+    s = '%r,%s' % (comment.created_at, comment.id)
+    return base64.urlsafe_b64encode(s.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        s = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, id = s.split(',', 1)
+        return float(created_at), id
+    except (ValueError, binascii.Error):
+        raise APIValueError('cursor', 'invalid cursor')
+
+
+@get('/api/blogs/{id}/comments')
+async def api_blog_comments(request, *, id, limit='20', cursor=None):
+    limit = _parse_limit(limit)
+    if cursor:
+        created_at, last_id = _decode_cursor(cursor)
+        where = '`blog_id`=? and (`created_at`<? or (`created_at`=? and `id`<?))'
+        args = [id, created_at, created_at, last_id]
+    else:
+        where = '`blog_id`=?'
+        args = [id]
+    # 多取一条，用来判断还有没有下一页
+    comments = await Comment.findAll(where, args, orderBy='`created_at` desc, `id` desc', limit=limit + 1)
+    next_cursor = _encode_cursor(comments[limit - 1]) if len(comments) > limit else None
+    count = await request.app['__counters__']['blog_comments'].get(id)
+    return dict(comments=comments[:limit], next=next_cursor, count=count)
+
+
+@get('/api/search')
+async def api_search(request, *, q='', limit='20'):
+    results = []
+    for key, extra, score in request.app['__search__'].search(q, _parse_limit(limit)):
+        kind, id = key.split(':', 1)
+        r = dict(type=kind, id=id, score=round(score, 4))
+        # 博客附带标题，评论附带所属博客的id
+        r['name' if kind == 'blog' else 'blog_id'] = extra
+        results.append(r)
+    return dict(results=results)
+
+
+# 订阅和sitemap都是预先生成好的bytes，带ETag/Last-Modified，支持条件请求
+@get('/feed')
+async def atom_feed(request):
+    return request.app['__feeds__'].atom().response(request)
+
+
+@get('/rss')
+async def rss_feed(request):
+    return request.app['__feeds__'].rss().response(request)
+
+
+@get('/sitemap.xml')
+async def sitemap(request):
+    return request.app['__feeds__'].sitemap().response(request)
+
+
+@get('/sitemap-{n}.xml')
+async def sitemap_shard(request, *, n):
+    doc = request.app['__feeds__'].sitemap(int(n)) if n.isdigit() else None
+    if doc is None:
+        raise web.HTTPNotFound()
+    return doc.response(request)
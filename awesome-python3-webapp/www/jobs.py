@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-process background jobs persisted to the `jobs` table.
+
+Tasks are plain functions marked with @task in the modules listed in configs.jobs.modules,
+a handler enqueues one by name and returns immediately:
+
+    await request.app['__jobs__'].enqueue('send_mail', to_addr=user.email, subject='...', body='...')
+
+Coroutine tasks run on the event loop, @task(blocking=True) ones in a thread pool.
+A job is claimed by switching it to 'running' with a lease, so several processes can share
+the table and a job left behind by a crash is picked up again once its lease expires;
+an expired lease counts as a failed attempt.
+Failed jobs are retried with exponential backoff; delivery is at-least-once.
+'''
+
+import asyncio, functools, json, logging, random, time, traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+import orm
+from models import Job
+
+
+def task(blocking=False):
+    '''
+    Define a job task: @task() for a coroutine function, @task(blocking=True) for a plain one.
+    '''
+    def decorator(func):
+        func.__task__ = func.__name__
+        func.__blocking__ = blocking
+        return func
+    return decorator
+
+
+class JobQueue(object):
+
+    def __init__(self, concurrency=4, threads=4, max_attempts=5, backoff=10, max_backoff=3600,
+                 poll_interval=5, lease=300, drain_timeout=5):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.drain_timeout = drain_timeout
+        self._tasks = dict()  # 任务名 => 函数
+        self._executor = ThreadPoolExecutor(threads)
+        self._running = dict()  # job id => (job, asyncio.Task)
+        self._wakeup = asyncio.Event()
+        self._scheduler = None
+
+    def add_tasks(self, module_name):
+        # 和coroweb.add_routes()一样，扫描模块中带__task__属性的函数
+        n = module_name.rfind('.')
+        if n == (-1):
+            mod = __import__(module_name, globals(), locals())
+        else:
+            name = module_name[n + 1:]
+            mod = getattr(__import__(module_name[:n], globals(), locals(), [name]), name)
+        for attr in dir(mod):
+            if attr.startswith('_'):
+                continue
+            fn = getattr(mod, attr)
+            name = getattr(fn, '__task__', None)
+            if callable(fn) and name:
+                logging.info('add task %s (%s)' % (name, 'blocking' if fn.__blocking__ else 'async'))
+                self._tasks[name] = fn
+
+    async def enqueue(self, name, delay=0, **kw):
+        if name not in self._tasks:
+            raise ValueError('unknown task: %s' % name)
+        job = Job(name=name, args=json.dumps(kw, ensure_ascii=False), status='pending',
+                  attempts=0, run_at=time.time() + delay)
+        await job.save()
+        if delay <= 0:
+            self._wakeup.set()
+        return job
+
+    async def _claim(self, job):
+        # 用原来的status和run_at做条件更新，只有一个进程能领到
+        until = time.time() + self.lease
+        status, attempts, error = 'running', job.attempts, job.error
+        if job.status == 'running':
+            # 租约到期说明上次执行没有结果（进程崩溃或者卡住），也算一次失败，
+            # 否则每次都让进程崩溃的任务会被无限重领
+            attempts += 1
+            error = 'lease expired (attempt %s)' % attempts
+            if attempts >= self.max_attempts:
+                status = 'failed'
+        rows = await orm.execute('update `jobs` set `status`=?, `run_at`=?, `attempts`=?, `error`=? '
+                                 'where `id`=? and `status`=? and `run_at`=?',
+                                 [status, until, attempts, error, job.id, job.status, job.run_at])
+        if rows != 1:
+            return False
+        job.status, job.run_at, job.attempts, job.error = status, until, attempts, error
+        if status == 'failed':
+            logging.error('job %s %s failed after %s attempts: %s' % (job.name, job.id, attempts, error))
+            return False
+        return True
+
+    async def _dispatch(self):
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return
+        # running且run_at已过期的是租约到期、没人在跑的任务
+        jobs = await Job.findAll('`status` in (?, ?) and `run_at`<=?', ['pending', 'running', time.time()],
+                                 orderBy='`run_at`', limit=free + len(self._running))
+        for job in jobs:
+            if job.id in self._running or len(self._running) >= self.concurrency:
+                continue
+            if await self._claim(job):
+                self._running[job.id] = (job, asyncio.ensure_future(self._execute(job)))
+
+    async def _execute(self, job):
+        try:
+            fn = self._tasks.get(job.name)
+            if fn is None:
+                raise LookupError('unknown task: %s' % job.name)
+            kw = json.loads(job.args)
+            if fn.__blocking__:
+                await asyncio.get_event_loop().run_in_executor(self._executor, functools.partial(fn, **kw))
+            else:
+                await fn(**kw)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            job.attempts += 1
+            job.error = traceback.format_exc()[-4000:]
+            if job.attempts >= self.max_attempts:
+                job.status = 'failed'
+                logging.error('job %s %s failed after %s attempts:\n%s' % (job.name, job.id, job.attempts, job.error))
+            else:
+                delay = min(self.backoff * 2 ** (job.attempts - 1), self.max_backoff)
+                job.status = 'pending'
+                job.run_at = time.time() + delay * random.uniform(0.5, 1.0)
+                logging.warning('job %s %s failed (attempt %s), retry in %.0fs' % (job.name, job.id, job.attempts, job.run_at - time.time()))
+            await self._finish(job.update())
+        else:
+            await self._finish(job.remove())
+        finally:
+            self._running.pop(job.id, None)
+            self._wakeup.set()
+
+    async def _finish(self, coro):
+        try:
+            await coro
+        except Exception:
+            # 写不回去也没关系，租约到期后会重新执行
+            logging.exception('failed to record job result')
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._dispatch()
+            except Exception:
+                logging.exception('job dispatch failed')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._scheduler = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+        running = [t for job, t in self._running.values()]
+        if running:
+            logging.info('waiting for %s running jobs...' % len(running))
+            await asyncio.wait(running, timeout=self.drain_timeout)
+        # 没跑完的放回pending，下次启动立即重跑，不用等租约过期
+        for job, t in list(self._running.values()):
+            t.cancel()
+            await self._finish(orm.execute('update `jobs` set `status`=?, `run_at`=? where `id`=? and `status`=?',
+                                           ['pending', time.time(), job.id, 'running']))
+        self._executor.shutdown(wait=False)
+
+
+def add_jobs(app, modules=(), **kw):
+    '''
+    Create app['__jobs__'], register tasks from modules, run the scheduler from startup to cleanup.
+    '''
+    queue = app['__jobs__'] = JobQueue(**kw)
+    for module_name in modules:
+        queue.add_tasks(module_name)
+
+    async def on_startup(app):
+        queue.start()
+
+    async def on_cleanup(app):
+        await queue.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return queue
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Mail tasks, run by the job queue in its thread pool since smtplib blocks.
+'''
+
+import logging, smtplib
+
+from email.header import Header
+from email.mime.text import MIMEText
+from email.utils import parseaddr, formataddr
+
+from config import configs
+from jobs import task
+
+
+def _format_addr(s):
+    name, addr = parseaddr(s)
+    return formataddr((Header(name, 'utf-8').encode(), addr))
+
+
+@task(blocking=True)
+def send_mail(to_addr, subject, body, subtype='plain'):
+    cfg = configs.mail
+    if not cfg.host:
+        logging.warning('mail server not configured, drop mail to %s: %s' % (to_addr, subject))
+        return
+    # subtype传'html'即可发送HTML邮件
+    msg = MIMEText(body, subtype, 'utf-8')
+    msg['From'] = _format_addr(cfg.from_addr)
+    msg['To'] = _format_addr(to_addr)
+    msg['Subject'] = Header(subject, 'utf-8').encode()
+    with smtplib.SMTP(cfg.host, cfg.port, timeout=cfg.timeout) as server:
+        if cfg.starttls:
+            server.starttls()
+        if cfg.user:
+            server.login(cfg.user, cfg.password)
+        server.sendmail(parseaddr(cfg.from_addr)[1], [parseaddr(to_addr)[1]], msg.as_string())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+' Prometheus-style metrics middleware '
+
+import time, logging, bisect
+
+from aiohttp import web
+
+import orm
+
+# 延迟直方图的桶上界（秒），最后还有一个隐含的+Inf桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 响应大小直方图的桶上界（字节）
+SIZE_BUCKETS = (128, 1024, 8192, 65536, 524288, 4194304)
+# 数据库连接池的指标
+POOL_GAUGES = (('size', 'Open database connections.'), ('used', 'Database connections checked out.'),
+               ('free', 'Idle database connections.'), ('maxsize', 'Maximum database connections.'))
+
+
+class Histogram(object):
+    '''
+    Fixed-bucket histogram, counts[i] holds observations in (buckets[i-1], buckets[i]].
+    '''
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        # bisect_left找到第一个>=value的桶，正好对应Prometheus的le语义
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # 输出时才把每个桶的计数累加，记录时只需改一个桶
+        total = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            yield bound, total
+
+
+class RouteStats(object):
+    __slots__ = ('method', 'route', 'inflight', 'responses', 'latency', 'size')
+
+    def __init__(self, method, route):
+        self.method = method
+        self.route = route
+        self.inflight = 0
+        self.responses = dict()  # 状态码 => 次数
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+
+    def observe(self, status, elapsed, size):
+        self.responses[status] = self.responses.get(status, 0) + 1
+        self.latency.observe(elapsed)
+        if size is not None:
+            self.size.observe(size)
+
+
+# 取请求匹配到的路由模板，如'/blog/{id}'，而不是原始路径，避免标签数量随URL无限增长
+def route_name(route):
+    resource = getattr(route, 'resource', None)
+    if resource is None:
+        return '<unmatched>'
+    info = resource.get_info()
+    return info.get('formatter') or info.get('path') or info.get('prefix') or '<unknown>'
+
+
+class Metrics(object):
+
+    def __init__(self):
+        # 以route对象为key，热路径上只需一次dict查找
+        self._by_route = dict()
+        # 以(method, 路由模板)为key，多个route对象可能共用一个模板
+        self._stats = dict()
+
+    def stats_for(self, request):
+        route = request.match_info.route
+        stats = self._by_route.get(route)
+        if stats is None:
+            key = (request.method, route_name(route))
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RouteStats(*key)
+            # 404/405每次都会新建一个SystemRoute，只缓存注册过的路由，否则_by_route会无限增长
+            if route.resource is not None:
+                self._by_route[route] = stats
+        return stats
+
+    def render(self):
+        L = []
+        L.append('# HELP http_requests_total Total HTTP responses by route and status.')
+        L.append('# TYPE http_requests_total counter')
+        for s in self._stats.values():
+            for status, n in sorted(s.responses.items()):
+                L.append('http_requests_total{%s,status="%s"} %s' % (_labels(s), status, n))
+        L.append('# HELP http_requests_in_flight Requests currently being handled.')
+        L.append('# TYPE http_requests_in_flight gauge')
+        for s in self._stats.values():
+            L.append('http_requests_in_flight{%s} %s' % (_labels(s), s.inflight))
+        _render_histogram(L, 'http_request_duration_seconds', 'Request latency in seconds.', self._stats, 'latency')
+        _render_histogram(L, 'http_response_size_bytes', 'Response body size in bytes.', self._stats, 'size')
+        pool = orm.pool_stats()
+        for name, help in POOL_GAUGES:
+            L.append('# HELP orm_pool_%s %s' % (name, help))
+            L.append('# TYPE orm_pool_%s gauge' % name)
+            L.append('orm_pool_%s %s' % (name, pool[name]))
+        L.append('')
+        return '\n'.join(L)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(stats):
+    return 'method="%s",route="%s"' % (stats.method, _escape(stats.route))
+
+
+def _render_histogram(L, name, help, stats, attr):
+    L.append('# HELP %s %s' % (name, help))
+    L.append('# TYPE %s histogram' % name)
+    for s in stats.values():
+        h = getattr(s, attr)
+        labels = _labels(s)
+        for bound, total in h.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            L.append('%s_bucket{%s,le="%s"} %s' % (name, labels, le, total))
+        L.append('%s_sum{%s} %s' % (name, labels, h.sum))
+        L.append('%s_count{%s} %s' % (name, labels, h.count))
+
+
+# 记录每个路由的请求数、延迟、响应大小和并发数的middleware
+# 需要放在response_factory之前（外层），这样拿到的已经是web.Response对象
+async def metrics_factory(app, handler):
+    metrics = app['__metrics__']
+
+    async def collect(request):
+        stats = metrics.stats_for(request)
+        stats.inflight += 1
+        start = time.perf_counter()
+        status, size = 500, None
+        try:
+            r = await handler(request)
+            status, size = r.status, r.content_length
+            return r
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            stats.inflight -= 1
+            stats.observe(status, time.perf_counter() - start, size)
+    return collect
+
+
+async def metrics_handler(request):
+    resp = web.Response(body=request.app['__metrics__'].render().encode('utf-8'))
+    resp.content_type = 'text/plain; version=0.0.4;charset=utf-8'
+    return resp
+
+
+# 初始化统计对象并注册暴露指标的路由
+def add_metrics(app, path='/metrics'):
+    app['__metrics__'] = Metrics()
+    app.router.add_route('GET', path, metrics_handler)
+    logging.info('add metrics route GET %s' % path)
@@ -1,7 +1,7 @@
 import time, uuid
 
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, StringField, BooleanField, FloatField, TextField, IntegerField
 
 
 def next_id():
@@ -43,3 +43,17 @@ class Comment(Model):
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
     created_at = FloatField(default=time.time)
+
+
+class Job(Model):
+    __table__ = 'jobs'
+
+    id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
+    name = StringField(ddl='varchar(50)')
+    args = TextField()
+    # pending: 等待执行；running: 已被某个进程领取，run_at是租约到期时间；failed: 重试次数用完
+    status = StringField(ddl='varchar(10)')
+    attempts = IntegerField()
+    run_at = FloatField(default=time.time)
+    error = TextField()
+    created_at = FloatField(default=time.time)
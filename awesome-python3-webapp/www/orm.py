@@ -3,10 +3,12 @@
 
 __author__ = 'Michael Liao'
 
-import asyncio, logging
+import asyncio, logging, time
 
 import aiomysql
 
+import startup
+
 
 # 设置调试级别level,此处为logging.INFO,不设置logging.info()没有任何作用等同于pass
 logging.basicConfig(level=logging.INFO)
@@ -21,6 +23,7 @@ def log(sql, args=()):
 async def create_pool(loop, **kw):
     logging.info('create database connection pool...')
     global __pool
+    start = time.perf_counter()
     __pool = await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
@@ -35,11 +38,48 @@ async def create_pool(loop, **kw):
         minsize=kw.get('minsize', 1),
         loop=loop
     )
+    startup.record('pool', 'connect', time.perf_counter() - start)
+
+
+# fast start时先监听端口,连接池在后台创建,就绪之前的查询在select()/execute()里等待
+_pool_task = None
+
+
+def start_pool(loop, **kw):
+    global _pool_task
+    _pool_task = asyncio.ensure_future(create_pool(loop, **kw))
+    return _pool_task
+
+
+# 直接使用一个已经创建好的连接池,例如压测时用的sqlite_pool
+def set_pool(pool):
+    global __pool
+    __pool = pool
+
+
+# 关闭连接池,wait_closed()会等到所有借出的连接(包括事务中的)归还后才返回
+async def close_pool():
+    pool = globals().get('__pool')
+    if pool is None:
+        return
+    logging.info('close database connection pool...')
+    pool.close()
+    await pool.wait_closed()
+
+
+# 连接池当前的使用情况,供监控使用;连接池尚未创建时全部返回0
+def pool_stats():
+    pool = globals().get('__pool')
+    if pool is None:
+        return dict(size=0, free=0, used=0, maxsize=0)
+    return dict(size=pool.size, free=pool.freesize, used=pool.size - pool.freesize, maxsize=pool.maxsize)
 
 
 # 该协程封装的是查询事务,第一个参数为sql语句,第二个为sql语句中占位符的参数列表,第三个参数是要查询数据的数量
 async def select(sql, args, size=None):
     log(sql, args)
+    if _pool_task is not None:
+        await _pool_task
     global __pool
     # 例子中用的get()方法来获取数据库连接,最新的文档中使用的是acquire(),所以在此做出修改
     # 获取数据库连接
@@ -63,6 +103,8 @@ async def select(sql, args, size=None):
 # 可以定义一个通用的execute()函数，因为这3种SQL的执行都需要相同的参数，以及返回一个整数表示影响的行数：
 async def execute(sql, args, autocommit=True):
     log(sql)
+    if _pool_task is not None:
+        await _pool_task
     async with __pool.get() as conn:
         if not autocommit:
             # 如果不是自动提交事务,需要手动启动,但是我发现这个是可以省略的
@@ -82,6 +124,26 @@ async def execute(sql, args, autocommit=True):
         return affected
 
 
+# 模型变更的监听函数: (模型类, 事件) => [fn, ...], 事件为'save'、'update'、'remove'
+# 缓存、索引等需要跟随数据变化的模块通过add_listener()注册,写库成功后依次调用fn(obj)
+_listeners = dict()
+
+
+def add_listener(model, event, fn):
+    _listeners.setdefault((model, event), []).append(fn)
+
+
+async def notify(obj, event):
+    for fn in _listeners.get((obj.__class__, event), ()):
+        try:
+            r = fn(obj)
+            if asyncio.iscoroutine(r):
+                await r
+        except Exception:
+            # 数据已经写入,监听函数出错不应该让这次写操作失败
+            logging.exception('listener %s for %s.%s failed' % (fn, obj.__class__.__name__, event))
+
+
 # 创建拥有几个占位符的字符串
 def create_args_string(num):
     L = []
@@ -146,9 +208,11 @@ class ModelMetaclass(type):
         # 如果是基类对象,不做处理,因为没有字段名,没什么可处理的
         if name == 'Model':
             return type.__new__(cls, name, bases, attrs)
+        start = time.perf_counter()
         # 保存表名,如果获取不到,则把类名当做表名,完美利用了or短路原理
         tableName = attrs.get('__table__', None) or name
-        logging.info('found model: %s (table: %s)' % (name, tableName))
+        # 用logging自己的参数格式化,日志级别被调高时(如fast start)省掉字符串拼接
+        logging.info('found model: %s (table: %s)', name, tableName)
         # 保存列类型的对象
         mappings = dict()
         # 保存列名的数组
@@ -158,7 +222,7 @@ class ModelMetaclass(type):
         for k, v in attrs.items():
             # 是列名的就保存下来
             if isinstance(v, Field):
-                logging.info('  found mapping: %s ==> %s' % (k, v))
+                logging.info('  found mapping: %s ==> %s', k, v)
                 mappings[k] = v
                 if v.primary_key:
                     # 找到主键:
@@ -186,7 +250,9 @@ class ModelMetaclass(type):
                               % (tableName, ', '.join(map(lambda f: '`%s`=?'
                                                                     % (mappings.get(f).name or f), fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey)
-        return type.__new__(cls, name, bases, attrs)
+        model = type.__new__(cls, name, bases, attrs)
+        startup.record('model', name, time.perf_counter() - start)
+        return model
 
 
 # 这是模型的基类,继承于dict,
@@ -277,6 +343,8 @@ class Model(dict, metaclass=ModelMetaclass):
         rows = await execute(self.__insert__, args)
         if rows != 1:
             logging.warn('failed to insert record: affected rows: %s' % rows)
+        else:
+            await notify(self, 'save')
 
     async def update(self):
         args = list(map(self.getValue, self.__fields__))
@@ -284,12 +352,16 @@ class Model(dict, metaclass=ModelMetaclass):
         rows = await execute(self.__update__, args)
         if rows != 1:
             logging.warn('failed to update by primary key: affected rows: %s' % rows)
+        else:
+            await notify(self, 'update')
 
     async def remove(self):
         args = [self.getValue(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
         if rows != 1:
             logging.warn('failed to remove by primary key: affected rows: %s' % rows)
+        else:
+            await notify(self, 'remove')
 
 
 '''# 以下为测试
@@ -43,5 +43,29 @@ create table comments (
     `content` mediumtext not null,
     `created_at` real not null,
     key `idx_created_at` (`created_at`),
+    key `idx_blog_id_created_at` (`blog_id`, `created_at`, `id`),
     primary key (`id`)
-) engine=innodb default charset=utf8;
\ No newline at end of file
+) engine=innodb default charset=utf8;
+
+create table counters (
+    `name` varchar(50) not null,
+    `key` varchar(50) not null,
+    `value` bigint not null,
+    primary key (`name`, `key`)
+) engine=innodb default charset=utf8;
+
+-- 已有数据时初始化每篇博客的评论数，之后由程序增量维护:
+-- insert into counters (`name`, `key`, `value`) select 'blog_comments', `blog_id`, count(`id`) from comments group by `blog_id`;
+
+create table jobs (
+    `id` varchar(50) not null,
+    `name` varchar(50) not null,
+    `args` mediumtext not null,
+    `status` varchar(10) not null,
+    `attempts` bigint not null,
+    `run_at` real not null,
+    `error` mediumtext,
+    `created_at` real not null,
+    key `idx_status_run_at` (`status`, `run_at`),
+    primary key (`id`)
+) engine=innodb default charset=utf8;
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-process full-text search over blogs and comments.
+
+Latin text is split into lowercase words, CJK text into single characters plus bigrams,
+so a Chinese query matches without a dictionary. Documents are ranked with BM25.
+The index is kept up to date through orm listeners and saved to a file that is
+memory-mapped on restart, postings are only decoded when a query or update touches them.
+A file saved on a clean shutdown is reconciled with the database on startup (rows added or
+removed meanwhile, e.g. by another worker); any other file may lack updates and is rebuilt.
+'''
+
+import asyncio, json, logging, math, mmap, os, re, struct
+
+import orm
+from models import Blog, Comment
+
+_TOKEN_RE = re.compile(r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+
+# 文件格式：MAGIC + meta长度 + meta(json) + postings，每条posting是(文档编号, 权重)
+MAGIC = b'AWSIDX1\n'
+_HEADER = struct.Struct('<Q')
+_POSTING = struct.Struct('<If')
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text, query=False):
+    '''
+    Split text into terms. CJK runs produce every character and every bigram when indexing;
+    a query only uses bigrams for runs longer than one character.
+    '''
+    for m in _TOKEN_RE.finditer(text.lower()):
+        w = m.group()
+        if w[0] < '\u3040':
+            yield w
+            continue
+        if len(w) == 1:
+            yield w
+            continue
+        if not query:
+            for c in w:
+                yield c
+        for i in range(len(w) - 1):
+            yield w[i:i + 2]
+
+
+class SearchIndex(object):
+
+    def __init__(self):
+        self._docs = []  # 文档编号 => [key, length, extra]
+        self._doc_num = dict()  # key => 文档编号
+        self._deleted = set()  # 已删除或被更新替换的文档编号，保存时才真正清理
+        self._total_len = 0
+        self._postings = dict()  # term => {文档编号: 权重}，已经在内存里的
+        self._mapped = dict()  # term => (offset, count)，还在mmap文件里没有解码的
+        self._mm = None
+        self._base = 0
+        self._version = 0  # 每次add/remove加一，用来判断异步保存期间有没有更新
+        self._shared = set()  # 保存线程正在读的postings，add()修改前先复制一份
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._doc_num)
+
+    def _get(self, term):
+        p = self._postings.get(term)
+        if p is None:
+            loc = self._mapped.pop(term, None)
+            if loc is None:
+                return None
+            start = self._base + loc[0]
+            p = self._postings[term] = dict(_POSTING.iter_unpack(self._mm[start:start + loc[1] * _POSTING.size]))
+        return p
+
+    def add(self, key, fields, extra=''):
+        '''
+        Index a document, fields is a list of (text, weight). Re-adding a key replaces it.
+        '''
+        self.remove(key)
+        tf = dict()
+        length = 0
+        for text, weight in fields:
+            for term in tokenize(text or ''):
+                tf[term] = tf.get(term, 0) + weight
+                length += 1
+        num = len(self._docs)
+        self._docs.append([key, length, extra])
+        self._doc_num[key] = num
+        self._total_len += length
+        for term, w in tf.items():
+            p = self._get(term)
+            if p is None:
+                p = self._postings[term] = dict()
+            elif term in self._shared:
+                p = self._postings[term] = dict(p)
+                self._shared.discard(term)
+            p[num] = w
+        self._version += 1
+        self.dirty = True
+
+    def remove(self, key):
+        num = self._doc_num.pop(key, None)
+        if num is not None:
+            self._deleted.add(num)
+            self._total_len -= self._docs[num][1]
+            self._version += 1
+            self.dirty = True
+
+    def search(self, q, limit=20):
+        terms = set(tokenize(q, query=True))
+        n = len(self._doc_num)
+        if not terms or n == 0:
+            return []
+        avg_len = self._total_len / n or 1
+        scores = dict()
+        for term in terms:
+            p = self._get(term)
+            if not p:
+                continue
+            live = [(num, tf) for num, tf in p.items() if num not in self._deleted]
+            if not live:
+                continue
+            idf = math.log(1 + (n - len(live) + 0.5) / (len(live) + 0.5))
+            for num, tf in live:
+                norm = tf + K1 * (1 - B + B * self._docs[num][1] / avg_len)
+                scores[num] = scores.get(num, 0) + idf * tf * (K1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda x: -x[1])[:limit]
+        return [(self._docs[num][0], self._docs[num][2], score) for num, score in ranked]
+
+    def _freeze(self):
+        # 在事件循环里调用，只复制外层容器（和文档数、词数成正比），不解码也不复制postings；
+        # 之后add()要改的postings写时复制，保存线程读到的内容不会变
+        self._shared = set(self._postings)
+        return (list(self._docs), dict(self._doc_num), set(self._deleted), dict(self._postings),
+                dict(self._mapped), self._mm, self._base)
+
+    def _reload(self, path):
+        self.close()
+        self._load(path)
+        logging.info('search index saved: %s docs, %s terms => %s' % (len(self._docs), len(self._mapped), path))
+
+    def save(self, path):
+        try:
+            _write_file(path, *_serialize(*self._freeze()))
+        finally:
+            self._shared = set()
+        self._reload(path)
+
+    async def save_async(self, path):
+        '''
+        Like save(), but the postings are decoded, serialized and written in the default executor
+        so the event loop keeps serving.
+        '''
+        version = self._version
+        frozen = self._freeze()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, _save_frozen, path, frozen)
+        finally:
+            self._shared = set()
+        if self._version == version:
+            self._reload(path)
+        # 写文件期间又有更新：内存里的索引比文件新，保持dirty，下次再保存
+
+    def _load(self, path):
+        f = open(path, 'rb')
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise ValueError('not a search index file: %s' % path)
+            pos = len(MAGIC)
+            meta_len, = _HEADER.unpack_from(mm, pos)
+            pos += _HEADER.size
+            meta = json.loads(mm[pos:pos + meta_len].decode('utf-8'))
+            docs = meta['docs']
+            mapped = dict((term, tuple(loc)) for term, loc in meta['terms'].items())
+            # 文件被截断时postings不完整，查询时才发现就晚了，加载时就检查
+            size = len(mm) - pos - meta_len
+            for offset, count in mapped.values():
+                if offset + count * _POSTING.size > size:
+                    raise ValueError('truncated search index file: %s' % path)
+        except BaseException:
+            mm.close()
+            raise
+        self._mm = mm
+        self._base = pos + meta_len
+        self._docs = docs
+        self._doc_num = dict((doc[0], num) for num, doc in enumerate(self._docs))
+        self._deleted = set()
+        self._total_len = sum(doc[1] for doc in self._docs)
+        self._postings = dict()
+        self._mapped = mapped
+        self.dirty = False
+
+    def clear(self):
+        # 丢掉全部文档，保留对象本身（orm listener引用的是它）
+        self.close()
+        self.__init__()
+        self.dirty = True
+
+    def close(self):
+        if self._mm is not None:
+            for term in list(self._mapped):
+                self._get(term)
+            self._mm.close()
+            self._mm = None
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        index._load(path)
+        return index
+
+
+def _serialize(docs, doc_num, deleted, postings, mapped, mm, base):
+    # 按存活文档重新编号后序列化，返回(meta, postings)两段bytes；mmap里还没解码的postings在这里解码
+    renumber = dict()
+    live = []
+    for num, doc in enumerate(docs):
+        if num not in deleted and doc_num.get(doc[0]) == num:
+            renumber[num] = len(live)
+            live.append(doc)
+    terms = dict()
+    blob = bytearray()
+
+    def pack(term, p):
+        entries = [(renumber[num], w) for num, w in p if num in renumber]
+        if entries:
+            terms[term] = [len(blob), len(entries)]
+            for e in entries:
+                blob.extend(_POSTING.pack(*e))
+
+    for term, p in postings.items():
+        pack(term, p.items())
+    for term, (offset, count) in mapped.items():
+        if term not in postings:
+            start = base + offset
+            pack(term, _POSTING.iter_unpack(mm[start:start + count * _POSTING.size]))
+    meta = json.dumps(dict(docs=live, terms=terms), ensure_ascii=False).encode('utf-8')
+    return meta, bytes(blob)
+
+
+def _save_frozen(path, frozen):
+    _write_file(path, *_serialize(*frozen))
+
+
+def _write_file(path, meta, blob):
+    # 写入临时文件再原子替换，写到一半崩溃也不会留下损坏的索引文件
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER.pack(len(meta)))
+        f.write(meta)
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def index_blog(index, blog):
+    index.add('blog:%s' % blog.id, [(blog.name, 3), (blog.summary, 2), (blog.content, 1)], blog.name)
+
+
+def index_comment(index, comment):
+    index.add('comment:%s' % comment.id, [(comment.content, 1)], comment.blog_id)
+
+
+async def rebuild(index):
+    for blog in await Blog.findAll():
+        index_blog(index, blog)
+    for comment in await Comment.findAll():
+        index_comment(index, comment)
+    logging.info('search index built: %s docs' % len(index))
+
+
+async def reconcile(index, batch=500):
+    '''
+    Add rows missing from a loaded index and remove documents whose rows are gone.
+    Rows updated in place are not detected, which is why only a clean file is reconciled.
+    '''
+    added = removed = 0
+    for model, kind, add in ((Blog, 'blog', index_blog), (Comment, 'comment', index_comment)):
+        prefix = kind + ':'
+        rs = await orm.select('select `id` from `%s`' % model.__table__, [])
+        ids = set(r['id'] for r in rs)
+        for key in [k for k in index._doc_num if k.startswith(prefix) and k[len(prefix):] not in ids]:
+            index.remove(key)
+            removed += 1
+        missing = [id for id in ids if prefix + id not in index._doc_num]
+        for i in range(0, len(missing), batch):
+            chunk = missing[i:i + batch]
+            for row in await model.findAll('`id` in (%s)' % ', '.join(['?'] * len(chunk)), chunk):
+                add(index, row)
+                added += 1
+    logging.info('search index reconciled: %s added, %s removed' % (added, removed))
+
+
+def add_search(app, path='search.idx', save_interval=300):
+    '''
+    Load the index file (or rebuild from the database when it is missing),
+    keep it in sync with Blog/Comment writes and save it periodically and on cleanup.
+    A relative path is relative to this directory, not the working directory.
+    '''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    index = app['__search__'] = SearchIndex()
+    orm.add_listener(Blog, 'save', lambda b: index_blog(index, b))
+    orm.add_listener(Blog, 'update', lambda b: index_blog(index, b))
+    orm.add_listener(Blog, 'remove', lambda b: index.remove('blog:%s' % b.id))
+    orm.add_listener(Comment, 'save', lambda c: index_comment(index, c))
+    orm.add_listener(Comment, 'update', lambda c: index_comment(index, c))
+    orm.add_listener(Comment, 'remove', lambda c: index.remove('comment:%s' % c.id))
+
+    saver = []
+    writing = []
+
+    async def save_loop():
+        while True:
+            await asyncio.sleep(save_interval)
+            if index.dirty:
+                # shield：关闭时取消save_loop不会打断写了一半的文件，on_cleanup会等它写完
+                writing[:] = [asyncio.ensure_future(index.save_async(path))]
+                try:
+                    await asyncio.shield(writing[0])
+                except Exception:
+                    logging.exception('search index save failed: %s' % path)
+
+    # 正常关闭时保存完索引再创建这个文件，启动时马上删掉；之后进程崩溃的话它就不存在
+    clean_marker = path + '.clean'
+
+    async def on_startup(app):
+        loaded = False
+        clean = os.path.exists(clean_marker)
+        if clean:
+            os.remove(clean_marker)
+        if os.path.exists(path):
+            try:
+                index._load(path)
+                loaded = True
+                logging.info('search index loaded: %s docs from %s' % (len(index), path))
+            except Exception:
+                # 文件截断或损坏不能让服务起不来，从数据库重建并覆盖
+                logging.exception('search index %s is unreadable, rebuilding from the database' % path)
+        if loaded and not clean:
+            # 定期保存的文件：进程崩溃前最多save_interval秒的更新不在里面，而且无法知道改了哪些
+            logging.warning('search index %s was not saved on shutdown, rebuilding from the database' % path)
+            index.clear()
+            loaded = False
+        if loaded:
+            await reconcile(index)
+        else:
+            await rebuild(index)
+        if index.dirty:
+            index.save(path)
+        saver.append(asyncio.ensure_future(save_loop()))
+
+    async def on_cleanup(app):
+        for task in saver:
+            task.cancel()
+        if writing and not writing[0].done():
+            await asyncio.wait(writing)
+        if index.dirty:
+            index.save(path)
+        index.close()
+        open(clean_marker, 'w').close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return index
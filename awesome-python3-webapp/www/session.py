@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+' signed cookie sessions backed by an in-process user cache '
+
+import hashlib, hmac, logging, time
+
+import orm
+from cache import LRUCache
+from models import User
+
+_HEX = set('0123456789abcdef')
+
+
+class Session(object):
+
+    def __init__(self, uid, expires, user):
+        self.uid = uid
+        self.expires = expires
+        self.user = user
+
+
+class SessionStore(object):
+    '''
+    Cookie format: "uid-expires-signature", the signature is HMAC-SHA1 over uid, passwd and expires,
+    so changing the password invalidates every cookie issued before.
+    '''
+
+    def __init__(self, secret, name='awesession', max_age=86400, cache_size=10000, cache_ttl=300):
+        self.secret = secret.encode('utf-8')
+        self.name = name
+        self.max_age = max_age
+        # uid => (passwd, 去掉passwd的User)，命中时不需要查数据库；只缓存签名验证通过的用户
+        self.users = LRUCache(cache_size, cache_ttl)
+
+    def _sign(self, uid, passwd, expires):
+        s = '%s-%s-%s' % (uid, passwd, expires)
+        return hmac.new(self.secret, s.encode('utf-8'), hashlib.sha1).hexdigest()
+
+    def _remember(self, user):
+        # 交给请求和模板的User对象不带密码，密码只留在缓存里用来验证签名
+        masked = User(**user)
+        masked.passwd = '******'
+        self.users.set(user.id, (user.passwd, masked))
+        return masked
+
+    def cookie(self, user, max_age=None):
+        expires = str(int(time.time() + (max_age or self.max_age)))
+        return '-'.join([user.id, expires, self._sign(user.id, user.passwd, expires)])
+
+    async def load(self, cookie_str):
+        '''
+        Parse and verify the cookie, return a Session or None.
+        '''
+        if not cookie_str:
+            return None
+        L = cookie_str.split('-')
+        if len(L) != 3:
+            return None
+        uid, expires, sig = L
+        # 格式不对或者已过期的cookie不查缓存也不查数据库
+        if not uid or not expires.isdigit() or int(expires) < time.time():
+            return None
+        if len(sig) != 40 or not set(sig) <= _HEX:
+            return None
+        cached = self.users.get(uid)
+        if cached is not None:
+            passwd, user = cached
+        else:
+            user = await User.find(uid)
+            if user is None:
+                return None
+            passwd = user.passwd
+        if not hmac.compare_digest(sig, self._sign(uid, passwd, expires)):
+            logging.info('invalid session cookie for %s' % uid)
+            return None
+        if cached is None:
+            user = self._remember(user)
+        return Session(uid, int(expires), user)
+
+    def invalidate(self, user):
+        self.users.pop(user.id)
+
+    def login(self, response, user, max_age=None):
+        max_age = max_age or self.max_age
+        self._remember(user)
+        response.set_cookie(self.name, self.cookie(user, max_age), max_age=max_age, httponly=True)
+
+    def logout(self, response):
+        response.del_cookie(self.name)
+
+
+# 解析cookie，把session和当前用户绑定到request.__session__、request.__user__上
+async def auth_factory(app, handler):
+    store = app['__session__']
+
+    async def auth(request):
+        session = await store.load(request.cookies.get(store.name))
+        request.__session__ = session
+        request.__user__ = session.user if session else None
+        return (await handler(request))
+    return auth
+
+
+def add_session(app, **kw):
+    store = app['__session__'] = SessionStore(**kw)
+    # 用户资料变更或删除后，缓存里的旧对象必须作废
+    orm.add_listener(User, 'update', store.invalidate)
+    orm.add_listener(User, 'remove', store.invalidate)
+    return store
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+A local SQLite stand-in for the aiomysql pool used by orm, for benchmarks and offline runs.
+
+    pool = sqlite_pool.create_pool('bench.db')
+    sqlite_pool.create_tables(pool, [User, Blog, Comment])
+    orm.set_pool(pool)
+
+    sqlite_pool.seed('bench.db', users=100, blogs=1000, comments=10000)   # create all tables and fill them with random rows
+
+Queries run synchronously on the event loop thread, which is fine for a single-file local database.
+'''
+
+import random, re, sqlite3, time
+
+from models import User, Blog, Comment, Job, next_id
+
+# MySQL的upsert写法换成sqlite的: on duplicate key update ... values(`c`) => on conflict do update set ... excluded.`c`
+_UPSERT_RE = re.compile(r'on duplicate key update', re.I)
+_VALUES_RE = re.compile(r'values\((`\w+`)\)', re.I)
+
+
+def _translate(sql):
+    sql = sql.replace('%s', '?')
+    m = _UPSERT_RE.search(sql)
+    if m is not None:
+        sql = sql[:m.start()] + 'on conflict do update set' + _VALUES_RE.sub(r'excluded.\1', sql[m.end():])
+    return sql
+
+
+class _Cursor(object):
+
+    def __init__(self, conn):
+        self._cur = conn.cursor()
+        self.rowcount = -1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._cur.close()
+
+    async def execute(self, sql, args=()):
+        # orm已经把?换成了MySQL的%s，这里再换回sqlite的?
+        self._cur.execute(_translate(sql), tuple(args or ()))
+        self.rowcount = self._cur.rowcount
+
+    async def executemany(self, sql, seq_of_args):
+        self._cur.executemany(_translate(sql), seq_of_args)
+        self.rowcount = self._cur.rowcount
+
+    async def fetchall(self):
+        return [dict(r) for r in self._cur.fetchall()]
+
+    async def fetchmany(self, size):
+        return [dict(r) for r in self._cur.fetchmany(size)]
+
+
+class _Connection(object):
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    async def __aenter__(self):
+        self._pool.freesize -= 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self._pool.freesize += 1
+
+    def cursor(self, *args):
+        # 参数是aiomysql.DictCursor，sqlite用row_factory达到同样的效果
+        return _Cursor(self._conn)
+
+    async def begin(self):
+        self._conn.execute('begin')
+
+    async def commit(self):
+        self._conn.commit()
+
+    async def rollback(self):
+        self._conn.rollback()
+
+
+class Pool(object):
+    '''
+    Looks like an aiomysql pool of one connection: acquire()/get(), size/freesize, close()/wait_closed().
+    '''
+
+    def __init__(self, database):
+        self._conn = sqlite3.connect(database, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # 所有协程共用一个连接，freesize可能为负，只用于监控
+        self.size = self.maxsize = self.freesize = 1
+        self.closed = False
+
+    def acquire(self):
+        return _Connection(self, self._conn)
+
+    get = acquire
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        self._conn.close()
+
+
+def create_pool(database=':memory:'):
+    return Pool(database)
+
+
+def create_tables(pool, models):
+    for m in models:
+        cols = ['`%s` %s%s' % (k, f.column_type, ' primary key' if f.primary_key else '')
+                for k, f in m.__mappings__.items()]
+        pool._conn.execute('create table if not exists `%s` (%s)' % (m.__table__, ', '.join(cols)))
+
+
+def insert_many(pool, model, rows):
+    '''
+    Bulk insert dict rows (all model fields required), bypassing orm for fast seeding.
+    '''
+    names = [model.__primary_key__] + model.__fields__
+    sql = 'insert into `%s` (%s) values (%s)' % (
+        model.__table__, ', '.join('`%s`' % n for n in names), ', '.join('?' * len(names)))
+    pool._conn.execute('begin')
+    pool._conn.executemany(sql, [tuple(r[n] for n in names) for r in rows])
+    pool._conn.execute('commit')
+
+
+def seed(path, users, blogs, comments):
+    '''
+    Create all tables in a SQLite file and fill it with random users, blogs and comments.
+    '''
+    pool = create_pool(path)
+    create_tables(pool, [User, Blog, Comment, Job])
+    pool._conn.execute('create table if not exists `counters` (`name` varchar(50), `key` varchar(50), `value` bigint, '
+                       'primary key (`name`, `key`))')
+    now = time.time()
+    U = [dict(id=next_id(), email='u%d@example.com' % i, passwd='x' * 40, admin=False,
+              name='user%d' % i, image='about:blank', created_at=now - i) for i in range(users)]
+    B = []
+    for i in range(blogs):
+        u = random.choice(U)
+        B.append(dict(id=next_id(), user_id=u['id'], user_name=u['name'], user_image=u['image'],
+                      name='blog %d' % i, summary='summary %d' % i, content='内容' * 500, created_at=now - i * 60))
+    C = []
+    for i in range(comments):
+        u, b = random.choice(U), random.choice(B)
+        C.append(dict(id=next_id(), blog_id=b['id'], user_id=u['id'], user_name=u['name'],
+                      user_image=u['image'], content='comment %d' % i, created_at=now - i))
+    insert_many(pool, User, U)
+    insert_many(pool, Blog, B)
+    insert_many(pool, Comment, C)
+    pool._conn.execute("insert into `counters` select 'blog_comments', `blog_id`, count(`id`) from `comments` group by `blog_id`")
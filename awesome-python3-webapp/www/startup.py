@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Startup profiler and fast-start switches.
+
+    python3 app.py --profile-startup   # print time per import, model, route and pool connect
+    python3 app.py --fast-start        # listen first, warm the pool and templates afterwards
+'''
+
+import builtins, contextlib, os, sys, time
+
+# 命令行参数或环境变量，需要在导入其他模块之前就能判断
+FAST_START = '--fast-start' in sys.argv or os.environ.get('AWESOME_FAST_START') == '1'
+PROFILE_STARTUP = '--profile-startup' in sys.argv or os.environ.get('AWESOME_PROFILE_STARTUP') == '1'
+
+
+class StartupProfiler(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []  # (kind, name, seconds)
+        self._start = time.perf_counter()
+        self._real_import = None
+
+    def record(self, kind, name, seconds):
+        if self.enabled:
+            self.records.append((kind, name, seconds))
+
+    @contextlib.contextmanager
+    def phase(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    def track_imports(self):
+        '''
+        Time every first-time import from now on, nested imports are indented under their parent.
+        '''
+        real_import = self._real_import = builtins.__import__
+        depth = [0]
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            # 已导入的模块和相对导入直接放过，热路径上只多一次dict查找
+            if level or name in sys.modules:
+                return real_import(name, globals, locals, fromlist, level)
+            indent = '  ' * depth[0]
+            depth[0] += 1
+            start = time.perf_counter()
+            try:
+                return real_import(name, globals, locals, fromlist, level)
+            finally:
+                depth[0] -= 1
+                self.record('import', indent + name, time.perf_counter() - start)
+        builtins.__import__ = timed_import
+
+    def untrack_imports(self):
+        if self._real_import is not None:
+            builtins.__import__ = self._real_import
+            self._real_import = None
+
+    def report(self, limit=15):
+        L = ['startup profile: %.1f ms total' % ((time.perf_counter() - self._start) * 1000)]
+        for kind in ('import', 'model', 'route', 'pool', 'phase'):
+            rs = [r for r in self.records if r[0] == kind]
+            if not rs:
+                continue
+            L.append('  %s: %d, %.1f ms' % (kind, len(rs), sum(r[2] for r in rs if not r[1].startswith(' ')) * 1000))
+            # import按发生顺序列出以保留层级，其余按耗时排序
+            if kind != 'import':
+                rs = sorted(rs, key=lambda r: -r[2])
+            else:
+                rs = [r for r in rs if r[2] * 1000 >= 1]
+            for r in (rs if kind == 'import' else rs[:limit]):
+                L.append('    %8.2f ms  %s' % (r[2] * 1000, r[1]))
+        return '\n'.join(L)
+
+
+profiler = StartupProfiler()
+record = profiler.record
+phase = profiler.phase
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Jinja2 fragment cache:
+
+    {% cache ('blog', blog.id, blog.created_at), 60 %}
+        ...
+    {% endcache %}
+
+The rendered body is stored under the key for ttl seconds (omit ttl to keep it until evicted).
+'''
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from cache import LRUCache
+
+
+class FragmentCacheExtension(Extension):
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        # 默认的存储，init_jinja2里可以替换成别的大小
+        environment.extend(fragment_cache=LRUCache(1000))
+
+    def parse(self, parser):
+        # 第一个token是'cache'本身，记下行号用于报错
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        if isinstance(key, list):
+            key = tuple(key)
+        cache = self.environment.fragment_cache
+        rv = cache.get(key)
+        if rv is None:
+            rv = caller()
+            cache.set(key, rv, ttl)
+        return rv
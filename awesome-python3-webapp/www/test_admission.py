@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from admission import Admission, Limiter, Overloaded, TokenBucket, admission_factory
+
+
+def test_token_bucket_caps_clients():
+    buckets = TokenBucket(rate=0.001, burst=2, maxclients=100)
+    # 每个客户端都用掉了令牌，桶都没回满，也不能超过maxclients
+    for i in range(1000):
+        assert buckets.take(i) == 0
+        assert len(buckets._buckets) <= 100
+    # 最近用过的客户端保留自己的桶，令牌用完就要等
+    waits = []
+    for i in range(200):
+        waits.append(buckets.take('hot'))
+        buckets.take(i + 1000)
+    assert waits[:2] == [0, 0] and all(w > 0 for w in waits[2:])
+    assert 'hot' in buckets._buckets and 0 not in buckets._buckets
+
+
+def test_limiter_queue_limit_and_priority():
+    async def main():
+        limiter = Limiter(concurrency=1, queue=2)
+        await limiter.acquire()
+        order = []
+
+        async def wait(priority, name):
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        waiters = [asyncio.ensure_future(wait(1, 'low')), asyncio.ensure_future(wait(0, 'high'))]
+        await asyncio.sleep(0)
+        assert limiter.waiting == 2
+        # 队列满了马上拒绝，不再排队
+        with pytest.raises(Overloaded):
+            await limiter.acquire()
+        limiter.release()
+        await asyncio.gather(*waiters)
+        assert order == ['high', 'low']
+        assert limiter.active == 0 and limiter.waiting == 0
+
+    asyncio.run(main())
+
+
+def test_limiter_timeout_gives_up_its_place():
+    async def main():
+        limiter = Limiter(concurrency=1, queue=5)
+        await limiter.acquire()
+        with pytest.raises(Overloaded):
+            await limiter.acquire(timeout=0.05)
+        assert limiter.waiting == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_admission_sheds_and_releases_on_errors():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(request):
+            if request.path == '/boom':
+                raise ValueError('boom')
+            await gate.wait()
+            return web.Response(text='ok')
+
+        admission = Admission(concurrency=1, queue=1, timeout=5, retry_after=7,
+                              rules=[dict(prefix='/api/', concurrency=1, queue=0)])
+        admit = await admission_factory({'__admission__': admission}, handler)
+        first = asyncio.ensure_future(admit(make_mocked_request('GET', '/api/a')))
+        await asyncio.sleep(0)
+        # /api/只允许1个并发且不排队，第二个马上503
+        r = await admit(make_mocked_request('GET', '/api/b'))
+        assert r.status == 503 and r.headers['Retry-After'] == '7'
+        # 全局还能排1个，再多的也503
+        queued = asyncio.ensure_future(admit(make_mocked_request('GET', '/page')))
+        await asyncio.sleep(0)
+        r = await admit(make_mocked_request('GET', '/other'))
+        assert r.status == 503 and admission.rejected == 2
+        gate.set()
+        assert (await first).status == 200 and (await queued).status == 200
+        # handler抛异常后名额也要还回去
+        for i in range(3):
+            with pytest.raises(ValueError):
+                await admit(make_mocked_request('GET', '/boom'))
+        assert admission.limiter.active == 0 and admission.rules[0].limiter.active == 0
+        assert (await admit(make_mocked_request('GET', '/api/c'))).status == 200
+
+    asyncio.run(main())
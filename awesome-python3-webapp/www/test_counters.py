@@ -0,0 +1,22 @@
+import asyncio
+
+import orm
+from counters import BufferedCounter
+
+
+def test_flush_keeps_cache_expiry(db):
+    async def main():
+        counter = BufferedCounter('views', cache_ttl=0.3)
+        counter.incr('k')
+        await counter.flush()
+        assert await counter.get('k') == 1
+        # 另一个worker写进去的增量
+        await orm.execute('update `counters` set `value`=`value`+100 where `name`=? and `key`=?', ['views', 'k'])
+        # 热点key每次写库时都在缓存里，写库不能让它一直不过期
+        for i in range(20):
+            counter.incr('k')
+            await counter.flush()
+            await asyncio.sleep(0.05)
+        assert await counter.get('k') == 121
+
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import asyncio
+
+import orm
+from feeds import Feeds
+from models import Blog
+
+
+def _blog(i, created_at):
+    return Blog(id='b%03d' % i, user_id='u', user_name='user', user_image='', name='blog %d' % i,
+                summary='summary', content='', created_at=created_at)
+
+
+def test_remove_bumps_validators(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr('feeds.time.time', lambda: now[0])
+    feeds = Feeds('http://example.com', 'Test', size=5, shard_size=4)
+    blogs = [_blog(i, 1000 + i) for i in range(10)]
+    feeds.load(blogs[-5:], [(b.id, b.created_at) for b in blogs])
+    now[0] += 10
+    feeds.on_blog(blogs[-1])
+    before = [feeds.atom(), feeds.rss(), feeds.sitemap(), feeds.sitemap(2)]
+    # 删掉最近修改过的那篇，剩下的内容都比它旧，Last-Modified和ETag仍然要前进
+    now[0] += 10
+    feeds.on_remove(blogs[-1])
+    after = [feeds.atom(), feeds.rss(), feeds.sitemap(), feeds.sitemap(2)]
+    for old, new in zip(before, after):
+        assert new.last_modified > old.last_modified
+        assert new.etag != old.etag
+    # 删除只影响它所在和之后的分片
+    assert feeds.sitemap(0).last_modified == 1003
+
+
+def test_remove_refills_feed_from_db(db):
+    async def main():
+        blogs = await Blog.findAll(orderBy='`created_at` desc')
+        feeds = Feeds('http://example.com', 'Test', size=5)
+        feeds.load(blogs[:5], [(b.id, b.created_at) for b in blogs])
+        before = feeds.atom()
+        # 删掉订阅里的一篇，下一篇更早的博客补进来
+        await orm.execute('delete from `blogs` where `id`=?', [blogs[1].id])
+        assert feeds.on_remove(blogs[1])
+        await feeds.refill()
+        ids = [b.id for b in blogs[:1] + blogs[2:6]]
+        assert sorted(feeds._entries) == sorted(ids)
+        assert feeds.atom().body.count(b'<entry>') == 5
+        assert b'blog 5' in feeds.atom().body and feeds.atom().etag != before.etag
+        # 不在订阅里的博客删掉后不需要补
+        await orm.execute('delete from `blogs` where `id`=?', [blogs[9].id])
+        assert not feeds.on_remove(blogs[9])
+
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+'''
+Run the app against the seeded SQLite stand-in and call the JSON APIs over HTTP.
+'''
+
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer, make_mocked_request
+
+from coroweb import RequestHandler
+
+
+@pytest.fixture(scope='module')
+def client(make_db, tmp_path_factory):
+    import app
+    tmp = tmp_path_factory.mktemp('www')
+    make_db(users=5, blogs=150, comments=300)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # 搜索索引默认保存在www目录下，测试时放到临时目录里
+    mp = pytest.MonkeyPatch()
+    mp.setitem(app.configs.search, 'path', str(tmp / 'search.idx'))
+    application = app.create_app(loop, str(tmp))
+    c = TestClient(TestServer(application), loop=loop)
+    loop.run_until_complete(c.start_server())
+
+    def get(path):
+        async def fetch():
+            resp = await c.get(path)
+            if resp.content_type != 'application/json':
+                return resp.status, await resp.text()
+            return resp.status, await resp.json()
+        return loop.run_until_complete(fetch())
+
+    get.app = application
+    yield get
+    loop.run_until_complete(c.close())
+    # cleanup里取消的后台任务（计数器、任务队列）还要再跑一轮才真正结束
+    loop.run_until_complete(asyncio.sleep(0.1))
+    mp.undo()
+    loop.close()
+
+
+def test_api_blogs_limit(client):
+    status, r = client('/api/blogs?limit=5')
+    assert status == 200 and len(r['blogs']) == 5
+    assert all('comments' in b for b in r['blogs'])
+    # 超过上限的截到100，0和负数至少返回1条，不会把LIMIT -n交给数据库
+    assert len(client('/api/blogs?limit=500')[1]['blogs']) == 100
+    assert len(client('/api/blogs?limit=0')[1]['blogs']) == 1
+    assert len(client('/api/blogs?limit=-5')[1]['blogs']) == 1
+
+
+def test_api_blogs_bad_limit(client):
+    status, r = client('/api/blogs?limit=abc')
+    assert status == 200
+    assert r['error'] == 'value:invalid' and r['data'] == 'limit'
+
+
+def test_api_search_limit(client):
+    status, r = client('/api/search?q=blog&limit=abc')
+    assert r['error'] == 'value:invalid' and r['data'] == 'limit'
+    assert len(client('/api/search?q=blog&limit=-1')[1]['results']) == 1
+    assert len(client('/api/search?q=blog&limit=3')[1]['results']) == 3
+    # 没有q参数时返回空结果，不是500
+    assert client('/api/search') == (200, dict(results=[]))
+
+
+def test_missing_argument_is_400():
+    async def fn(*, q):
+        return dict(q=q)
+
+    async def call(path):
+        return await RequestHandler(None, fn)(make_mocked_request('GET', path))
+
+    r = asyncio.run(call('/x'))
+    assert r.status == 400 and r.text == 'Missing argument: q'
+    assert asyncio.run(call('/x?q=1')) == dict(q='1')
+
+
+def test_api_blog_comments_pagination(client):
+    blog = max(client('/api/blogs?limit=100')[1]['blogs'], key=lambda b: b['comments'])
+    assert blog['comments'] > 1
+    status, r = client('/api/blogs/%s/comments?limit=abc' % blog['id'])
+    assert r['error'] == 'value:invalid' and r['data'] == 'limit'
+    status, r = client('/api/blogs/%s/comments?cursor=%%21%%21' % blog['id'])
+    assert r['error'] == 'value:invalid' and r['data'] == 'cursor'
+    # 一条一条翻页，拿到的评论和一次取完的一样，数量和计数器一致
+    seen = []
+    cursor = ''
+    while True:
+        r = client('/api/blogs/%s/comments?limit=-3&cursor=%s' % (blog['id'], cursor))[1]
+        seen.extend(c['id'] for c in r['comments'])
+        if not r['next']:
+            break
+        cursor = r['next']
+    all_ids = [c['id'] for c in client('/api/blogs/%s/comments?limit=100' % blog['id'])[1]['comments']]
+    assert seen == all_ids and len(seen) == r['count'] == blog['comments']
+
+
+def test_unmatched_requests_share_one_metrics_entry(client):
+    metrics = client.app['__metrics__']
+    for i in range(20):
+        client('/no/such/page/%d' % i)
+    # 每个404都是新的SystemRoute，不能各占一个缓存项
+    routes = len(metrics._by_route)
+    client('/no/such/page')
+    assert len(metrics._by_route) == routes
+    assert metrics._stats[('GET', '<unmatched>')].responses[404] == 21
+    text = metrics.render()
+    for name in ('size', 'used', 'free', 'maxsize'):
+        assert '# HELP orm_pool_%s ' % name in text
+
+
+def test_requests_wait_until_ready(make_db, tmp_path, monkeypatch):
+    import app
+    make_db(users=2, blogs=3, comments=0)
+    monkeypatch.setitem(app.configs.search, 'path', str(tmp_path / 'search.idx'))
+
+    async def main():
+        application = app.create_app(asyncio.get_running_loop(), str(tmp_path), hold_until_ready=True)
+        async with TestClient(TestServer(application)) as c:
+            # fast start：端口已经打开，on_startup还没算完
+            fetch = asyncio.ensure_future(c.get('/api/blogs'))
+            await asyncio.sleep(0.2)
+            assert not fetch.done()
+            application['__ready__'].set()
+            resp = await asyncio.wait_for(fetch, 5)
+            assert len((await resp.json())['blogs']) == 3
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
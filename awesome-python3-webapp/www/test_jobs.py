@@ -0,0 +1,56 @@
+import asyncio, time
+
+import orm
+from jobs import JobQueue, task
+from models import Job
+
+
+CALLS = []
+
+
+@task()
+async def hang():
+    CALLS.append(1)
+    await asyncio.sleep(3600)
+
+
+@task()
+async def boom():
+    raise RuntimeError('boom')
+
+
+def test_expired_lease_counts_as_attempt(db):
+    async def main():
+        queue = JobQueue(max_attempts=3, lease=300)
+        queue.add_tasks(__name__)
+        job = await queue.enqueue('hang')
+        for i in range(5):
+            await queue._dispatch()
+            await asyncio.sleep(0)
+            # 模拟进程崩溃：任务没有结果，行还是running，等租约过期
+            for j, t in list(queue._running.values()):
+                t.cancel()
+            await asyncio.sleep(0)
+            await orm.execute('update `jobs` set `run_at`=? where `id`=?', [time.time() - 1, job.id])
+        job = await Job.find(job.id)
+        # 第一次领取加两次租约过期后重领，第三次过期时进入failed，不再执行
+        assert len(CALLS) == 3
+        assert job.status == 'failed' and job.attempts == 3
+        assert 'lease expired' in job.error
+
+    asyncio.run(main())
+
+
+def test_failed_job_dead_letters(db):
+    async def main():
+        queue = JobQueue(max_attempts=2, backoff=0)
+        queue.add_tasks(__name__)
+        job = await queue.enqueue('boom')
+        for i in range(3):
+            await queue._dispatch()
+            await asyncio.gather(*(t for j, t in list(queue._running.values())))
+        job = await Job.find(job.id)
+        assert job.status == 'failed' and job.attempts == 2
+        assert 'RuntimeError: boom' in job.error
+
+    asyncio.run(main())
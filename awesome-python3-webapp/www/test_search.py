@@ -0,0 +1,158 @@
+import asyncio, os
+
+import pytest
+from aiohttp import web
+
+import orm
+from models import Blog, Comment
+from search import SearchIndex, add_search
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index = SearchIndex()
+    index.add('blog:1', [('Python asyncio 教程', 1)], 'a')
+    index.add('blog:2', [('Rust ownership', 1)], 'b')
+    index.save(path)
+    loaded = SearchIndex.load(path)
+    assert [r[0] for r in loaded.search('asyncio')] == ['blog:1']
+    assert [r[0] for r in loaded.search('教程')] == ['blog:1']
+    loaded.close()
+    index.close()
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index = SearchIndex()
+    for i in range(50):
+        index.add('blog:%d' % i, [('word%d common' % i, 1)])
+    index.save(path)
+    index.close()
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-20])
+    with pytest.raises(ValueError):
+        SearchIndex.load(path)
+
+
+def test_save_async_keeps_updates_made_while_writing(tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index = SearchIndex()
+    index.add('blog:1', [('first', 1)])
+
+    async def run():
+        t = asyncio.ensure_future(index.save_async(path))
+        await asyncio.sleep(0)
+        # 文件在线程里写的时候事件循环还在处理更新
+        index.add('blog:2', [('second', 1)])
+        await t
+
+    asyncio.run(run())
+    assert index.dirty
+    assert [r[0] for r in index.search('second')] == ['blog:2']
+    index.save(path)
+    assert not index.dirty
+    assert SearchIndex.load(path).search('second')[0][0] == 'blog:2'
+    index.close()
+
+
+def test_corrupt_file_is_rebuilt_on_startup(db, tmp_path):
+    path = str(tmp_path / 'search.idx')
+    with open(path, 'wb') as f:
+        f.write(b'AWSIDX1\n\x05')
+    app = web.Application()
+    index = add_search(app, path=path)
+
+    async def run():
+        for f in app.on_startup:
+            await f(app)
+        assert len(index) == 15
+        for f in app.on_cleanup:
+            await f(app)
+
+    asyncio.run(run())
+    assert len(SearchIndex.load(path)) == 15
+
+
+def test_save_async_copies_postings_changed_while_writing(tmp_path):
+    path = str(tmp_path / 'search.idx')
+    index = SearchIndex()
+    for i in range(200):
+        index.add('blog:%d' % i, [('common word%d' % i, 1)])
+    index.save(path)
+    # 一半postings还在mmap里，一半已经解码到内存
+    index.add('blog:new', [('common fresh', 1)])
+
+    async def run():
+        t = asyncio.ensure_future(index.save_async(path))
+        await asyncio.sleep(0)
+        # 保存线程正在读'common'的postings时又往里加文档
+        for i in range(100):
+            index.add('blog:late%d' % i, [('common late', 1)])
+        await t
+
+    asyncio.run(run())
+    assert len(index.search('common', 1000)) == 301
+    saved = SearchIndex.load(path)
+    # 文件里是开始保存那一刻的状态
+    assert len(saved.search('common', 1000)) == 201
+    assert [r[0] for r in saved.search('word7')] == ['blog:7']
+    saved.close()
+    index.save(path)
+    assert len(SearchIndex.load(path).search('common', 1000)) == 301
+    index.close()
+
+
+def _start_and_stop(path, check):
+    app = web.Application()
+    index = add_search(app, path=path)
+
+    async def run():
+        for f in app.on_startup:
+            await f(app)
+        await check(index)
+        for f in app.on_cleanup:
+            await f(app)
+
+    asyncio.run(run())
+
+
+def test_clean_file_is_reconciled_and_unclean_file_rebuilt(db, tmp_path):
+    path = str(tmp_path / 'search.idx')
+
+    async def built(index):
+        assert len(index) == 15
+
+    _start_and_stop(path, built)
+    assert os.path.exists(path + '.clean')
+
+    async def change_db():
+        # 模拟其他worker在这期间写数据库：新增一篇博客、删掉一条评论、改一篇博客的标题
+        blog = (await Blog.findAll(limit=1))[0]
+        await orm.execute('insert into `blogs` (`id`, `user_id`, `user_name`, `user_image`, `name`, `summary`, '
+                          '`content`, `created_at`) values (?, ?, ?, ?, ?, ?, ?, ?)',
+                          ['added', blog.user_id, 'u', '', 'brandnew', 's', 'c', 0])
+        comment = (await Comment.findAll(limit=1))[0]
+        await orm.execute('delete from `comments` where `id`=?', [comment.id])
+        await orm.execute('update `blogs` set `name`=? where `id`=?', ['retitled', blog.id])
+        return comment
+
+    comment = asyncio.run(change_db())
+
+    async def reconciled(index):
+        assert len(index) == 15
+        assert [r[0] for r in index.search('brandnew')] == ['blog:added']
+        assert 'comment:%s' % comment.id not in index._doc_num
+        # 原地更新看不出来，正常关闭的文件也只补增删
+        assert index.search('retitled') == []
+
+    _start_and_stop(path, reconciled)
+    # 模拟运行中崩溃：没有正常关闭的标记，启动时整个重建，更新也能查到
+    os.remove(path + '.clean')
+
+    async def rebuilt(index):
+        assert len(index) == 15
+        assert len(index.search('retitled')) == 1
+
+    _start_and_stop(path, rebuilt)
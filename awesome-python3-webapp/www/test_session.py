@@ -0,0 +1,27 @@
+import asyncio, time
+
+from models import User
+from session import SessionStore
+
+
+def test_load_verifies_before_caching(db):
+    async def main():
+        user = (await User.findAll())[0]
+        store = SessionStore('secret')
+        cookie = store.cookie(user)
+        uid, expires, sig = cookie.split('-')
+        # 签名不对、已过期、格式不对的cookie都不会把用户放进缓存
+        assert await store.load('%s-%s-%s' % (uid, expires, 'f' * 40)) is None
+        assert await store.load('%s-%d-%s' % (uid, time.time() - 5, sig)) is None
+        assert await store.load('%s-%s-%s' % (uid, expires, 'not-hex')) is None
+        assert len(store.users) == 0
+        for i in range(2):
+            session = await store.load(cookie)
+            assert session.uid == uid and session.user.name == user.name
+            assert session.user.passwd == '******'
+        assert len(store.users) == 1
+        # 缓存命中时仍然验证签名
+        assert await store.load('%s-%s-%s' % (uid, expires, 'f' * 40)) is None
+        assert user.passwd != '******'
+
+    asyncio.run(main())